@@ -0,0 +1,241 @@
+# Benchmarks der Rechen-, Simulations-, Diagramm- und PDF-Stufen
+#
+# Aufruf:
+#   python tools/benchmark.py [--output bench_results.json] [--only protocol]
+#   python tools/benchmark.py --save-baseline tools/benchmark_baseline.json
+#   python tools/benchmark.py --baseline tools/benchmark_baseline.json --threshold 0.25
+#
+# Läuft ohne Streamlit-Server. Für jeden Fall werden Laufzeit (Median und
+# Minimum über mehrere Wiederholungen) und der Spitzenwert des Python-Speichers
+# (tracemalloc, eigener Lauf) gemessen und als JSON geschrieben. Mit --baseline
+# ist der Exit-Code 1, wenn der Median eines Falls die Basislinie um mehr als
+# den Schwellwert überschreitet.
+#
+# tools/benchmark_baseline.json ist die Referenz des Repositorys (Rechner und
+# Python-Version stehen in der Datei). Laufzeiten sind nur auf vergleichbarer
+# Hardware vergleichbar; für einen anderen Rechner die Basislinie dort zuerst
+# mit --save-baseline auf dem Stand des Hauptzweigs erzeugen und erst dann mit
+# --baseline gegen Änderungen vergleichen.
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trepro_core as core  # noqa: E402
+
+START_DATE = datetime.date(2026, 1, 1)
+
+# Protokollgrößen: (aktuelle Dosis, Zieldosis, Wochen, Steigerungen pro Woche, Gewicht, Konzentration)
+PROTOCOL_INPUTS = {
+    "small": (5, 6, 1, 1, 70, 1),
+    "typical": (5, 10, 4, 2, 70, 1),
+    "extreme": (5, 120, 52, 7, 90, 1),
+}
+
+BATCH_PATIENTS = 10000
+
+
+def _protocol(size):
+    return core.simulate_dose_increase(*PROTOCOL_INPUTS[size], start_date=START_DATE)
+
+
+# Fall: skalare Umrechnungen für eine Patientenliste in einer Python-Schleife
+def case_converters_scalar():
+    rows = [(40 + i % 80, 1 + i % 60, core.CONCENTRATIONS[i % 5]) for i in range(BATCH_PATIENTS)]
+
+    def run():
+        for weight, dose, concentration in rows:
+            rate = core.calculate_infusion_rate(weight, dose, concentration)
+            core.calculate_reservoir_duration(rate)
+            core.calculate_dose_from_infusion_rate(weight, rate, concentration)
+            core.calculate_perfusor_rate(weight, dose, concentration)
+    return run
+
+
+# Fall: vektorisierte Umrechnungen für dieselbe Patientenliste
+def case_converters_vectorized():
+    import numpy as np
+
+    import trepro_vectorized as vec
+
+    index = np.arange(BATCH_PATIENTS)
+    weights, doses = 40 + index % 80, 1 + index % 60
+    concentrations = np.array(core.CONCENTRATIONS)[index % 5]
+
+    def run():
+        rates = vec.calculate_infusion_rates(weights, doses, concentrations)
+        vec.calculate_reservoir_durations(rates)
+        vec.calculate_doses_from_infusion_rates(weights, rates, concentrations)
+        vec.calculate_perfusor_rates(weights, doses, concentrations)
+    return run
+
+
+def case_protocol(size):
+    def setup():
+        return lambda: core.generate_dose_increase_protocol(*PROTOCOL_INPUTS[size], start_date=START_DATE)
+    return setup
+
+
+# Fall: Protokolle samt Zusammenfassung für eine ganze Kohorte im selben Prozess (öffentlicher Weg)
+def case_protocol_batch():
+    inputs = [(5, 10 + i % 30, 4 + i % 8, 1 + i % 3, 50 + i % 60, core.CONCENTRATIONS[i % 5])
+              for i in range(BATCH_PATIENTS)]
+
+    def run():
+        for args in inputs:
+            _, vial_usage, reservoir_changes, reservoir_intervals = core.generate_dose_increase_protocol(
+                *args, start_date=START_DATE)
+            core.generate_summary(vial_usage, reservoir_changes, reservoir_intervals, args[2])
+    return run
+
+
+# Fall: anstehende Wechsel der nächsten 7 Tage über eine Station mit vielen gespeicherten Patienten
+def case_store_upcoming():
+    from trepro_store import ProtocolStore
+
+    store = ProtocolStore(":memory:")
+    store.save_many(
+        (f"P{i:05d}", core.simulate_dose_increase(5, 10 + i % 30, 4 + i % 8, 1 + i % 3, 50 + i % 60,
+                                                  core.CONCENTRATIONS[i % 5],
+                                                  start_date=START_DATE + datetime.timedelta(days=i % 60))[0], "")
+        for i in range(BATCH_PATIENTS // 2))
+    return lambda: store.upcoming_events(START_DATE + datetime.timedelta(days=30), 7)
+
+
+# Fall: Prognose des Vialbedarfs (Monte Carlo) für eine Kohorte
+def case_forecast():
+    from trepro_forecast import forecast_vial_demand
+
+    cohort = [{"current_dose": 5, "target_dose": 10 + i % 30, "weeks": 4 + i % 8, "increases_per_week": 1 + i % 3,
+               "weight": 50 + i % 60, "concentration": core.CONCENTRATIONS[i % 5], "start_date": START_DATE}
+              for i in range(500)]
+    return lambda: forecast_vial_demand(cohort, variants=200, seed=1)
+
+
+def case_summary(size):
+    def setup():
+        _, vial_usage, reservoir_changes, reservoir_intervals = _protocol(size)
+        weeks = PROTOCOL_INPUTS[size][2]
+        return lambda: core.generate_summary(vial_usage, reservoir_changes, reservoir_intervals, weeks)
+    return setup
+
+
+def case_plot(size):
+    def setup():
+        from trepro_render import render_protocol_chart
+
+        protocol = _protocol(size)[0]
+        return lambda: render_protocol_chart(protocol)
+    return setup
+
+
+def case_pdf(size):
+    def setup():
+        from trepro_render import generate_pdf_with_graph, render_protocol_chart
+
+        protocol, vial_usage, reservoir_changes, reservoir_intervals = _protocol(size)
+        summary = core.generate_summary(vial_usage, reservoir_changes, reservoir_intervals, PROTOCOL_INPUTS[size][2])
+        png = render_protocol_chart(protocol)
+        return lambda: generate_pdf_with_graph(protocol, png, summary)
+    return setup
+
+
+# Name -> (Vorbereitung, Wiederholungen)
+CASES = {
+    "converters_scalar_10k": (case_converters_scalar, 20),
+    "converters_vectorized_10k": (case_converters_vectorized, 50),
+    "protocol_small": (case_protocol("small"), 500),
+    "protocol_typical": (case_protocol("typical"), 500),
+    "protocol_extreme": (case_protocol("extreme"), 20),
+    "protocol_batch_10k": (case_protocol_batch, 3),
+    "store_upcoming_5k": (case_store_upcoming, 100),
+    "forecast_500x200": (case_forecast, 3),
+    "summary_typical": (case_summary("typical"), 1000),
+    "summary_extreme": (case_summary("extreme"), 1000),
+    "plot_typical": (case_plot("typical"), 5),
+    "plot_extreme": (case_plot("extreme"), 3),
+    "pdf_typical": (case_pdf("typical"), 5),
+    "pdf_extreme": (case_pdf("extreme"), 3),
+}
+
+
+# Funktion zur Messung eines Falls
+def run_case(setup, repeat, measure_memory=True):
+    run = setup()
+    run()  # Aufwärmen (Importe, Caches)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    result = {"runs": repeat, "median_s": statistics.median(timings), "min_s": min(timings)}
+    if measure_memory:
+        tracemalloc.start()
+        run()
+        result["peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    return result
+
+
+# Funktion zum Vergleich mit der Basislinie, liefert die Liste der Verschlechterungen
+def compare_with_baseline(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            continue
+        ratio = result["median_s"] / reference["median_s"]
+        if ratio > 1 + threshold:
+            regressions.append((name, reference["median_s"], result["median_s"], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks des Treprostinil Dosisrechners")
+    parser.add_argument("--output", default="bench_results.json", help="Ergebnisdatei (JSON)")
+    parser.add_argument("--only", action="append", help="Nur Fälle, deren Name diesen Text enthält")
+    parser.add_argument("--repeat-scale", type=float, default=1.0, help="Faktor für die Anzahl der Wiederholungen")
+    parser.add_argument("--no-memory", action="store_true", help="Speicherspitzen nicht messen")
+    parser.add_argument("--baseline", help="Basislinie (JSON) für den Vergleich")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Erlaubte Verschlechterung (0.25 = 25 %%)")
+    parser.add_argument("--save-baseline", help="Ergebnisse zusätzlich als Basislinie speichern")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, (setup, repeat) in CASES.items():
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        result = run_case(setup, max(1, round(repeat * args.repeat_scale)), not args.no_memory)
+        results[name] = result
+        memory = f", Speicher {result['peak_kib']:.0f} KiB" if "peak_kib" in result else ""
+        print(f"{name:28s} Median {result['median_s'] * 1000:10.3f} ms{memory}")
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            regressions = compare_with_baseline(results, json.load(handle), args.threshold)
+        for name, reference, current, ratio in regressions:
+            print(f"VERSCHLECHTERUNG {name}: {reference * 1000:.3f} ms -> {current * 1000:.3f} ms ({ratio:.2f}x)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,625 @@
+# Differenzielle Prüfung der schnellen Rechenwege gegen die Referenz
+#
+# Aufruf:
+#   python tools/equivalence_harness.py [--only protocol] [--scale 10] [--seed 1] [--workers 4]
+#                                       [--chunk-size 2000] [--output harness_results.json]
+#
+# Für jede Prüfung werden zufällige Eingaben erzeugt und die Referenz sowie der
+# zu prüfende Rechenweg nebeneinander ausgeführt. Verglichen wird Zeile für
+# Zeile über repr(), also bitgenau einschließlich der Typen (1 statt 1.0 in den
+# Hinweisen); eine Prüfung kann stattdessen eine relative Toleranz für Zahlen
+# festlegen (Check.rel_tol). Erwartete Fehler (EXPECTED_ERRORS, Laufrate 0)
+# zählen als Ergebnis und müssen auf beiden Wegen gleich auftreten; jeder andere
+# Fehler, auch ein fehlendes Modul, lässt die Prüfung fehlschlagen.
+#
+# Referenz des Protokolls ist reference_dose_increase_protocol, die
+# ursprüngliche Schleife über Listen von Dictionaries aus der ersten Version der
+# App. Die Umrechnungen verwenden als Referenz die skalaren Funktionen aus
+# trepro_core.
+#
+# Ausgegeben werden je Prüfung die Anzahl der Fälle und Abweichungen, die
+# Laufzeit beider Wege und die erste abweichende Zeile samt Eingabe. Die Fälle
+# werden in Blöcken in einem Prozesspool geprüft; jeder Block hat einen eigenen,
+# reproduzierbaren Zufallsstrom (--seed). Exit-Code 1 bei einer Abweichung oder
+# einem unerwarteten Fehler.
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import re
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trepro_core as core  # noqa: E402
+
+START_DATE = datetime.date(2026, 1, 1)
+
+# Fehler, die zum Ergebnis gehören (Laufrate rundet auf 0 µl/h) und daher verglichen werden
+EXPECTED_ERRORS = (ZeroDivisionError,)
+
+# Eine Prüfung: Erzeugung eines Falls, Referenz und Kandidat (liefern Listen von Zeilen),
+# Anzahl der Fälle ohne --scale und relative Toleranz (0 = bitgenau)
+Check = collections.namedtuple("Check", ["description", "generate", "reference", "candidate", "cases", "rel_tol"])
+
+
+# Funktion zur Bestimmung der nächsthöheren Konzentration (Referenz)
+def reference_next_higher_concentration(current_concentration):
+    concentrations = [1, 2.5, 5, 10, 20]  # Liste der verfügbaren Konzentrationen in mg/ml
+    for conc in concentrations:
+        if conc > current_concentration:
+            return conc
+    return current_concentration  # Rückgabe der aktuellen Konzentration, wenn keine höhere gefunden wird
+
+
+# Dosissteigerungsprotokoll (Referenz)
+#
+# Schleife der ersten Version der App; ergänzt um Startdatum sowie geänderte
+# Dosen ({Schritt: Dosis}) und vorzeitige Konzentrationswechsel ({Schritt:
+# Konzentration}) wie in TitrationSimulation.edit.
+def reference_dose_increase_protocol(current_dose, target_dose, weeks, increases_per_week, weight, concentration,
+                                     pump_capacity=3, vial_capacity=10, start_date=None, doses=None,
+                                     concentrations=None):
+    doses = doses or {}
+    concentrations = concentrations or {}
+    total_increases = weeks * increases_per_week
+    dose_step = (target_dose - current_dose) / total_increases
+    protocol = []
+    current_date = start_date if start_date is not None else datetime.date.today()
+
+    current_reservoir_volume = pump_capacity  # 3 ml für die Reservoirkapazität
+    vial_refills_left = vial_capacity / pump_capacity  # Ein Vial kann 3 Mal das Reservoir füllen
+    reservoir_days_used = 0  # Zählt die Tage, die das aktuelle Reservoir in der Pumpe verbleibt
+
+    vial_usage = {}  # Um den Vial-Verbrauch pro Konzentration zu zählen
+    reservoir_changes = 0  # Anzahl der Reservoirwechsel
+    reservoir_intervals = []  # Liste der Intervalle für Reservoirwechsel
+
+    last_reservoir_change_date = None  # Um die Zeit zwischen den Reservoirwechseln zu messen
+
+    for i in range(total_increases):
+        current_date += datetime.timedelta(days=7 / increases_per_week)  # Berechnung des Datums für jede Steigerung
+        current_dose += dose_step  # Steigere die Dosis
+        dose = doses.get(i, current_dose)
+
+        # Vorzeitiger Wechsel der Konzentration: angebrochenes Vial verwerfen
+        switched = i in concentrations and concentrations[i] != concentration
+        if switched:
+            vial_usage[concentration] = vial_usage.get(concentration, 0) + 1
+            concentration = concentrations[i]
+            vial_refills_left = vial_capacity / pump_capacity
+
+        infusion_rate = core.calculate_infusion_rate(weight, dose, concentration)
+        rounded_infusion_rate = round(infusion_rate)
+
+        # Verbrauch pro Tag in ml
+        daily_consumption_ml = rounded_infusion_rate * 24 / 1000  # µl in ml umrechnen
+        reservoir_days_left = current_reservoir_volume / daily_consumption_ml
+        reservoir_days_used += 7 / increases_per_week  # Zählt die Tage, die das aktuelle Reservoir verwendet wird
+
+        # Reservoirwechsel erzwingen, wenn 14 Tage erreicht sind, unabhängig vom Restvolumen
+        if switched or reservoir_days_used >= 14 or reservoir_days_left < 1:
+            current_reservoir_volume = pump_capacity
+            vial_refills_left -= 1  # Eine Reservoirfüllung verbraucht
+            reservoir_days_used = 0  # Setze die Zähler zurück, da das Reservoir gewechselt wurde
+            reservoir_changes += 1
+
+            # Berechne das Intervall zwischen Reservoirwechseln
+            if last_reservoir_change_date:
+                interval = (current_date - last_reservoir_change_date).days
+                reservoir_intervals.append(interval)
+            last_reservoir_change_date = current_date  # Setze das Datum des letzten Reservoirwechsels
+
+            # Wenn das Vial aufgebraucht ist, ein neues Vial anfangen
+            if vial_refills_left <= 0:
+                if concentration in vial_usage:
+                    vial_usage[concentration] += 1
+                else:
+                    vial_usage[concentration] = 1
+                concentration = reference_next_higher_concentration(concentration)
+                vial_refills_left = vial_capacity / pump_capacity  # Neues Vial anfangen
+                hint = f"Vialwechsel erforderlich. Neue Konzentration: {concentration} mg/ml"
+            elif switched:
+                hint = f"Vialwechsel erforderlich. Neue Konzentration: {concentration} mg/ml"
+            else:
+                hint = "Reservoir neu gefüllt"
+        else:
+            current_reservoir_volume -= daily_consumption_ml  # Reduziere das Restvolumen im Reservoir
+            hint = ""
+
+        protocol.append({
+            "Datum": current_date,
+            "Dosis (ng/kg/min)": round(dose, 2),
+            "Laufrate (µl/h)": rounded_infusion_rate,
+            "Restvolumen im Reservoir (ml)": round(current_reservoir_volume, 2),
+            "Hinweis": hint
+        })
+
+    # Füge das letzte Vial zur Liste hinzu, falls es nicht bereits registriert wurde
+    if concentration in vial_usage:
+        vial_usage[concentration] += 1
+    else:
+        vial_usage[concentration] = 1
+
+    return protocol, vial_usage, reservoir_changes, reservoir_intervals
+
+
+# Funktion zur Umwandlung eines Protokolls in vergleichbare Zeilen (Tabelle und Zusammenfassung)
+def _protocol_rows(protocol, vial_usage, reservoir_changes, reservoir_intervals):
+    rows = [tuple(entry.values()) for entry in protocol]
+    rows.append(("Vialverbrauch", tuple(vial_usage.items())))
+    rows.append(("Reservoirwechsel", reservoir_changes, tuple(reservoir_intervals)))
+    return rows
+
+
+# Funktion zur Erzeugung zufälliger Protokolleingaben (mit Randfällen wie Laufrate 0 oder 1-ml-Vials)
+def random_protocol_case(rng, valid=False):
+    current_dose = round(rng.uniform(0.5, 40), rng.choice([0, 1, 2]))
+    target_dose = round(current_dose + rng.choice([0, rng.uniform(0, 40), rng.uniform(0, 150)]), 1)
+    if not valid and rng.random() < 0.05:
+        target_dose = round(rng.uniform(0.5, current_dose), 1)  # Dosisreduktion
+    elif valid:
+        target_dose = max(target_dose, current_dose)  # Zieldosis nicht kleiner als die aktuelle Dosis
+    return {
+        "current_dose": current_dose,
+        "target_dose": target_dose,
+        "weeks": rng.choice([rng.randint(1, 8), rng.randint(1, 60)]),
+        "increases_per_week": rng.randint(1, 7),
+        "weight": round(rng.uniform(20, 160), 1),
+        "concentration": rng.choice(core.CONCENTRATIONS),
+        "pump_capacity": rng.choice([3, 3, 3, 2, 1.5]),
+        "vial_capacity": rng.choice([10, 10, 10, 20, 3, 1]),
+        "start_date": START_DATE + datetime.timedelta(days=rng.randint(0, 365)),
+    }
+
+
+# Prüfung: Rechenkern (spaltenweise Simulation) gegen die Referenzschleife
+def protocol_reference(case):
+    return _protocol_rows(*reference_dose_increase_protocol(**case))
+
+
+def protocol_candidate(case):
+    return _protocol_rows(*core.generate_dose_increase_protocol(**case))
+
+
+# Prüfung: Neuberechnung ab dem geänderten Schritt (Zwischenstände) gegen vollständige Neuberechnung
+def random_edit_case(rng):
+    case = random_protocol_case(rng)
+    steps = case["weeks"] * case["increases_per_week"]
+    edits = []
+    for _ in range(rng.randint(1, 4)):
+        step = rng.randrange(steps)
+        if rng.random() < 0.7:
+            edits.append(("dose", step, round(rng.uniform(0.5, 1.5) * max(case["current_dose"], case["target_dose"]), 2)))
+        else:
+            edits.append(("concentration", step, rng.choice(core.CONCENTRATIONS)))
+    return dict(case, edits=edits)
+
+
+def replay_reference(case):
+    params = {name: value for name, value in case.items() if name != "edits"}
+    doses, concentrations = {}, {}
+    result = reference_dose_increase_protocol(**params)
+    for kind, step, value in case["edits"]:
+        (doses if kind == "dose" else concentrations)[step] = value
+        result = reference_dose_increase_protocol(**params, doses=dict(doses), concentrations=dict(concentrations))
+    return _protocol_rows(*result)
+
+
+def replay_candidate(case):
+    simulation = core.TitrationSimulation(**{name: value for name, value in case.items() if name != "edits"})
+    for kind, step, value in case["edits"]:
+        simulation.edit(**{"doses" if kind == "dose" else "concentrations": {step: value}})
+    protocol, vial_usage, reservoir_changes, reservoir_intervals = simulation.result()
+    return _protocol_rows(protocol.to_records(), vial_usage, reservoir_changes, reservoir_intervals)
+
+
+# Prüfung: Speichern und Laden über SQLite
+_store = None
+
+
+def store_reference(case):
+    return [tuple(entry.values()) for entry in reference_dose_increase_protocol(**case)[0]]
+
+
+def store_candidate(case):
+    global _store
+    from trepro_store import ProtocolStore
+
+    if _store is None:
+        _store = ProtocolStore(":memory:")
+    _store.save_protocol("harness", core.simulate_dose_increase(**case)[0])
+    return [tuple(entry.values()) for entry in _store.load_protocol("harness").to_records()]
+
+
+# Prüfung: JSON-Antwort des HTTP-Dienstes (einschließlich Serialisierung)
+#
+# Der Dienst liest Zahlen wie trepro_batch als float, ganzzahlige Kapazitäten als
+# int; die Referenz erhält Dosen und Gewicht daher ebenfalls als float.
+def service_reference(case):
+    params = dict(case, **{name: float(case[name]) for name in ("current_dose", "target_dose", "weight")},
+                  **{name: core.capacity_value(float(case[name])) for name in ("pump_capacity", "vial_capacity")})
+    protocol, vial_usage, reservoir_changes, reservoir_intervals = reference_dose_increase_protocol(**params)
+    rows = [(entry["Datum"].isoformat(), entry["Dosis (ng/kg/min)"], entry["Laufrate (µl/h)"],
+             entry["Restvolumen im Reservoir (ml)"], entry["Hinweis"]) for entry in protocol]
+    rows.append(core.generate_summary(vial_usage, reservoir_changes, reservoir_intervals, case["weeks"]))
+    return rows
+
+
+def service_candidate(case):
+    from trepro_batch import ZERO_RATE_ERROR
+    from trepro_service import HttpError, _protocol_parameters, _protocol_response
+
+    payload = dict(case, start_date=case["start_date"].isoformat())
+    try:
+        response = json.loads(json.dumps(_protocol_response(_protocol_parameters(payload))))
+    except HttpError as exc:
+        # Der Dienst beantwortet eine Laufrate von 0 µl/h mit 422, die Referenz bricht mit ZeroDivisionError ab
+        if exc.message == ZERO_RATE_ERROR:
+            raise ZeroDivisionError(exc.message)
+        raise
+    rows = [(row["date"], row["dose"], row["infusion_rate"], row["reservoir_volume"], row["hint"])
+            for row in response["protocol"]]
+    rows.append(response["summary"])
+    return rows
+
+
+# Prüfung: Protokoll, Zusammenfassung und PDF aus dem Zwischenspeicher gegen eine Neuberechnung
+#
+# Wenige Grundfälle, deren Werte zufällig als int oder float übergeben werden: gleiche
+# Zahlen mit anderem Typ ergeben andere Ausgaben (Restvolumen 3 bzw. 3.0, "1 mg/ml"
+# bzw. "1.0 mg/ml") und müssen eigene Einträge erhalten. Jeder Worker hat einen
+# eigenen Zwischenspeicher, sodass die meisten Fälle Treffer sind. Verglichen wird
+# auch der Text der PDF-Seiten (ohne die Zeile mit dem Erstellungszeitpunkt); die
+# Referenz erzeugt ihr PDF ohne Diagramm.
+CACHE_BASE_CASES = [
+    {"current_dose": 5, "target_dose": 10, "weeks": 4, "increases_per_week": 2, "weight": 70, "concentration": 1,
+     "pump_capacity": 3, "vial_capacity": 10},
+    {"current_dose": 5, "target_dose": 40, "weeks": 12, "increases_per_week": 3, "weight": 60, "concentration": 5,
+     "pump_capacity": 2, "vial_capacity": 3},
+]
+_cache = None
+_blank_png = None
+
+
+def random_cache_case(rng):
+    case = dict(rng.choice(CACHE_BASE_CASES), start_date=START_DATE)
+    for name in ("current_dose", "weight", "concentration", "pump_capacity"):
+        if rng.random() < 0.5:
+            case[name] = float(case[name])
+    return case
+
+
+# Funktion zum Auslesen der Texte aller Seiten eines PDF (Inhalte mit FlateDecode, wie fpdf sie schreibt)
+def _pdf_text(pdf_data):
+    lines = []
+    for match in re.finditer(rb"<</Filter /FlateDecode /Length (\d+)>>\nstream\n", pdf_data):
+        content = zlib.decompress(pdf_data[match.end():match.end() + int(match.group(1))])
+        lines += [re.sub(rb"\\(.)", rb"\1", text) for text in re.findall(rb"\(((?:[^\\()]|\\.)*)\) Tj", content)]
+    return [line.decode("latin1") for line in lines if b"erstellt" not in line]
+
+
+def cache_reference(case):
+    global _blank_png
+    from trepro_render import generate_pdf_with_graph
+
+    if _blank_png is None:
+        import io
+
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (8, 8), "white").save(buffer, "PNG")
+        _blank_png = buffer.getvalue()
+    protocol, vial_usage, reservoir_changes, reservoir_intervals = core.simulate_dose_increase(**case)
+    summary = core.generate_summary(vial_usage, reservoir_changes, reservoir_intervals, case["weeks"])
+    rows = _protocol_rows(protocol.to_records(), vial_usage, reservoir_changes, reservoir_intervals)
+    return rows + [summary] + _pdf_text(generate_pdf_with_graph(protocol, _blank_png, summary))
+
+
+def cache_candidate(case):
+    global _cache
+    from trepro_cache import LRUByteCache, cached_protocol_result
+
+    if _cache is None:
+        _cache = LRUByteCache()
+    result = cached_protocol_result(case["weight"], case["current_dose"], case["target_dose"], case["weeks"],
+                                    case["increases_per_week"], case["concentration"], case["pump_capacity"],
+                                    case["vial_capacity"], case["start_date"], cache=_cache)
+    rows = _protocol_rows(result.protocol.to_records(), result.vial_usage, result.reservoir_changes,
+                          result.reservoir_intervals)
+    return rows + [result.summary] + _pdf_text(result.pdf)
+
+
+# Prüfung: Prognose ohne Zufallseinflüsse gegen den Vialverbrauch der Referenz
+def forecast_reference(case):
+    try:
+        vial_usage = reference_dose_increase_protocol(**case)[1]
+    except ZeroDivisionError:
+        return None  # Laufrate 0: in der Prognose nicht definiert, Fall überspringen
+    return sorted(vial_usage.items())
+
+
+def forecast_candidate(case):
+    from trepro_forecast import forecast_vial_demand
+
+    forecast = forecast_vial_demand([case], variants=1, weight_drift_sd=0, missed_step_probability=0,
+                                    early_change_probability=0)
+    return [(concentration, round(float(total)))
+            for concentration, total in zip(forecast.concentrations, forecast.expected.sum(axis=1)) if total]
+
+
+# Prüfung: vektorisierte Umrechnungen gegen die skalaren Funktionen (ein Fall = 256 Zeilen)
+def random_converter_case(rng):
+    rows = []
+    for _ in range(256):
+        weight = rng.choice([round(rng.uniform(20, 160), 1), rng.uniform(0.1, 300)])
+        dose = rng.choice([round(rng.uniform(0.1, 150), 2), rng.uniform(0.001, 500)])
+        if rng.random() < 0.03:
+            weight, dose = rng.choice([(0, dose), (weight, 0), (-weight, dose)])
+        rows.append((weight, dose, rng.choice(core.CONCENTRATIONS)))
+    return rows
+
+
+def converters_reference(case):
+    rows = []
+    for weight, dose, concentration in case:
+        if weight <= 0 or dose <= 0:
+            rows.append((math.nan,) * 4)  # Ungültige Eingabe: in der App eine Fehlermeldung
+            continue
+        rate = core.calculate_infusion_rate(weight, dose, concentration)
+        rows.append((rate, core.calculate_reservoir_duration(rate),
+                     core.calculate_dose_from_infusion_rate(weight, rate, concentration),
+                     core.calculate_perfusor_rate(weight, dose, concentration)))
+    return rows
+
+
+def converters_candidate(case):
+    import trepro_vectorized as vec
+
+    weights, doses, concentrations = zip(*case)
+    rates = vec.calculate_infusion_rates(weights, doses, concentrations)
+    return list(zip(rates.tolist(), vec.calculate_reservoir_durations(rates).tolist(),
+                    vec.calculate_doses_from_infusion_rates(weights, rates, concentrations).tolist(),
+                    vec.calculate_perfusor_rates(weights, doses, concentrations).tolist()))
+
+
+# Prüfung: Tabellenwerte des Nomogramms (vektorisiert berechnet) gegen die skalaren Funktionen
+def random_nomogram_case(rng):
+    from trepro_nomogram import DEFAULT_DOSES, DEFAULT_WEIGHTS
+
+    return rng.choice(DEFAULT_WEIGHTS), rng.choice(DEFAULT_DOSES), rng.choice(core.CONCENTRATIONS)
+
+
+def nomogram_reference(case):
+    weight, dose, concentration = case
+    rate = core.calculate_infusion_rate(weight, dose, concentration)
+    return [(rate, core.calculate_reservoir_duration(rate), core.calculate_perfusor_rate(weight, dose, concentration))]
+
+
+def nomogram_candidate(case):
+    from trepro_nomogram import get_nomogram
+
+    weight, dose, concentration = case
+    nomogram = get_nomogram()
+    w_index, d_index = nomogram.weights.index(weight), nomogram.doses.index(dose)
+    return [tuple(float(nomogram.table(quantity, concentration)[w_index, d_index])
+                  for quantity in ("infusion_rate", "reservoir_duration", "perfusor_rate"))]
+
+
+# Prüfung: Eigenschaften jedes Protokolls (Referenz: keine Verletzung)
+def properties_reference(case):
+    return []
+
+
+def properties_candidate(case):
+    try:
+        protocol, vial_usage, reservoir_changes, reservoir_intervals = core.simulate_dose_increase(**case)
+    except ZeroDivisionError:
+        return []  # Laufrate 0: Fehler wie in der Referenz, keine Eigenschaft betroffen
+    violations = []
+    step_days = 7 / case["increases_per_week"]
+    if len(protocol) != case["weeks"] * case["increases_per_week"]:
+        violations.append(("Anzahl der Schritte", len(protocol)))
+    concentration = case["concentration"]
+    changes = vial_changes = 0
+    for index, step in enumerate(protocol):
+        if step.event == core.EVENT_NONE:
+            if not 0 <= step.reservoir_volume <= case["pump_capacity"]:
+                violations.append(("Restvolumen außerhalb des Reservoirs", index, step.reservoir_volume))
+            if step.concentration != concentration:
+                violations.append(("Konzentration ohne Vialwechsel geändert", index, step.concentration))
+        else:
+            changes += 1
+        if step.event == core.EVENT_VIAL_CHANGE:
+            vial_changes += 1
+            if step.concentration != core.get_next_higher_concentration(concentration):
+                violations.append(("Vialwechsel nicht auf die nächsthöhere Konzentration", index,
+                                   concentration, step.concentration))
+        concentration = step.concentration
+    if changes != reservoir_changes:
+        violations.append(("Reservoirwechsel", reservoir_changes, changes))
+    if len(reservoir_intervals) != max(changes - 1, 0):
+        violations.append(("Anzahl der Intervalle", len(reservoir_intervals)))
+    if any(not 0 <= interval < core.MAX_RESERVOIR_DAYS + step_days for interval in reservoir_intervals):
+        violations.append(("Intervall über 14 Tage", tuple(reservoir_intervals)))
+    if sum(vial_usage.values()) != vial_changes + 1:
+        violations.append(("Vialverbrauch", tuple(vial_usage.items()), vial_changes))
+    return violations
+
+
+CHECKS = {
+    "protocol_core": Check("Rechenkern gegen Referenzschleife", random_protocol_case, protocol_reference,
+                           protocol_candidate, 100000, 0),
+    "protocol_replay": Check("Neuberechnung ab Änderung gegen vollständige Neuberechnung", random_edit_case,
+                             replay_reference, replay_candidate, 20000, 0),
+    "protocol_properties": Check("Eigenschaften der Protokolle", random_protocol_case, properties_reference,
+                                 properties_candidate, 100000, 0),
+    "store_roundtrip": Check("SQLite speichern und laden", random_protocol_case, store_reference, store_candidate,
+                             20000, 0),
+    "service_json": Check("JSON-Antwort des Dienstes", lambda rng: random_protocol_case(rng, valid=True),
+                          service_reference, service_candidate, 20000, 0),
+    "cache_roundtrip": Check("Zwischenspeicher (gemischte int/float-Eingaben) gegen Neuberechnung",
+                             random_cache_case, cache_reference, cache_candidate, 2000, 0),
+    "forecast_deterministic": Check("Prognose ohne Zufall gegen Vialverbrauch",
+                                    lambda rng: random_protocol_case(rng, valid=True), forecast_reference,
+                                    forecast_candidate, 2000, 0),
+    "converters_vectorized": Check("Vektorisierte Umrechnungen (256 Zeilen je Fall)", random_converter_case,
+                                   converters_reference, converters_candidate, 5000, 0),
+    "nomogram_table": Check("Nomogrammtabellen gegen exakte Berechnung", random_nomogram_case, nomogram_reference,
+                            nomogram_candidate, 20000, 0),
+}
+
+
+# Funktion zur Ausführung eines Wegs mit Zeitmessung; erwartete Fehler werden als Zeile zurückgegeben
+def _timed(func, case):
+    start = time.perf_counter()
+    try:
+        rows = func(case)
+    except EXPECTED_ERRORS as exc:
+        rows = [("Fehler", type(exc).__name__)]
+    return rows, time.perf_counter() - start
+
+
+# Funktion zum Vergleich zweier Zeilen (bitgenau oder mit relativer Toleranz für Zahlen)
+def _same(reference, candidate, rel_tol):
+    if not rel_tol:
+        return repr(reference) == repr(candidate)
+    if isinstance(reference, tuple) and isinstance(candidate, tuple):
+        return len(reference) == len(candidate) and all(
+            _same(a, b, rel_tol) for a, b in zip(reference, candidate))
+    if isinstance(reference, float) and isinstance(candidate, float):
+        return math.isclose(reference, candidate, rel_tol=rel_tol)
+    return repr(reference) == repr(candidate)
+
+
+# Funktion zur Bestimmung der ersten abweichenden Zeile (None, wenn beide gleich sind)
+def first_divergence(reference, candidate, rel_tol=0):
+    for index, (a, b) in enumerate(zip(reference, candidate)):
+        if not _same(a, b, rel_tol):
+            return index
+    if len(reference) != len(candidate):
+        return min(len(reference), len(candidate))
+    return None
+
+
+# Prüfung eines Blocks von Fällen (läuft im Worker-Prozess)
+def run_chunk(name, seed, chunk, cases):
+    check = CHECKS[name]
+    rng = random.Random(f"{seed}:{name}:{chunk}")
+    result = {"cases": 0, "skipped": 0, "diverging": 0, "errors": 0, "reference_s": 0.0, "candidate_s": 0.0,
+              "first": None, "first_error": None}
+    for index in range(cases):
+        case = None
+        try:
+            case = check.generate(rng)
+            reference, reference_time = _timed(check.reference, case)
+            if reference is None:
+                result["skipped"] += 1
+                continue
+            candidate, candidate_time = _timed(check.candidate, case)
+        except Exception as exc:  # Unerwarteter Fehler (z.B. fehlendes Modul): Prüfung schlägt fehl
+            result["errors"] += 1
+            if result["first_error"] is None:
+                result["first_error"] = {"chunk": chunk, "case": index, "input": repr(case)[:300],
+                                         "error": f"{type(exc).__name__}: {exc}"}
+            if isinstance(exc, ImportError):
+                break  # Betrifft alle Fälle des Blocks
+            continue
+        result["cases"] += 1
+        result["reference_s"] += reference_time
+        result["candidate_s"] += candidate_time
+
+        row = first_divergence(reference, candidate, check.rel_tol)
+        if row is not None:
+            result["diverging"] += 1
+            if result["first"] is None:
+                result["first"] = {
+                    "chunk": chunk,
+                    "case": index,
+                    "input": repr(case),
+                    "row": row,
+                    "reference": repr(reference[row]) if row < len(reference) else "(keine Zeile)",
+                    "candidate": repr(candidate[row]) if row < len(candidate) else "(keine Zeile)",
+                }
+    return result
+
+
+# Funktion zur Prüfung aller Blöcke einer Prüfung, liefert die zusammengefassten Ergebnisse
+def run_check(executor, name, cases, seed, chunk_size):
+    chunks = [(chunk, min(chunk_size, cases - start)) for chunk, start in enumerate(range(0, cases, chunk_size))]
+    if executor is None:
+        results = [run_chunk(name, seed, chunk, count) for chunk, count in chunks]
+    else:
+        results = list(executor.map(run_chunk, [name] * len(chunks), [seed] * len(chunks),
+                                    *zip(*chunks)))
+
+    total = {"cases": 0, "skipped": 0, "diverging": 0, "errors": 0, "reference_s": 0.0, "candidate_s": 0.0,
+             "first": None, "first_error": None}
+    for result in results:
+        for field in ("cases", "skipped", "diverging", "errors", "reference_s", "candidate_s"):
+            total[field] += result[field]
+        for field in ("first", "first_error"):
+            if total[field] is None:
+                total[field] = result[field]  # Blöcke in Reihenfolge: erste Abweichung des ersten Blocks
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Differenzielle Prüfung des Treprostinil Dosisrechners")
+    parser.add_argument("--only", action="append", help="Nur Prüfungen, deren Name diesen Text enthält")
+    parser.add_argument("--scale", type=float, default=1.0, help="Faktor für die Anzahl der Fälle")
+    parser.add_argument("--seed", type=int, default=1, help="Startwert der Zufallsfälle")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Anzahl der Worker-Prozesse")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="Fälle je Block")
+    parser.add_argument("--output", help="Ergebnisse zusätzlich als JSON speichern")
+    args = parser.parse_args(argv)
+
+    executor = concurrent.futures.ProcessPoolExecutor(args.workers) if args.workers > 1 else None
+    results = {}
+    try:
+        for name, check in CHECKS.items():
+            if args.only and not any(pattern in name for pattern in args.only):
+                continue
+            result = run_check(executor, name, max(1, round(check.cases * args.scale)), args.seed,
+                               args.chunk_size)
+            results[name] = result
+            speedup = result["reference_s"] / result["candidate_s"] if result["candidate_s"] else float("nan")
+            print(f"{name:24s} {result['cases']:9d} Fälle  {result['diverging']:6d} abweichend  "
+                  f"Referenz {result['reference_s']:8.2f} s  Kandidat {result['candidate_s']:8.2f} s  "
+                  f"({speedup:.2f}x)  {check.description}")
+            first = result["first"]
+            if first is not None:
+                print(f"  ABWEICHUNG in Block {first['chunk']}, Fall {first['case']}, Zeile {first['row']}")
+                print(f"    Eingabe:  {first['input']}")
+                print(f"    Referenz: {first['reference']}")
+                print(f"    Kandidat: {first['candidate']}")
+            first_error = result["first_error"]
+            if first_error is not None:
+                print(f"  FEHLER in {result['errors']} Fällen, zuerst Block {first_error['chunk']}, "
+                      f"Fall {first_error['case']}: {first_error['error']}")
+                print(f"    Eingabe:  {first_error['input']}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump({
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "seed": args.seed,
+                "results": results,
+            }, handle, indent=2)
+    return 1 if any(result["diverging"] or result["errors"] for result in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
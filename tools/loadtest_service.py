@@ -0,0 +1,100 @@
+# Lasttest des JSON-HTTP-Dienstes (trepro_service.py)
+#
+# Aufruf:
+#   python trepro_service.py &
+#   python tools/loadtest_service.py [--url http://127.0.0.1:8765] [--endpoint /protocol]
+#                                    [--concurrency 32] [--requests 5000]
+#
+# Öffnet --concurrency dauerhafte Verbindungen (keep-alive) und schickt über sie
+# insgesamt --requests Anfragen an den gewählten Endpunkt. Ausgegeben werden
+# Durchsatz (Anfragen pro Sekunde), Median/p99 der Antwortzeit und die Anzahl
+# fehlgeschlagener Anfragen. Nur Standardbibliothek.
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+import urllib.parse
+
+# Beispielanfragen je Endpunkt
+PAYLOADS = {
+    "/infusion-rate": {"weight": 70, "dose": 10, "concentration": 1},
+    "/dose": {"weight": 70, "infusion_rate": 42, "concentration": 1},
+    "/perfusor-rate": {"weight": 70, "dose": 10, "concentration": 1},
+    "/protocol": {"current_dose": 5, "target_dose": 10, "weeks": 4, "increases_per_week": 2, "weight": 70,
+                  "concentration": 1, "start_date": "2026-01-01"},
+    "/protocol/pdf": {"current_dose": 5, "target_dose": 10, "weeks": 4, "increases_per_week": 2, "weight": 70,
+                      "concentration": 1, "start_date": "2026-01-01"},
+    "/batch": {"patients": [{"patient_id": str(i), "current_dose": 5, "target_dose": 10 + i % 30,
+                             "weeks": 4 + i % 8, "increases_per_week": 1 + i % 3, "weight": 50 + i % 60,
+                             "concentration": 1, "start_date": "2026-01-01"} for i in range(100)]},
+}
+
+
+# Funktion zum Lesen einer HTTP-Antwort, liefert den Statuscode
+async def _read_response(reader):
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+# Eine Verbindung, die Anfragen abarbeitet, solange das gemeinsame Kontingent reicht
+async def _client(host, port, request, budget, latencies, failures):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while budget[0] > 0:
+            budget[0] -= 1
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = await _read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                failures[0] += 1
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, endpoint, concurrency, requests):
+    body = json.dumps(PAYLOADS[endpoint]).encode()
+    request = (f"POST {endpoint} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+               f"Content-Length: {len(body)}\r\n\r\n").encode("latin1") + body
+    budget, latencies, failures = [requests], [], [0]
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, request, budget, latencies, failures) for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, failures[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lasttest des Treprostinil-Dienstes")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--endpoint", default="/protocol", choices=sorted(PAYLOADS))
+    parser.add_argument("--concurrency", type=int, default=32, help="Anzahl gleichzeitiger Verbindungen")
+    parser.add_argument("--requests", type=int, default=5000, help="Anzahl der Anfragen insgesamt")
+    args = parser.parse_args(argv)
+
+    url = urllib.parse.urlsplit(args.url)
+    elapsed, latencies, failures = asyncio.run(
+        run_load(url.hostname, url.port or 80, args.endpoint, args.concurrency, args.requests))
+
+    ordered = sorted(latencies)
+    print(f"Endpunkt          {args.endpoint}")
+    print(f"Anfragen          {len(latencies)} ({failures} fehlgeschlagen)")
+    print(f"Dauer             {elapsed:.2f} s")
+    print(f"Durchsatz         {len(latencies) / elapsed:.1f} Anfragen/s")
+    print(f"Antwortzeit p50   {statistics.median(ordered) * 1000:.2f} ms")
+    print(f"Antwortzeit p99   {ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))] * 1000:.2f} ms")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+# Misst die Importzeit des Rechenkerns in frischen Interpretern
+#
+# Aufruf:  python tools/measure_import.py [--runs 10] [--max-ms 50]
+# Der Exit-Code ist 1, wenn der Median die Schwelle überschreitet oder beim
+# Import eine der schweren Bibliotheken (Streamlit, pandas, ...) geladen wird.
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Module, die beim Import des Kerns nicht geladen werden dürfen
+HEAVY_MODULES = ["streamlit", "pandas", "numpy", "matplotlib", "fpdf"]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(elapsed * 1000, ",".join(heavy))
+"""
+
+
+# Funktion zur Messung eines einzelnen Imports in einem neuen Prozess
+def measure_once(module):
+    code = PROBE.format(module=module, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True,
+                            check=True)
+    elapsed_ms, _, heavy = result.stdout.strip().partition(" ")
+    return float(elapsed_ms), [m for m in heavy.split(",") if m]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importzeit des Treprostinil-Rechenkerns messen")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=50.0, help="Schwelle für den Median in Millisekunden")
+    parser.add_argument("modules", nargs="*", default=["trepro_core", "trepro_render"])
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module in args.modules:
+        timings = []
+        loaded = set()
+        for _ in range(args.runs):
+            elapsed_ms, heavy = measure_once(module)
+            timings.append(elapsed_ms)
+            loaded.update(heavy)
+        median = statistics.median(timings)
+        print(f"{module}: Median {median:.2f} ms, Max {max(timings):.2f} ms über {args.runs} Läufe")
+        if loaded:
+            print(f"  FEHLER: beim Import geladen: {', '.join(sorted(loaded))}")
+            failed = True
+        if median > args.max_ms:
+            print(f"  FEHLER: Median über der Schwelle von {args.max_ms:.0f} ms")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# Dauertest der Diagramm- und PDF-Erstellung
+#
+# Aufruf:  python tools/soak_render.py [--renders 2000] [--max-growth-mb 20]
+# Rendert das Protokolldiagramm (und jedes zehnte Mal das PDF) wiederholt und
+# vergleicht den Arbeitsspeicher (RSS) nach der Aufwärmphase mit dem Stand am
+# Ende. Der Exit-Code ist 1, wenn der Speicher stärker wächst als erlaubt oder
+# im temporären Verzeichnis Dateien zurückbleiben.
+import argparse
+import datetime
+import gc
+import os
+import resource
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trepro_core import generate_dose_increase_protocol, generate_summary  # noqa: E402
+from trepro_render import generate_pdf_with_graph, protocol_to_dataframe, render_protocol_chart  # noqa: E402
+
+WARMUP_RENDERS = 50
+
+
+# Funktion zur Ermittlung des aktuellen Arbeitsspeichers in MiB
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Höchststand als Näherung
+
+
+def render_once(index):
+    weeks = 4 + index % 12  # Wechselnde Protokolllängen
+    protocol, vial_usage, reservoir_changes, reservoir_intervals = generate_dose_increase_protocol(
+        5, 40, weeks, 3, 70, 1, start_date=datetime.date(2026, 1, 1))
+    png = render_protocol_chart(protocol)
+    if index % 10 == 0:
+        summary = generate_summary(vial_usage, reservoir_changes, reservoir_intervals, weeks)
+        generate_pdf_with_graph(protocol_to_dataframe(protocol), png, summary)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dauertest der Diagramm- und PDF-Erstellung")
+    parser.add_argument("--renders", type=int, default=2000)
+    parser.add_argument("--max-growth-mb", type=float, default=20.0)
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.gettempdir()
+    files_before = set(os.listdir(tmpdir))
+
+    for index in range(WARMUP_RENDERS):
+        render_once(index)
+    gc.collect()
+    baseline = current_rss_mb()
+
+    for index in range(args.renders):
+        render_once(index)
+        if (index + 1) % 500 == 0:
+            print(f"{index + 1} Diagramme: RSS {current_rss_mb():.1f} MiB")
+    gc.collect()
+    final = current_rss_mb()
+
+    leftover = set(os.listdir(tmpdir)) - files_before
+    growth = final - baseline
+    print(f"RSS nach Aufwärmphase {baseline:.1f} MiB, am Ende {final:.1f} MiB, Zuwachs {growth:.1f} MiB")
+    print(f"Zurückgebliebene temporäre Dateien: {len(leftover)}")
+    return 1 if growth > args.max_growth_mb or leftover else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
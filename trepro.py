@@ -1,453 +1,519 @@
-import streamlit as st
-import pandas as pd
-import datetime
-from fpdf import FPDF
-import io  # Zum Zwischenspeichern der PDF-Datei im Speicher
-import matplotlib.pyplot as plt  # Für die Diagramme
-from io import BytesIO  # Um das Bild in den Speicher zu speichern
-import tempfile  # Für das Erstellen einer temporären Datei
-
-
-
-# Funktion zur PDF-Erstellung mit Grafik, Zusammenfassung und Fußzeile
-def generate_pdf_with_graph(protocol_df, fig, summary_text):
-    pdf = FPDF()
-
-    # Setze Seitenränder auf 15 mm
-    pdf.set_margins(15, 15, 15)
-
-    pdf.add_page()
-
-    # Füge den Titel hinzu
-    pdf.set_font('Arial', 'B', 12)
-    pdf.cell(200, 10, txt="Dosissteigerungsprotokoll", ln=True, align='L')
-
-    # Füge die Fußzeile mit Datum und Uhrzeit hinzu
-    current_datetime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    pdf.ln(2)
-    pdf.set_font('Arial', 'I', 8)
-    pdf.cell(200, 10,
-             txt=f"Dieses Dosissteigerungsprotokoll wurde automatisch mit dem Treprostinil Dosisrechner (Beta Version 1.0) am {current_datetime} erstellt.",
-             ln=True, align='L')
-
-    # Füge die Tabelle hinzu (angepasste Spaltenbreiten und kleinere Schriftgröße)
-    pdf.set_font('Arial', '', 8)  # Kleinere Schriftgröße für die Tabelle
-    col_widths = [20, 25, 20, 32, 73]  # Anpassung der Spaltenbreiten
-    columns = ["Datum", "Dosis (ng/kg/min)", "Laufrate (µl/h)", "Noch im Reservoir (ml)", "Hinweis"]
-
-    # Angepasste Zeilenhöhe (z.B. 12 Einheiten)
-    row_height = 8
-
-    for i, col in enumerate(columns):
-        pdf.cell(col_widths[i % len(col_widths)], row_height, col, 1)
-    pdf.ln()
-
-    for row in protocol_df.itertuples():
-        pdf.cell(col_widths[0], row_height, str(row[1]), 1)
-        pdf.cell(col_widths[1], row_height, str(row[2]), 1)
-        pdf.cell(col_widths[2], row_height, str(row[3]), 1)
-        pdf.cell(col_widths[3], row_height, str(row[4]), 1)
-
-        # Umbruch für die "Hinweis"-Spalte, wenn der Text zu lang ist
-        hint_text = str(row[5])
-        pdf.multi_cell(col_widths[4], row_height, hint_text, 1)
-
-    # Füge die Zusammenfassung hinzu
-    pdf.ln(5)
-    pdf.set_font('Arial', '', 10)
-    for line in summary_text.split('\n'):
-        pdf.cell(200, 10, txt=line, ln=True)
-
-
-
-    # Speichere die Grafik in eine temporäre Datei
-    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmpfile:
-        fig.savefig(tmpfile.name, format='PNG')
-        pdf.image(tmpfile.name, x=10, y=None, w=180)
-
-
-
-    # Schreibe die PDF in einen Byte-Stream anstelle einer Datei
-    pdf_output = pdf.output(dest='S').encode('latin1')
-    return pdf_output
-
-
-# Funktion zur Ermittlung der nächsthöheren Konzentration
-def get_next_higher_concentration(current_concentration):
-    concentrations = [1, 2.5, 5, 10, 20]  # Liste der verfügbaren Konzentrationen in mg/ml
-    for conc in concentrations:
-        if conc > current_concentration:
-            return conc
-    return current_concentration  # Rückgabe der aktuellen Konzentration, wenn keine höhere gefunden wird
-
-
-# Funktion zur Berechnung der Laufrate in µl/h
-def calculate_infusion_rate(weight, dose, concentration):
-    dose_mcg_per_min = dose * weight / 1000  # ng/kg/min in µg/min umrechnen
-    dose_mg_per_h = dose_mcg_per_min * 60 / 1000  # µg/min in mg/h umrechnen
-    infusion_rate = dose_mg_per_h / concentration * 1000  # mg/h in µl/h umrechnen
-    return infusion_rate
-
-
-# Funktion zur Berechnung der Haltbarkeit des Reservoirs in Tagen
-def calculate_reservoir_duration(infusion_rate, reservoir_volume=3):
-    reservoir_duration_hours = (
-                                           reservoir_volume * 1000) / infusion_rate  # Reservoirvolumen in µl, Infusionsrate in µl/h
-    reservoir_duration_days = reservoir_duration_hours / 24  # in Tagen umrechnen
-    return reservoir_duration_days
-
-
-# Funktion zur Berechnung der Dosis in ng/kg/min basierend auf der Laufrate
-def calculate_dose_from_infusion_rate(weight, infusion_rate, concentration):
-    dose_mg_per_h = infusion_rate * concentration / 1000  # µl/h in mg/h umrechnen
-    dose_mcg_per_min = dose_mg_per_h * 1000 / 60  # mg/h in µg/min umrechnen
-    dose_ng_per_kg_min = dose_mcg_per_min / weight * 1000  # µg/min in ng/kg/min umrechnen
-    return dose_ng_per_kg_min
-
-
-# Funktion zur Berechnung der Perfusor-Laufrate in ml/h
-def calculate_perfusor_rate(weight, dose, concentration):
-    diluted_concentration = concentration / 50  # Konzentration des verdünnten Medikaments
-    dose_mcg_per_min = dose * weight / 1000  # ng/kg/min in µg/min umrechnen
-    dose_mg_per_h = dose_mcg_per_min * 60 / 1000  # µg/min in mg/h umrechnen
-    perfusor_rate = dose_mg_per_h / diluted_concentration  # mg/h in ml/h umrechnen
-    return perfusor_rate
-
-
-# Dosissteigerungsprotokoll Funktion
-def generate_dose_increase_protocol(current_dose, target_dose, weeks, increases_per_week, weight, concentration,
-                                    pump_capacity=3, vial_capacity=10):
-    total_increases = weeks * increases_per_week
-    dose_step = (target_dose - current_dose) / total_increases
-    protocol = []
-    current_dose = current_dose
-    current_date = datetime.date.today()
-
-    current_reservoir_volume = pump_capacity  # 3 ml für die Reservoirkapazität
-    vial_refills_left = vial_capacity / pump_capacity  # Ein Vial kann 3 Mal das Reservoir füllen
-    reservoir_days_used = 0  # Zählt die Tage, die das aktuelle Reservoir in der Pumpe verbleibt
-
-    vial_usage = {}  # Um den Vial-Verbrauch pro Konzentration zu zählen
-    reservoir_changes = 0  # Anzahl der Reservoirwechsel
-    reservoir_intervals = []  # Liste der Intervalle für Reservoirwechsel
-
-    last_reservoir_change_date = None  # Um die Zeit zwischen den Reservoirwechseln zu messen
-
-    for i in range(total_increases):
-        current_date += datetime.timedelta(days=7 / increases_per_week)  # Berechnung des Datums für jede Steigerung
-        current_dose += dose_step  # Steigere die Dosis
-        infusion_rate = calculate_infusion_rate(weight, current_dose, concentration)
-        rounded_infusion_rate = round(infusion_rate)
-
-        # Verbrauch pro Tag in ml
-        daily_consumption_ml = rounded_infusion_rate * 24 / 1000  # µl in ml umrechnen
-        reservoir_days_left = current_reservoir_volume / daily_consumption_ml
-        reservoir_days_used += 7 / increases_per_week  # Zählt die Tage, die das aktuelle Reservoir verwendet wird
-
-        # Reservoirwechsel erzwingen, wenn 14 Tage erreicht sind, unabhängig vom Restvolumen
-        if reservoir_days_used >= 14 or reservoir_days_left < 1:
-            current_reservoir_volume = pump_capacity
-            vial_refills_left -= 1  # Eine Reservoirfüllung verbraucht
-            reservoir_days_used = 0  # Setze die Zähler zurück, da das Reservoir gewechselt wurde
-            reservoir_changes += 1
-
-            # Berechne das Intervall zwischen Reservoirwechseln
-            if last_reservoir_change_date:
-                interval = (current_date - last_reservoir_change_date).days
-                reservoir_intervals.append(interval)
-            last_reservoir_change_date = current_date  # Setze das Datum des letzten Reservoirwechsels
-
-            # Wenn das Vial aufgebraucht ist, ein neues Vial anfangen
-            if vial_refills_left <= 0:
-                if concentration in vial_usage:
-                    vial_usage[concentration] += 1
-                else:
-                    vial_usage[concentration] = 1
-                concentration = get_next_higher_concentration(concentration)
-                vial_refills_left = vial_capacity / pump_capacity  # Neues Vial anfangen
-                protocol.append({
-                    "Datum": current_date,
-                    "Dosis (ng/kg/min)": round(current_dose, 2),
-                    "Laufrate (µl/h)": rounded_infusion_rate,
-                    "Restvolumen im Reservoir (ml)": round(current_reservoir_volume, 2),
-                    "Hinweis": f"Vialwechsel erforderlich. Neue Konzentration: {concentration} mg/ml"
-                })
-            else:
-                protocol.append({
-                    "Datum": current_date,
-                    "Dosis (ng/kg/min)": round(current_dose, 2),
-                    "Laufrate (µl/h)": rounded_infusion_rate,
-                    "Restvolumen im Reservoir (ml)": round(current_reservoir_volume, 2),
-                    "Hinweis": "Reservoir neu gefüllt"
-                })
-        else:
-            current_reservoir_volume -= daily_consumption_ml  # Reduziere das Restvolumen im Reservoir
-            protocol.append({
-                "Datum": current_date,
-                "Dosis (ng/kg/min)": round(current_dose, 2),
-                "Laufrate (µl/h)": rounded_infusion_rate,
-                "Restvolumen im Reservoir (ml)": round(current_reservoir_volume, 2),
-                "Hinweis": ""
-            })
-
-    # Füge das letzte Vial zur Liste hinzu, falls es nicht bereits registriert wurde
-    if concentration in vial_usage:
-        vial_usage[concentration] += 1
-    else:
-        vial_usage[concentration] = 1
-
-    return protocol, vial_usage, reservoir_changes, reservoir_intervals
-
-
-# Funktion zur Erstellung der Grafik mit Reservoir-Inhalt als Balken
-def plot_dose_infusion_rate_reservoir(protocol):
-    dates = [entry["Datum"] for entry in protocol]
-    doses = [entry["Dosis (ng/kg/min)"] for entry in protocol]
-    infusion_rates = [entry["Laufrate (µl/h)"] for entry in protocol]
-    reservoir_volumes = [entry["Restvolumen im Reservoir (ml)"] for entry in protocol]
-    vial_changes = [i for i, entry in enumerate(protocol) if "Vialwechsel" in entry["Hinweis"]]
-
-    fig, ax1 = plt.subplots(figsize=(10, 5))
-
-    # Dosis darstellen
-    ax1.plot(dates, doses, marker='o', color='b', label='Dosis (ng/kg/min)')
-    ax1.set_xlabel('Datum')
-    ax1.set_ylabel('Dosis (ng/kg/min)', color='b')
-    ax1.tick_params(axis='y', labelcolor='b')
-
-    # Pumpenlaufrate darstellen (zweite y-Achse)
-    ax2 = ax1.twinx()
-    ax2.plot(dates, infusion_rates, marker='s', color='g', label='Laufrate (µl/h)')
-    ax2.set_ylabel('Laufrate (µl/h)', color='g')
-    ax2.tick_params(axis='y', labelcolor='g')
-
-    # Reservoir-Inhalt als Balken hinzufügen (separate Achse für den Bar-Plot)
-    ax3 = ax1.twinx()
-    ax3.bar(dates, reservoir_volumes, alpha=0.3, color='orange', width=1.0, label='Reservoir Inhalt (ml)')
-    ax3.set_ylabel('Reservoir Inhalt (ml)', color='orange')
-    ax3.tick_params(axis='y', labelcolor='orange')
-    ax3.spines['right'].set_position(('outward', 60))  # Verschiebe die dritte Achse nach außen
-
-    # Markiere Vialwechsel
-    for idx in vial_changes:
-        ax1.axvline(dates[idx], color='r', linestyle='--', label=f'Vialwechsel am {dates[idx]}')
-
-    plt.title('Dosissteigerungsprotokoll mit Laufrate und Reservoir-Inhalt')
-    fig.tight_layout()
-    return fig
-
-
-# Funktion zur Erstellung der Zusammenfassung
-def generate_summary(vial_usage, reservoir_changes, reservoir_intervals, total_weeks):
-    summary = f"Zusammenfassung des Dosissteigerungsprotokolls:\n"
-    summary += f"- Gesamtdauer des Protokolls: {total_weeks} Wochen\n"
-    summary += f"- Anzahl der Reservoirwechsel: {reservoir_changes}\n"
-
-    if reservoir_intervals:
-        shortest_interval = min(reservoir_intervals)
-        longest_interval = max(reservoir_intervals)
-        summary += f"- Kürzestes Intervall zwischen Reservoirwechseln: {shortest_interval} Tage\n"
-        summary += f"- Längstes Intervall zwischen Reservoirwechseln: {longest_interval} Tage\n"
-    else:
-        summary += f"- Keine Reservoirwechsel während des Protokolls\n"
-
-    summary += f"- Vialverbrauch:\n"
-
-    for concentration, count in vial_usage.items():
-        summary += f"  - {count} Vials mit {concentration} mg/ml\n"
-
-    return summary
-
-
-# Streamlit App
-st.title("Treprostinil Dosisrechner")
-
-# Tabs für die unterschiedlichen Berechnungen
-tab1, tab2, tab3, tab4 = st.tabs(["Infusionsrate", "Dosisberechnung", "Perfusor Laufrate", "Dosissteigerungsprotokoll"])
-
-# Infusionsrate berechnen
-with tab1:
-    st.markdown("### Infusionsrate berechnen (ng/kg/min -> µl/h)")
-    st.write(
-        "Berechnen Sie die Infusionsrate basierend auf dem Körpergewicht, der gewünschten Dosis (in ng/kg/min) und der Medikamentenkonzentration. Diese Berechnung ist gültig für die Apex Micro sc Infusionspumpe!")
-
-    weight_infusionsrate = st.number_input(
-        "Körpergewicht (kg):",
-        min_value=0.0, value=70.0, step=0.1,
-        help="Geben Sie das Gewicht der Person ein.",
-        key="weight_infusionsrate"
-    )
-    dose_infusionsrate = st.number_input(
-        "Gewünschte Dosis (ng/kg/min):",
-        min_value=0.0, value=10.0, step=0.1,
-        help="Geben Sie hier die gewünschte Dosis in ng/kg/min ein.",
-        key="dose_infusionsrate"
-    )
-    concentration_infusionsrate = st.selectbox(
-        "Konzentration des Medikaments (mg/ml):",
-        [1, 2.5, 5, 10, 20],
-        key="concentration_infusionsrate"
-    )
-
-    if st.button("Berechne Infusionsrate", key="infusionsrate"):
-        if weight_infusionsrate > 0 and dose_infusionsrate > 0:
-            infusion_rate = calculate_infusion_rate(weight_infusionsrate, dose_infusionsrate,
-                                                    concentration_infusionsrate)
-            st.success(f"Die berechnete Infusionsrate beträgt {infusion_rate:.2f} µl/h.")
-
-            # Berechnung der Haltbarkeit des Reservoirs in Tagen
-            reservoir_duration = calculate_reservoir_duration(infusion_rate)
-            st.info(f"Das Reservoir hält bei dieser Infusionsrate ungefähr {reservoir_duration:.2f} Tage.")
-
-            # Warnung, falls die Haltbarkeit die 14 Tage überschreitet
-            if reservoir_duration > 14:
-                st.warning(
-                    "ACHTUNG: Die Haltbarkeit des Medikaments im Reservoir beträgt maximal 14 Tage. Wechseln Sie das Reservoir früher!")
-        else:
-            st.error("Gewicht und Dosis müssen größer als 0 sein.")
-
-# Dosis berechnen
-with tab2:
-    st.markdown("### Dosis berechnen (µl/h -> ng/kg/min)")
-    st.write("Berechnen Sie die Dosis in ng/kg/min basierend auf der Pumpenlaufrate und der Medikamentenkonzentration. Diese Berechnung ist gültig für die Apex Micro sc Infusionspumpe!")
-
-    weight_dosisberechnung = st.number_input(
-        "Körpergewicht (kg):",
-        min_value=0.0, value=70.0, step=0.1,
-        help="Geben Sie das Gewicht der Person ein.",
-        key="weight_dosisberechnung"
-    )
-    infusion_rate_dosisberechnung = st.number_input(
-        "Pumpenlaufrate (µl/h):",
-        min_value=0.0, value=50.0, step=1.0,
-        help="Geben Sie hier die aktuelle Pumpenlaufrate in µl/h ein.",
-        key="infusion_rate_dosisberechnung"
-    )
-    concentration_dosisberechnung = st.selectbox(
-        "Konzentration des Medikaments (mg/ml):",
-        [1, 2.5, 5, 10, 20],
-        key="concentration_dosisberechnung"
-    )
-
-    if st.button("Berechne Dosis", key="dosis"):
-        if weight_dosisberechnung > 0 and infusion_rate_dosisberechnung > 0:
-            dose = calculate_dose_from_infusion_rate(weight_dosisberechnung, infusion_rate_dosisberechnung,
-                                                     concentration_dosisberechnung)
-            st.success(f"Die berechnete Dosis beträgt {dose:.2f} ng/kg/min.")
-        else:
-            st.error("Gewicht und Laufrate müssen größer als 0 sein.")
-
-# Perfusor-Laufrate berechnen
-with tab3:
-    st.markdown("### Perfusor Laufrate berechnen (ng/kg/min -> ml/h)")
-    st.write(
-        "Bestimmen Sie die Laufrate eines Perfusors (ml/h) basierend auf dem Gewicht, der gewünschten Dosis (ng/kg/min) und der verdünnten Medikamentenkonzentration. Die Berechnung erfolgt für einen Perfusor (50ml Perfusorspritze), der mit 1ml des Medikamentes und 49ml NaCl 0,9% aufgezogen ist! ")
-
-    weight_perfusor = st.number_input(
-        "Körpergewicht (kg):",
-        min_value=0.0, value=70.0, step=0.1,
-        help="Geben Sie das Gewicht der Person ein.",
-        key="weight_perfusor"
-    )
-    dose_perfusor = st.number_input(
-        "Gewünschte Dosis (ng/kg/min):",
-        min_value=0.0, value=10.0, step=0.1,
-        help="Geben Sie hier die gewünschte Dosis ein.",
-        key="dose_perfusor"
-    )
-    concentration_perfusor = st.selectbox(
-        "Konzentration des Medikaments (mg/ml):",
-        [1, 2.5, 5, 10, 20],
-        key="concentration_perfusor"
-    )
-
-    if st.button("Berechne Perfusor-Laufrate", key="perfusion"):
-        if weight_perfusor > 0 and dose_perfusor > 0:
-            perfusor_rate = calculate_perfusor_rate(weight_perfusor, dose_perfusor, concentration_perfusor)
-            st.success(f"Die berechnete Perfusor-Laufrate beträgt {perfusor_rate:.2f} ml/h.")
-        else:
-            st.error("Gewicht und Dosis müssen größer als 0 sein.")
-
-# Dosissteigerungsprotokoll erstellen und PDF exportieren
-with tab4:
-    st.markdown("### Dosissteigerungsprotokoll erstellen")
-    st.write(
-        "Erstellen Sie einen Plan zur schrittweisen Steigerung der Dosis bis zur Zieldosis unter Berücksichtigung der Reservoirkapazität und Vialwechsel.")
-
-    weight_protokoll = st.number_input(
-        "Körpergewicht (kg):",
-        min_value=0.0, value=70.0, step=0.1,
-        help="Geben Sie das Gewicht der Person ein.",
-        key="weight_protokoll"
-    )
-
-    current_dose_protokoll = st.number_input(
-        "Aktuelle Dosis (ng/kg/min):",
-        min_value=0.0, value=5.0, step=0.1,
-        help="Geben Sie hier die aktuelle Dosis des Patienten ein.",
-        key="current_dose_protokoll"
-    )
-
-    target_dose_protokoll = st.number_input(
-        "Zieldosis (ng/kg/min):",
-        min_value=0.0, value=10.0, step=0.1,
-        help="Geben Sie hier die Zieldosis des Patienten ein.",
-        key="target_dose_protokoll"
-    )
-
-    weeks_protokoll = st.number_input(
-        "Dauer der Steigerung (in Wochen):",
-        min_value=1, value=4, step=1,
-        help="Geben Sie hier die Anzahl der Wochen ein, über die die Dosis gesteigert werden soll.",
-        key="weeks_protokoll"
-    )
-
-    increases_per_week_protokoll = st.number_input(
-        "Anzahl der Steigerungen pro Woche:",
-        min_value=1, value=2, step=1,
-        help="Wie oft pro Woche soll die Dosis gesteigert werden?",
-        key="increases_per_week_protokoll"
-    )
-
-    concentration_protokoll = st.selectbox(
-        "Konzentration des Medikaments (mg/ml):",
-        [1, 2.5, 5, 10, 20],
-        key="concentration_protokoll"
-    )
-
-    if st.button("Dosissteigerungsprotokoll erstellen", key="steigerungsprotokoll"):
-        protocol, vial_usage, reservoir_changes, reservoir_intervals = generate_dose_increase_protocol(
-            current_dose_protokoll, target_dose_protokoll, weeks_protokoll, increases_per_week_protokoll,
-            weight_protokoll, concentration_protokoll)
-
-        # Ausgabe als Tabelle
-        df = pd.DataFrame(protocol)
-        st.write("### Dosissteigerungsprotokoll")
-        st.dataframe(df)
-
-        # Visualisierung des Protokolls in der App
-        st.write("### Dosissteigerungsdiagramm mit Pumpenlaufrate und Reservoir-Inhalt")
-        fig = plot_dose_infusion_rate_reservoir(protocol)
-        st.pyplot(fig)  # Zeige das Diagramm in der App
-
-        # Zusammenfassung des Protokolls
-        summary = generate_summary(vial_usage, reservoir_changes, reservoir_intervals, weeks_protokoll)
-        st.markdown(summary)
-
-        # Button, um das PDF zu erstellen und herunterzuladen
-        pdf_data = generate_pdf_with_graph(df, fig, summary)
-        st.download_button(
-            label="PDF herunterladen",
-            data=pdf_data,
-            file_name="dosissteigerungsprotokoll.pdf",
-            mime="application/pdf"
-
-        )
-# Versionsinformation
-st.markdown("<hr>", unsafe_allow_html=True)
-st.markdown(
-    '<p style="font-size:12px; color:red;">'
-    'Treprostinil Dosisrechner (Beta Testversion für internen Gebrauch 1.01). Erstellt von Dr. Nils Kremer. Diese App dient ausschließlich zu Informationszwecken und ersetzt nicht die ärztliche Beratung, Diagnose oder Behandlung durch qualifizierte medizinische Fachkräfte. Alle Berechnungen sollten vor der Anwendung von einem Arzt überprüft werden!'
-    '</p>',
-    unsafe_allow_html=True
-)
\ No newline at end of file
+import datetime
+import os
+import time
+
+import streamlit as st
+
+import trepro_metrics as metrics
+
+from trepro_cache import build_simulation_result, cached_protocol_result
+from trepro_core import (
+    CONCENTRATIONS,
+    EVENT_RESERVOIR_REFILL,
+    EVENT_VIAL_CHANGE,
+    LABEL_DATE,
+    LABEL_DOSE,
+    LABEL_HINT,
+    LABEL_INFUSION_RATE,
+    LABEL_RESERVOIR_VOLUME,
+    TitrationSimulation,
+    calculate_dose_from_infusion_rate,
+    calculate_infusion_rate,
+    calculate_perfusor_rate,
+    calculate_reservoir_duration,
+    describe_event,
+)
+from trepro_metrics import instrument, stage
+from trepro_nomogram import QUANTITIES, get_nomogram
+from trepro_optimizer import optimize_titration
+from trepro_render import protocol_to_dataframe
+from trepro_store import ProtocolStore
+
+# Kapazitäten der Apex Micro Pumpe (Reservoir) und eines Vials in ml
+PUMP_CAPACITY = 3
+VIAL_CAPACITY = 10
+
+# Beginn des Skriptlaufs; jede Interaktion außerhalb eines Fragments führt das ganze Skript erneut aus
+script_start = time.perf_counter()
+
+
+# Dekorator für einen Tab-Inhalt: Widgets im Fragment lösen nur einen Neulauf des Fragments aus.
+# Jeder Lauf wird als Stufe "fragment <Name>" gemessen.
+def tab_fragment(func):
+    return st.fragment(instrument(f"fragment {func.__name__}")(func))
+
+
+# Streamlit App
+st.title("Treprostinil Dosisrechner")
+
+# Tabs für die unterschiedlichen Berechnungen
+tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["Infusionsrate", "Dosisberechnung", "Perfusor Laufrate",
+                                              "Dosissteigerungsprotokoll", "Stationsübersicht", "Nomogramm"])
+
+# Infusionsrate berechnen
+@tab_fragment
+def infusion_rate_tab():
+    st.markdown("### Infusionsrate berechnen (ng/kg/min -> µl/h)")
+    st.write(
+        "Berechnen Sie die Infusionsrate basierend auf dem Körpergewicht, der gewünschten Dosis (in ng/kg/min) und der Medikamentenkonzentration. Diese Berechnung ist gültig für die Apex Micro sc Infusionspumpe!")
+
+    weight_infusionsrate = st.number_input(
+        "Körpergewicht (kg):",
+        min_value=0.0, value=70.0, step=0.1,
+        help="Geben Sie das Gewicht der Person ein.",
+        key="weight_infusionsrate"
+    )
+    dose_infusionsrate = st.number_input(
+        "Gewünschte Dosis (ng/kg/min):",
+        min_value=0.0, value=10.0, step=0.1,
+        help="Geben Sie hier die gewünschte Dosis in ng/kg/min ein.",
+        key="dose_infusionsrate"
+    )
+    concentration_infusionsrate = st.selectbox(
+        "Konzentration des Medikaments (mg/ml):",
+        [1, 2.5, 5, 10, 20],
+        key="concentration_infusionsrate"
+    )
+
+    if st.button("Berechne Infusionsrate", key="infusionsrate"):
+        if weight_infusionsrate > 0 and dose_infusionsrate > 0:
+            infusion_rate = calculate_infusion_rate(weight_infusionsrate, dose_infusionsrate,
+                                                    concentration_infusionsrate)
+            st.success(f"Die berechnete Infusionsrate beträgt {infusion_rate:.2f} µl/h.")
+
+            # Haltbarkeit des Reservoirs in Tagen
+            reservoir_duration = calculate_reservoir_duration(infusion_rate)
+            st.info(f"Das Reservoir hält bei dieser Infusionsrate ungefähr {reservoir_duration:.2f} Tage.")
+
+            # Warnung, falls die Haltbarkeit die 14 Tage überschreitet
+            if reservoir_duration > 14:
+                st.warning(
+                    "ACHTUNG: Die Haltbarkeit des Medikaments im Reservoir beträgt maximal 14 Tage. Wechseln Sie das Reservoir früher!")
+        else:
+            st.error("Gewicht und Dosis müssen größer als 0 sein.")
+
+
+with tab1:
+    infusion_rate_tab()
+
+
+# Dosis berechnen
+@tab_fragment
+def dose_tab():
+    st.markdown("### Dosis berechnen (µl/h -> ng/kg/min)")
+    st.write("Berechnen Sie die Dosis in ng/kg/min basierend auf der Pumpenlaufrate und der Medikamentenkonzentration. Diese Berechnung ist gültig für die Apex Micro sc Infusionspumpe!")
+
+    weight_dosisberechnung = st.number_input(
+        "Körpergewicht (kg):",
+        min_value=0.0, value=70.0, step=0.1,
+        help="Geben Sie das Gewicht der Person ein.",
+        key="weight_dosisberechnung"
+    )
+    infusion_rate_dosisberechnung = st.number_input(
+        "Pumpenlaufrate (µl/h):",
+        min_value=0.0, value=50.0, step=1.0,
+        help="Geben Sie hier die aktuelle Pumpenlaufrate in µl/h ein.",
+        key="infusion_rate_dosisberechnung"
+    )
+    concentration_dosisberechnung = st.selectbox(
+        "Konzentration des Medikaments (mg/ml):",
+        [1, 2.5, 5, 10, 20],
+        key="concentration_dosisberechnung"
+    )
+
+    if st.button("Berechne Dosis", key="dosis"):
+        if weight_dosisberechnung > 0 and infusion_rate_dosisberechnung > 0:
+            dose = calculate_dose_from_infusion_rate(weight_dosisberechnung, infusion_rate_dosisberechnung,
+                                                     concentration_dosisberechnung)
+            st.success(f"Die berechnete Dosis beträgt {dose:.2f} ng/kg/min.")
+        else:
+            st.error("Gewicht und Laufrate müssen größer als 0 sein.")
+
+
+with tab2:
+    dose_tab()
+
+
+# Perfusor-Laufrate berechnen
+@tab_fragment
+def perfusor_rate_tab():
+    st.markdown("### Perfusor Laufrate berechnen (ng/kg/min -> ml/h)")
+    st.write(
+        "Bestimmen Sie die Laufrate eines Perfusors (ml/h) basierend auf dem Gewicht, der gewünschten Dosis (ng/kg/min) und der verdünnten Medikamentenkonzentration. Die Berechnung erfolgt für einen Perfusor (50ml Perfusorspritze), der mit 1ml des Medikamentes und 49ml NaCl 0,9% aufgezogen ist! ")
+
+    weight_perfusor = st.number_input(
+        "Körpergewicht (kg):",
+        min_value=0.0, value=70.0, step=0.1,
+        help="Geben Sie das Gewicht der Person ein.",
+        key="weight_perfusor"
+    )
+    dose_perfusor = st.number_input(
+        "Gewünschte Dosis (ng/kg/min):",
+        min_value=0.0, value=10.0, step=0.1,
+        help="Geben Sie hier die gewünschte Dosis ein.",
+        key="dose_perfusor"
+    )
+    concentration_perfusor = st.selectbox(
+        "Konzentration des Medikaments (mg/ml):",
+        [1, 2.5, 5, 10, 20],
+        key="concentration_perfusor"
+    )
+
+    if st.button("Berechne Perfusor-Laufrate", key="perfusion"):
+        if weight_perfusor > 0 and dose_perfusor > 0:
+            perfusor_rate = calculate_perfusor_rate(weight_perfusor, dose_perfusor, concentration_perfusor)
+            st.success(f"Die berechnete Perfusor-Laufrate beträgt {perfusor_rate:.2f} ml/h.")
+        else:
+            st.error("Gewicht und Dosis müssen größer als 0 sein.")
+
+
+with tab3:
+    perfusor_rate_tab()
+
+
+# Dosissteigerungsprotokoll erstellen und PDF exportieren
+@tab_fragment
+def protocol_tab():
+    st.markdown("### Dosissteigerungsprotokoll erstellen")
+    st.write(
+        "Erstellen Sie einen Plan zur schrittweisen Steigerung der Dosis bis zur Zieldosis unter Berücksichtigung der Reservoirkapazität und Vialwechsel.")
+
+    weight_protokoll = st.number_input(
+        "Körpergewicht (kg):",
+        min_value=0.0, value=70.0, step=0.1,
+        help="Geben Sie das Gewicht der Person ein.",
+        key="weight_protokoll"
+    )
+
+    current_dose_protokoll = st.number_input(
+        "Aktuelle Dosis (ng/kg/min):",
+        min_value=0.0, value=5.0, step=0.1,
+        help="Geben Sie hier die aktuelle Dosis des Patienten ein.",
+        key="current_dose_protokoll"
+    )
+
+    target_dose_protokoll = st.number_input(
+        "Zieldosis (ng/kg/min):",
+        min_value=0.0, value=10.0, step=0.1,
+        help="Geben Sie hier die Zieldosis des Patienten ein.",
+        key="target_dose_protokoll"
+    )
+
+    weeks_protokoll = st.number_input(
+        "Dauer der Steigerung (in Wochen):",
+        min_value=1, value=4, step=1,
+        help="Geben Sie hier die Anzahl der Wochen ein, über die die Dosis gesteigert werden soll.",
+        key="weeks_protokoll"
+    )
+
+    increases_per_week_protokoll = st.number_input(
+        "Anzahl der Steigerungen pro Woche:",
+        min_value=1, value=2, step=1,
+        help="Wie oft pro Woche soll die Dosis gesteigert werden?",
+        key="increases_per_week_protokoll"
+    )
+
+    concentration_protokoll = st.selectbox(
+        "Konzentration des Medikaments (mg/ml):",
+        [1, 2.5, 5, 10, 20],
+        key="concentration_protokoll"
+    )
+
+    start_date_protokoll = st.date_input(
+        "Startdatum:",
+        value=datetime.date.today(),
+        help="Ab diesem Datum wird die Dosis gesteigert.",
+        key="start_date_protokoll"
+    )
+
+    # Das zuletzt berechnete Ergebnis bleibt im Sitzungszustand, bis sich eine Eingabe ändert
+    inputs = (weight_protokoll, current_dose_protokoll, target_dose_protokoll, weeks_protokoll,
+              increases_per_week_protokoll, concentration_protokoll, start_date_protokoll)
+    stored = st.session_state.get("protocol_result")
+    if stored is not None and stored[0] != inputs:
+        del st.session_state["protocol_result"]
+
+    if st.button("Dosissteigerungsprotokoll erstellen", key="steigerungsprotokoll"):
+        # Protokoll, Diagramm und PDF werden für gleiche Eingaben aus dem Zwischenspeicher geliefert
+        with stage("protocol_pipeline"):
+            result = cached_protocol_result(
+                weight_protokoll, current_dose_protokoll, target_dose_protokoll, weeks_protokoll,
+                increases_per_week_protokoll, concentration_protokoll, PUMP_CAPACITY, VIAL_CAPACITY,
+                start_date_protokoll)
+        st.session_state["protocol_result"] = (inputs, result)
+
+    if "protocol_result" in st.session_state:
+        result = edited_protocol_result(inputs, st.session_state["protocol_result"][1])
+
+        # Ausgabe als Tabelle
+        st.write("### Dosissteigerungsprotokoll")
+        df = protocol_to_dataframe(result.protocol)
+        with stage("st_dataframe"):
+            st.dataframe(df)
+
+        # Visualisierung des Protokolls in der App
+        st.write("### Dosissteigerungsdiagramm mit Pumpenlaufrate und Reservoir-Inhalt")
+        with stage("st_image"):
+            st.image(result.png)  # Zeige das Diagramm in der App
+
+        # Zusammenfassung des Protokolls
+        st.markdown(result.summary)
+
+        # Button, um das PDF herunterzuladen (löst keinen Neulauf aus)
+        with stage("st_download_button"):
+            st.download_button(
+                label="PDF herunterladen",
+                data=result.pdf,
+                file_name="dosissteigerungsprotokoll.pdf",
+                mime="application/pdf",
+                on_click="ignore"
+            )
+
+        protocol_editor(inputs)
+
+
+LABEL_CONCENTRATION = "Konzentration (mg/ml)"
+
+
+# Funktion zur Auswahl des angezeigten Ergebnisses: Wurde das Protokoll unter "Protokoll anpassen"
+# geändert, werden Tabelle, Diagramm und PDF aus dem angepassten Protokoll erstellt (einmal je Änderung)
+def edited_protocol_result(inputs, result):
+    entry = st.session_state.get("titration_simulation")
+    if entry is None or entry[0] != inputs or not entry[1].edits:
+        return result
+    simulation = entry[1]
+    stored = st.session_state.get("edited_protocol_result")
+    if stored is None or stored[0] != (inputs, simulation.edits):
+        with stage("protocol_pipeline_edited"):
+            stored = ((inputs, simulation.edits), build_simulation_result(simulation))
+        st.session_state["edited_protocol_result"] = stored
+    return stored[1]
+
+
+# Funktion zum Übernehmen der Änderungen aus der Tabelle (Callback vor dem Neulauf)
+def apply_protocol_edits(simulation, editor_key):
+    edited_rows = st.session_state[editor_key]["edited_rows"]
+    doses = {int(index): changes[LABEL_DOSE] for index, changes in edited_rows.items()
+             if changes.get(LABEL_DOSE) is not None}
+    concentrations = {int(index): next(conc for conc in CONCENTRATIONS if conc == changes[LABEL_CONCENTRATION])
+                      for index, changes in edited_rows.items() if changes.get(LABEL_CONCENTRATION) is not None}
+    try:
+        with stage("protocol_replay"):
+            simulation.edit(doses, concentrations)
+    except ZeroDivisionError:
+        # Laufrate rundet auf 0 µl/h; die Simulation behält den Stand vor dieser Änderung
+        st.session_state["protocol_editor_error"] = ("Die Dosis ist zu klein, die Laufrate würde 0 µl/h betragen. "
+                                                     "Die Änderung wurde nicht übernommen.")
+    # Neue Tabelle mit neuem Schlüssel, damit die Änderungen nicht erneut angewendet werden
+    st.session_state["protocol_editor_version"] += 1
+
+
+# Funktion zur Anpassung einzelner Schritte des Protokolls (Dosis halten, vorzeitiger Konzentrationswechsel).
+# Neu simuliert werden nur die Schritte ab der ersten Änderung.
+def protocol_editor(inputs):
+    with st.expander("Protokoll anpassen"):
+        st.write(
+            "Ändern Sie die Dosis oder die Konzentration einzelner Schritte. Ab dem ersten geänderten Schritt wird das Protokoll neu berechnet; ein Konzentrationswechsel beginnt mit einem neuen Vial und Reservoir.")
+
+        if "protocol_editor_error" in st.session_state:
+            st.error(st.session_state.pop("protocol_editor_error"))
+
+        version = st.session_state.setdefault("protocol_editor_version", 0)
+        entry = st.session_state.get("titration_simulation")
+        if entry is None or entry[0] != inputs:
+            weight, current_dose, target_dose, weeks, increases_per_week, concentration, start_date = inputs
+            entry = (inputs, TitrationSimulation(current_dose, target_dose, weeks, increases_per_week, weight,
+                                                 concentration, PUMP_CAPACITY, VIAL_CAPACITY, start_date))
+            st.session_state["titration_simulation"] = entry
+            version = st.session_state["protocol_editor_version"] = version + 1
+        simulation = entry[1]
+
+        editor_key = f"protocol_editor_{version}"
+        st.data_editor(
+            [{
+                LABEL_DATE: step.date,
+                LABEL_DOSE: step.dose,
+                LABEL_CONCENTRATION: step.concentration,
+                LABEL_INFUSION_RATE: step.infusion_rate,
+                LABEL_RESERVOIR_VOLUME: step.reservoir_volume,
+                LABEL_HINT: hint,
+            } for step, hint in zip(simulation.protocol, simulation.protocol.hints())],
+            key=editor_key,
+            num_rows="fixed",
+            disabled=[LABEL_DATE, LABEL_INFUSION_RATE, LABEL_RESERVOIR_VOLUME, LABEL_HINT],
+            column_config={
+                LABEL_DOSE: st.column_config.NumberColumn(min_value=0.01, step=0.01),
+                LABEL_CONCENTRATION: st.column_config.SelectboxColumn(options=CONCENTRATIONS, required=True),
+            },
+            on_change=apply_protocol_edits,
+            args=(simulation, editor_key)
+        )
+
+        st.markdown(simulation.summary())
+
+        # Speichern des (ggf. angepassten) Protokolls für die Stationsübersicht
+        patient_id = st.text_input("Patienten-ID:", key="patient_id_protokoll",
+                                   help="Unter dieser Kennung wird das Protokoll gespeichert; ein vorhandenes Protokoll des Patienten wird ersetzt.")
+        if st.button("Protokoll speichern", key="speichern"):
+            if patient_id.strip():
+                with stage("store_save"), ProtocolStore() as store:
+                    store.save_protocol(patient_id.strip(), simulation.protocol, simulation.summary())
+                st.success(f"Protokoll für Patient {patient_id.strip()} gespeichert.")
+            else:
+                st.error("Bitte eine Patienten-ID eingeben.")
+
+
+# Suche nach Plänen mit möglichst wenigen Reservoirwechseln und wenig Verwurf (eigenes Fragment,
+# die Eingaben des Protokolls werden aus dem Sitzungszustand gelesen)
+@tab_fragment
+def optimization_expander():
+    weight_protokoll = st.session_state["weight_protokoll"]
+    current_dose_protokoll = st.session_state["current_dose_protokoll"]
+    target_dose_protokoll = st.session_state["target_dose_protokoll"]
+    start_date_protokoll = st.session_state["start_date_protokoll"]
+
+    with st.expander("Plan-Optimierung"):
+        st.write(
+            "Durchsucht alle Kombinationen aus Dauer, Steigerungen pro Woche und Anfangskonzentration für die oben eingegebenen Werte und zeigt die Pläne mit den wenigsten Reservoirwechseln und dem geringsten verworfenen Vialvolumen.")
+        weeks_range_optimierung = st.slider("Dauer der Steigerung (in Wochen):", 1, 52, (2, 12),
+                                            key="weeks_range_optimierung")
+        increases_range_optimierung = st.slider("Anzahl der Steigerungen pro Woche:", 1, 7, (1, 7),
+                                                key="increases_range_optimierung")
+        concentrations_optimierung = st.multiselect("Konzentrationen (mg/ml):", CONCENTRATIONS, default=CONCENTRATIONS,
+                                                    key="concentrations_optimierung")
+        max_rate_optimierung = st.number_input(
+            "Maximale Laufrate der Pumpe (µl/h, 0 = ohne Grenze):",
+            min_value=0.0, value=0.0, step=1.0,
+            key="max_rate_optimierung"
+        )
+        max_dose_step_optimierung = st.number_input(
+            "Maximaler Dosissprung je Steigerung (ng/kg/min, 0 = ohne Grenze):",
+            min_value=0.0, value=0.0, step=0.1,
+            key="max_dose_step_optimierung"
+        )
+
+        if st.button("Pläne suchen", key="optimierung"):
+            if weight_protokoll > 0 and current_dose_protokoll > 0 and target_dose_protokoll >= current_dose_protokoll:
+                front, candidates = optimize_titration(
+                    current_dose_protokoll, target_dose_protokoll, weight_protokoll,
+                    range(weeks_range_optimierung[0], weeks_range_optimierung[1] + 1),
+                    range(increases_range_optimierung[0], increases_range_optimierung[1] + 1),
+                    concentrations_optimierung, PUMP_CAPACITY, VIAL_CAPACITY, start_date_protokoll,
+                    max_rate=max_rate_optimierung or None, max_dose_step=max_dose_step_optimierung or None)
+                st.write(f"{len(candidates)} Pläne geprüft, davon {sum(c.feasible for c in candidates)} zulässig.")
+                st.dataframe([{
+                    "Wochen": plan.weeks,
+                    "Steigerungen pro Woche": plan.increases_per_week,
+                    "Konzentration (mg/ml)": plan.concentration,
+                    "Reservoirwechsel": plan.reservoir_changes,
+                    "Verworfenes Volumen (ml)": plan.discarded_volume,
+                    "Längstes Intervall (Tage)": plan.longest_interval,
+                    "Laufrate max. (µl/h)": plan.max_infusion_rate,
+                } for plan in front])
+            else:
+                st.error("Gewicht und Dosis müssen größer als 0 sein und die Zieldosis mindestens der aktuellen Dosis entsprechen.")
+
+
+with tab4:
+    protocol_tab()
+    optimization_expander()
+
+
+# Anstehende Reservoir- und Vialwechsel aller gespeicherten Patienten
+@tab_fragment
+def ward_overview_tab():
+    st.markdown("### Stationsübersicht")
+    st.write("Zeigt die anstehenden Reservoir- und Vialwechsel aller gespeicherten Protokolle.")
+
+    start_date_station = st.date_input("Ab Datum:", value=datetime.date.today(), key="start_date_station")
+    days_station = st.number_input("Zeitraum (Tage):", min_value=1, value=7, step=1, key="days_station")
+    event_labels = {"Reservoir neu füllen": EVENT_RESERVOIR_REFILL, "Vialwechsel": EVENT_VIAL_CHANGE}
+    events_station = st.multiselect("Ereignisse:", list(event_labels), default=list(event_labels),
+                                    key="events_station")
+
+    with stage("store_upcoming_events"), ProtocolStore() as store:
+        upcoming = store.upcoming_events(start_date_station, days_station,
+                                         [event_labels[label] for label in events_station])
+        patients = store.patients()
+
+    st.write(f"### Anstehende Ereignisse ({len(upcoming)})")
+    st.dataframe([{
+        "Patient": event.patient_id,
+        LABEL_DATE: event.date,
+        LABEL_HINT: describe_event(event.event, event.concentration),
+        LABEL_DOSE: event.dose,
+        LABEL_INFUSION_RATE: event.infusion_rate,
+    } for event in upcoming])
+
+    st.write(f"### Gespeicherte Patienten ({len(patients)})")
+    st.dataframe([{
+        "Patient": patient.patient_id,
+        "Gespeichert": patient.created,
+        "Beginn": patient.first_date,
+        "Ende": patient.last_date,
+        "Schritte": patient.steps,
+    } for patient in patients])
+
+    delete_id = st.selectbox("Patient entfernen:", [""] + [patient.patient_id for patient in patients],
+                             key="delete_station")
+    st.button("Entfernen", key="entfernen", disabled=not delete_id, on_click=delete_stored_patient, args=(delete_id,))
+
+
+# Funktion zum Entfernen eines gespeicherten Patienten (Callback vor dem Neulauf)
+def delete_stored_patient(patient_id):
+    with ProtocolStore() as store:
+        store.delete_patient(patient_id)
+
+
+with tab5:
+    ward_overview_tab()
+
+
+# Nomogramm: vorberechnete Tabellen je Konzentration mit Export als PDF und CSV
+@tab_fragment
+def nomogram_tab():
+    st.markdown("### Nomogramm")
+    st.write("Vorberechnete Tabellen für Körpergewicht (Zeilen) und Dosis in ng/kg/min (Spalten).")
+
+    nomogram = get_nomogram()
+    concentration_nomogramm = st.selectbox("Konzentration des Medikaments (mg/ml):", nomogram.concentrations,
+                                           key="concentration_nomogramm")
+    quantity_nomogramm = st.selectbox("Größe:", list(QUANTITIES), format_func=lambda name: QUANTITIES[name][0],
+                                      key="quantity_nomogramm")
+    st.caption(QUANTITIES[quantity_nomogramm][1])
+
+    table = nomogram.table(quantity_nomogramm, concentration_nomogramm)
+    st.dataframe([{"kg": weight, **{f"{dose:g}": round(float(value), 2) for dose, value in zip(nomogram.doses, row)}}
+                  for weight, row in zip(nomogram.weights, table)], hide_index=True)
+
+    # PDF und CSV werden einmal je Prozess erzeugt und danach wiederverwendet
+    with stage("nomogram_export"):
+        pdf_data = nomogram.to_pdf()
+        csv_data = nomogram.to_csv()
+    st.download_button(label="Nomogramm als PDF herunterladen", data=pdf_data, file_name="nomogramm.pdf",
+                       mime="application/pdf", on_click="ignore", key="nomogramm_pdf")
+    st.download_button(label="Nomogramm als CSV herunterladen", data=csv_data, file_name="nomogramm.csv",
+                       mime="text/csv", on_click="ignore", key="nomogramm_csv")
+
+
+with tab6:
+    nomogram_tab()
+
+# Messwerte der Stufen zur Fehlersuche (TREPRO_METRICS=1 und TREPRO_METRICS_PANEL=1)
+if metrics.ENABLED and os.environ.get("TREPRO_METRICS_PANEL", "") not in ("", "0"):
+    with st.expander("Messwerte (Debug)"):
+        st.dataframe([dict(values, stage=name) for name, values in metrics.snapshot().items()])
+        st.code(metrics.prometheus_text(), language="text")
+
+# Versionsinformation
+st.markdown("<hr>", unsafe_allow_html=True)
+st.markdown(
+    '<p style="font-size:12px; color:red;">'
+    'Treprostinil Dosisrechner (Beta Testversion für internen Gebrauch 1.01). Erstellt von Dr. Nils Kremer. Diese App dient ausschließlich zu Informationszwecken und ersetzt nicht die ärztliche Beratung, Diagnose oder Behandlung durch qualifizierte medizinische Fachkräfte. Alle Berechnungen sollten vor der Anwendung von einem Arzt überprüft werden!'
+    '</p>',
+    unsafe_allow_html=True
+)
+
+# Dauer und Anzahl der vollständigen Skriptläufe (Fragment-Läufe werden je Fragment gezählt)
+if metrics.ENABLED:
+    metrics.record("script_run", time.perf_counter() - script_start)
@@ -0,0 +1,259 @@
+# Stapelverarbeitung von Dosissteigerungsprotokollen für ganze Patientenkohorten
+#
+# Aufruf:
+#   python trepro_batch.py patienten.csv -o protokolle.csv [--summary-output zusammenfassungen.csv]
+#
+# Die Eingabe (CSV oder Parquet) enthält je Patient eine Zeile mit den Spalten
+# weight, current_dose, target_dose, weeks, increases_per_week, concentration und
+# optional patient_id, pump_capacity, vial_capacity und start_date (JJJJ-MM-TT).
+# Die Patienten werden in einem Prozesspool berechnet und die Ergebnisse Zeile
+# für Zeile in die Ausgabe geschrieben, sodass der Speicherbedarf unabhängig von
+# der Kohortengröße bleibt. Fehler einzelner Patienten landen in der Spalte
+# "error", statt den Lauf abzubrechen. Für Parquet wird pyarrow benötigt.
+import argparse
+import collections
+import concurrent.futures
+import csv
+import datetime
+import math
+import os
+import sys
+
+from trepro_core import (
+    CONCENTRATIONS,
+    calculate_infusion_rate,
+    capacity_value,
+    concentration_value,
+    generate_dose_increase_protocol,
+    generate_summary,
+)
+
+PROTOCOL_COLUMNS = ["patient_id", "Datum", "Dosis (ng/kg/min)", "Laufrate (µl/h)",
+                    "Restvolumen im Reservoir (ml)", "Hinweis", "error"]
+SUMMARY_COLUMNS = ["patient_id", "reservoir_changes", "shortest_interval", "longest_interval", "summary", "error"]
+
+# Meldung, wenn die Laufrate auf 0 µl/h rundet (die Simulation teilt durch den Tagesverbrauch)
+ZERO_RATE_ERROR = "Laufrate rundet auf 0 µl/h; Gewicht oder Dosis sind für die Konzentration zu klein."
+
+# Anzahl der Zeilen pro Parquet-Zeilengruppe
+PARQUET_ROW_GROUP_SIZE = 10000
+
+# Spaltentypen für die Parquet-Ausgabe (Namen der pyarrow-Typfunktionen)
+PARQUET_TYPES = {
+    "patient_id": "string",
+    "Datum": "date32",
+    "Dosis (ng/kg/min)": "float64",
+    "Laufrate (µl/h)": "int64",
+    "Restvolumen im Reservoir (ml)": "float64",
+    "Hinweis": "string",
+    "error": "string",
+    "reservoir_changes": "int64",
+    "shortest_interval": "int64",
+    "longest_interval": "int64",
+    "summary": "string",
+    "week_start": "date32",
+    "concentration": "float64",
+    "expected_vials": "float64",
+    "p95_vials": "float64",
+}
+
+
+# Funktion zum Einlesen einer Anzahl (ganze Zahlen als int, andere Werte lehnt validate_parameters ab)
+def _parse_count(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+# Funktion zur Umwandlung einer Eingabezeile in die Parameter des Protokolls
+def patient_parameters(row):
+    start_date = row.get("start_date")
+    if isinstance(start_date, str) and start_date:
+        start_date = datetime.date.fromisoformat(start_date)
+    elif isinstance(start_date, datetime.datetime):
+        start_date = start_date.date()
+    elif not isinstance(start_date, datetime.date):
+        start_date = None
+
+    params = {
+        "current_dose": float(row["current_dose"]),
+        "target_dose": float(row["target_dose"]),
+        "weeks": _parse_count(row["weeks"]),
+        "increases_per_week": _parse_count(row["increases_per_week"]),
+        "weight": float(row["weight"]),
+        "concentration": concentration_value(float(row["concentration"])),
+        "start_date": start_date,
+    }
+    for optional in ("pump_capacity", "vial_capacity"):
+        if row.get(optional) not in (None, ""):
+            params[optional] = capacity_value(float(row[optional]))
+    return params
+
+
+# Funktion zur Prüfung der Eingaben wie in der App (liefert die Fehlermeldung oder None)
+#
+# Geprüft wird auch die Laufrate des ersten Schritts. Nach einem Vialwechsel auf
+# eine höhere Konzentration kann sie später noch auf 0 µl/h fallen; die Aufrufer
+# melden den ZeroDivisionError der Simulation dann ebenfalls mit ZERO_RATE_ERROR.
+def validate_parameters(params):
+    for name in ("weight", "current_dose", "target_dose", "concentration", "pump_capacity", "vial_capacity"):
+        if name in params and not math.isfinite(params[name]):
+            return f"Feld '{name}' muss eine endliche Zahl sein."
+    for name in ("weeks", "increases_per_week"):
+        if not isinstance(params[name], int):
+            return f"Feld '{name}' muss eine ganze Zahl sein."
+    if params["weight"] <= 0:
+        return "Gewicht muss größer als 0 sein."
+    if params["current_dose"] <= 0:
+        return "Aktuelle Dosis muss größer als 0 sein."
+    if params["target_dose"] < params["current_dose"]:
+        return "Zieldosis darf nicht kleiner als die aktuelle Dosis sein."
+    if params["weeks"] < 1 or params["increases_per_week"] < 1:
+        return "Dauer und Anzahl der Steigerungen müssen mindestens 1 sein."
+    if params["concentration"] not in CONCENTRATIONS:
+        return f"Unbekannte Konzentration {params['concentration']} mg/ml."
+    if params.get("pump_capacity", 3) <= 0 or params.get("vial_capacity", 10) <= 0:
+        return "Reservoir- und Vialkapazität müssen größer als 0 sein."
+    first_dose = params["current_dose"] + (params["target_dose"] - params["current_dose"]) / (
+        params["weeks"] * params["increases_per_week"])
+    infusion_rate = calculate_infusion_rate(params["weight"], first_dose, params["concentration"])
+    if not math.isfinite(infusion_rate):
+        return "Laufrate ist nicht endlich; Gewicht oder Dosis sind zu groß."
+    if round(infusion_rate) == 0:
+        return ZERO_RATE_ERROR
+    return None
+
+
+# Berechnung eines einzelnen Patienten (läuft im Worker-Prozess)
+def process_patient(patient_id, row):
+    try:
+        params = patient_parameters(row)
+        error = validate_parameters(params)
+        if error:
+            return patient_id, [], None, error
+        try:
+            protocol, vial_usage, reservoir_changes, reservoir_intervals = generate_dose_increase_protocol(**params)
+        except ZeroDivisionError:
+            return patient_id, [], None, ZERO_RATE_ERROR
+        summary = {
+            "reservoir_changes": reservoir_changes,
+            "shortest_interval": min(reservoir_intervals) if reservoir_intervals else None,
+            "longest_interval": max(reservoir_intervals) if reservoir_intervals else None,
+            "summary": generate_summary(vial_usage, reservoir_changes, reservoir_intervals, params["weeks"]),
+        }
+        return patient_id, protocol, summary, None
+    except Exception as exc:  # Fehler eines Patienten dürfen den Lauf nicht abbrechen
+        return patient_id, [], None, f"{type(exc).__name__}: {exc}"
+
+
+# Funktion zum zeilenweisen Lesen der Eingabe (CSV oder Parquet)
+def read_patients(path):
+    if path.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+    else:
+        with open(path, newline="", encoding="utf-8") as handle:
+            yield from csv.DictReader(handle)
+
+
+# Ausgabe als CSV, jede Zeile wird sofort geschrieben
+class CsvSink:
+    def __init__(self, path, columns):
+        self.columns = columns
+        self._handle = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._handle)
+        self._writer.writerow(columns)
+
+    def write(self, row):
+        self._writer.writerow([row.get(column) for column in self.columns])
+
+    def close(self):
+        self._handle.close()
+
+
+# Ausgabe als Parquet, gepuffert in Zeilengruppen fester Größe
+class ParquetSink:
+    def __init__(self, path, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.columns = columns
+        self._pa = pa
+        self._schema = pa.schema([(column, getattr(pa, PARQUET_TYPES[column])()) for column in columns])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._buffer = []
+
+    def write(self, row):
+        self._buffer.append({column: row.get(column) for column in self.columns})
+        if len(self._buffer) >= PARQUET_ROW_GROUP_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        self._writer.write_table(self._pa.Table.from_pylist(self._buffer, schema=self._schema))
+        self._buffer = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+# Funktion zur Auswahl der Ausgabe anhand der Dateiendung
+def open_sink(path, columns):
+    if path.lower().endswith(".parquet"):
+        return ParquetSink(path, columns)
+    return CsvSink(path, columns)
+
+
+# Funktion zur parallelen Berechnung mit begrenzter Anzahl offener Aufträge
+#
+# Es werden nie mehr als max_pending Patienten gleichzeitig gehalten, die
+# Ergebnisse kommen in der Reihenfolge der Eingabe zurück.
+def run_batch(patients, workers=None, max_pending=None):
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 4
+    pending = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for index, row in enumerate(patients, start=1):
+            patient_id = str(row.get("patient_id") or index)
+            pending.append(executor.submit(process_patient, patient_id, row))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dosissteigerungsprotokolle für eine Patientenliste erstellen")
+    parser.add_argument("input", help="CSV- oder Parquet-Datei mit den Patientenparametern")
+    parser.add_argument("-o", "--output", required=True, help="Ausgabe der Protokollzeilen (.csv oder .parquet)")
+    parser.add_argument("--summary-output", help="Optionale Ausgabe der Zusammenfassung je Patient")
+    parser.add_argument("--workers", type=int, default=None, help="Anzahl der Worker-Prozesse")
+    args = parser.parse_args(argv)
+
+    protocol_sink = open_sink(args.output, PROTOCOL_COLUMNS)
+    summary_sink = open_sink(args.summary_output, SUMMARY_COLUMNS) if args.summary_output else None
+    patients = failed = 0
+    try:
+        for patient_id, protocol, summary, error in run_batch(read_patients(args.input), args.workers):
+            patients += 1
+            if error:
+                failed += 1
+                protocol_sink.write({"patient_id": patient_id, "error": error})
+            for entry in protocol:
+                protocol_sink.write(dict(entry, patient_id=patient_id))
+            if summary_sink is not None:
+                summary_sink.write(dict(summary or {}, patient_id=patient_id, error=error))
+    finally:
+        protocol_sink.close()
+        if summary_sink is not None:
+            summary_sink.close()
+
+    print(f"{patients} Patienten verarbeitet, davon {failed} mit Fehler.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
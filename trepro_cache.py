@@ -0,0 +1,168 @@
+# Zwischenspeicher für Protokoll, Diagramm und PDF des Dosissteigerungsprotokolls
+#
+# Die Ergebnisse werden anhand der Eingaben aus Tab 4 (samt Typ) abgelegt,
+# sodass gleiche Anfragen (auch von verschiedenen Nutzern) direkt aus dem
+# Speicher bedient werden. Der Speicher ist durch ein Byte-Budget begrenzt und
+# verdrängt bei Bedarf die am längsten nicht genutzten Einträge (LRU).
+#
+# Das Budget kann über die Umgebungsvariable TREPRO_CACHE_MAX_BYTES gesetzt
+# werden (Standard: 64 MiB). Fehlt ein Eintrag, berechnet ihn nur ein Aufrufer;
+# gleichzeitige Anfragen mit demselben Schlüssel warten auf dessen Ergebnis.
+#
+# Das PDF wird mit dem Eintrag abgelegt und behält daher den Erstellungszeitpunkt
+# der ersten Berechnung, auch wenn es später (oder in einer anderen Sitzung)
+# ausgeliefert wird.
+import collections
+import copy
+import os
+import threading
+
+from trepro_core import generate_summary, simulate_dose_increase
+from trepro_metrics import stage
+from trepro_render import generate_pdf_with_graph, render_protocol_chart
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Ergebnis der Berechnung für einen Satz Eingaben
+ProtocolResult = collections.namedtuple(
+    "ProtocolResult", ["protocol", "vial_usage", "reservoir_changes", "reservoir_intervals", "summary", "png", "pdf"])
+
+
+# LRU-Zwischenspeicher mit Byte-Budget
+class LRUByteCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()  # Schlüssel -> (Wert, Größe in Bytes)
+        self._lock = threading.Lock()
+        self._pending = {}  # Schlüssel -> [Sperre, Anzahl wartender Aufrufer] für laufende Berechnungen
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return  # Zu groß für den Zwischenspeicher, wird nicht abgelegt
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    # Funktion zum Abrufen oder Berechnen eines Eintrags (je Schlüssel höchstens eine Berechnung gleichzeitig)
+    def get_or_compute(self, key, compute, sizeof):
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = [threading.Lock(), 0]
+            pending[1] += 1
+        try:
+            with pending[0]:
+                with self._lock:
+                    entry = self._entries.get(key)  # Inzwischen von einem anderen Aufrufer berechnet?
+                if entry is not None:
+                    return entry[0]
+                value = compute()
+                self.put(key, value, sizeof(value))
+                return value
+        finally:
+            with self._lock:
+                pending[1] -= 1
+                if not pending[1]:
+                    del self._pending[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Funktion zur Bildung des Schlüssels aus den Eingaben aus Tab 4
+#
+# Jeder Wert geht mit seinem Typ ein: 1 und 1.0 sind als Schlüssel gleich, ergeben
+# aber unterschiedliche Ausgaben ("1 mg/ml" bzw. "1.0 mg/ml", Restvolumen 3 bzw. 3.0).
+def protocol_cache_key(weight, current_dose, target_dose, weeks, increases_per_week, concentration,
+                       pump_capacity, vial_capacity, start_date):
+    values = (weight, current_dose, target_dose, weeks, increases_per_week, concentration, pump_capacity,
+              vial_capacity)
+    return tuple((type(value).__name__, value) for value in values) + (start_date.isoformat(),)
+
+
+# Funktion zur Schätzung des Speicherbedarfs eines Ergebnisses
+def result_size(result):
+    return len(result.png) + len(result.pdf) + len(result.summary) + result.protocol.nbytes
+
+
+# Funktion zur Erstellung von Zusammenfassung, Diagramm (PNG) und PDF zu einem Protokoll
+def _render_result(protocol, vial_usage, reservoir_changes, reservoir_intervals, weeks):
+    with stage("generate_summary"):
+        summary = generate_summary(vial_usage, reservoir_changes, reservoir_intervals, weeks)
+
+    png = render_protocol_chart(protocol)
+    pdf = generate_pdf_with_graph(protocol, png, summary)
+
+    return ProtocolResult(protocol, vial_usage, reservoir_changes, reservoir_intervals, summary, png, pdf)
+
+
+# Funktion zur Berechnung von Protokoll, Diagramm (PNG) und PDF
+def build_protocol_result(weight, current_dose, target_dose, weeks, increases_per_week, concentration,
+                          pump_capacity, vial_capacity, start_date):
+    with stage("simulate_dose_increase"):
+        protocol, vial_usage, reservoir_changes, reservoir_intervals = simulate_dose_increase(
+            current_dose, target_dose, weeks, increases_per_week, weight, concentration,
+            pump_capacity, vial_capacity, start_date)
+    return _render_result(protocol, vial_usage, reservoir_changes, reservoir_intervals, weeks)
+
+
+# Funktion zur Erstellung von Diagramm (PNG) und PDF zum aktuellen Stand einer TitrationSimulation
+#
+# Angepasste Protokolle werden nicht im gemeinsamen Zwischenspeicher abgelegt;
+# das Protokoll wird kopiert, damit spätere Änderungen das Ergebnis nicht verändern.
+def build_simulation_result(simulation):
+    protocol, vial_usage, reservoir_changes, reservoir_intervals = simulation.result()
+    return _render_result(copy.deepcopy(protocol), vial_usage, reservoir_changes, reservoir_intervals,
+                          simulation.weeks)
+
+
+# Gemeinsamer Zwischenspeicher für alle Sitzungen eines Prozesses
+protocol_cache = LRUByteCache(int(os.environ.get("TREPRO_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)))
+
+
+# Funktion zum Abrufen eines Protokolls aus dem Zwischenspeicher (oder Neuberechnung)
+def cached_protocol_result(weight, current_dose, target_dose, weeks, increases_per_week, concentration,
+                           pump_capacity, vial_capacity, start_date, cache=protocol_cache):
+    key = protocol_cache_key(weight, current_dose, target_dose, weeks, increases_per_week, concentration,
+                             pump_capacity, vial_capacity, start_date)
+    return cache.get_or_compute(
+        key,
+        lambda: build_protocol_result(weight, current_dose, target_dose, weeks, increases_per_week, concentration,
+                                      pump_capacity, vial_capacity, start_date),
+        result_size)
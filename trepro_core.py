@@ -0,0 +1,520 @@
+# Rechenkern des Treprostinil Dosisrechners
+#
+# Dieses Modul enthält ausschließlich die Berechnungsfunktionen und kommt ohne
+# Streamlit, pandas, matplotlib oder fpdf aus. Es kann daher schnell importiert
+# und in Batch-Jobs, Tests oder anderen Diensten direkt verwendet werden.
+import array
+import collections
+import copy
+import datetime
+
+
+# Verfügbare Konzentrationen in mg/ml
+CONCENTRATIONS = [1, 2.5, 5, 10, 20]
+
+
+# Funktion zur Ermittlung der nächsthöheren Konzentration
+def get_next_higher_concentration(current_concentration):
+    for conc in CONCENTRATIONS:
+        if conc > current_concentration:
+            return conc
+    return current_concentration  # Rückgabe der aktuellen Konzentration, wenn keine höhere gefunden wird
+
+
+# Konzentration wie in der Liste der Konzentrationen (1 statt 1.0), damit die Hinweise gleich lauten wie in der App
+def concentration_value(concentration):
+    for conc in CONCENTRATIONS:
+        if conc == concentration:
+            return conc
+    return concentration
+
+
+# Kapazität wie in der App (3 statt 3.0), damit das Restvolumen nach einem Wechsel gleich lautet
+def capacity_value(capacity):
+    return int(capacity) if float(capacity).is_integer() else capacity
+
+
+# Funktion zur Berechnung der Laufrate in µl/h
+def calculate_infusion_rate(weight, dose, concentration):
+    dose_mcg_per_min = dose * weight / 1000  # ng/kg/min in µg/min umrechnen
+    dose_mg_per_h = dose_mcg_per_min * 60 / 1000  # µg/min in mg/h umrechnen
+    infusion_rate = dose_mg_per_h / concentration * 1000  # mg/h in µl/h umrechnen
+    return infusion_rate
+
+
+# Funktion zur Berechnung der Haltbarkeit des Reservoirs in Tagen
+def calculate_reservoir_duration(infusion_rate, reservoir_volume=3):
+    reservoir_duration_hours = (
+                                           reservoir_volume * 1000) / infusion_rate  # Reservoirvolumen in µl, Infusionsrate in µl/h
+    reservoir_duration_days = reservoir_duration_hours / 24  # in Tagen umrechnen
+    return reservoir_duration_days
+
+
+# Funktion zur Berechnung der Dosis in ng/kg/min basierend auf der Laufrate
+def calculate_dose_from_infusion_rate(weight, infusion_rate, concentration):
+    dose_mg_per_h = infusion_rate * concentration / 1000  # µl/h in mg/h umrechnen
+    dose_mcg_per_min = dose_mg_per_h * 1000 / 60  # mg/h in µg/min umrechnen
+    dose_ng_per_kg_min = dose_mcg_per_min / weight * 1000  # µg/min in ng/kg/min umrechnen
+    return dose_ng_per_kg_min
+
+
+# Funktion zur Berechnung der Perfusor-Laufrate in ml/h
+def calculate_perfusor_rate(weight, dose, concentration):
+    diluted_concentration = concentration / 50  # Konzentration des verdünnten Medikaments
+    dose_mcg_per_min = dose * weight / 1000  # ng/kg/min in µg/min umrechnen
+    dose_mg_per_h = dose_mcg_per_min * 60 / 1000  # µg/min in mg/h umrechnen
+    perfusor_rate = dose_mg_per_h / diluted_concentration  # mg/h in ml/h umrechnen
+    return perfusor_rate
+
+
+# Ereigniscodes des Protokolls
+EVENT_NONE = 0  # Nur Dosissteigerung
+EVENT_RESERVOIR_REFILL = 1  # Reservoir neu gefüllt
+EVENT_VIAL_CHANGE = 2  # Vial aufgebraucht, Wechsel auf die nächsthöhere Konzentration
+
+# Maximale Verweildauer des Medikaments im Reservoir in Tagen
+MAX_RESERVOIR_DAYS = 14
+
+# Anzeigenamen der Protokollspalten (werden erst bei der Ausgabe verwendet)
+LABEL_DATE = "Datum"
+LABEL_DOSE = "Dosis (ng/kg/min)"
+LABEL_INFUSION_RATE = "Laufrate (µl/h)"
+LABEL_RESERVOIR_VOLUME = "Restvolumen im Reservoir (ml)"
+LABEL_HINT = "Hinweis"
+
+# Eine Zeile des Protokolls (Dosis und Volumen bereits gerundet wie in der Tabelle)
+ProtocolEvent = collections.namedtuple(
+    "ProtocolEvent", ["date", "dose", "infusion_rate", "reservoir_volume", "event", "concentration"])
+
+
+# Spaltenweise Darstellung des Dosissteigerungsprotokolls
+#
+# Jede Spalte ist ein typisiertes array.array; das Datum wird als Ordinalzahl
+# gespeichert, der Hinweis als Ereigniscode. Über das Pufferprotokoll können
+# NumPy und pandas die Zahlenspalten ohne Kopie verwenden. Anzeigenamen und
+# Hinweistexte entstehen erst bei der Ausgabe (to_records, table_rows).
+class Protocol:
+    def __init__(self, pump_capacity=3, initial_concentration=None):
+        self.pump_capacity = pump_capacity
+        self.initial_concentration = initial_concentration
+        self.date_ordinals = array.array('q')
+        self.doses = array.array('d')
+        self.infusion_rates = array.array('q')
+        self.reservoir_volumes = array.array('d')
+        self.events = array.array('b')
+        self.concentrations = array.array('d')
+
+    def append(self, date, dose, infusion_rate, reservoir_volume, event, concentration):
+        self.date_ordinals.append(date.toordinal())
+        self.doses.append(dose)
+        self.infusion_rates.append(infusion_rate)
+        self.reservoir_volumes.append(reservoir_volume)
+        self.events.append(event)
+        self.concentrations.append(concentration)
+
+    def __len__(self):
+        return len(self.events)
+
+    # Funktion zum Verwerfen aller Schritte ab length
+    def truncate(self, length):
+        for column in (self.date_ordinals, self.doses, self.infusion_rates, self.reservoir_volumes, self.events,
+                       self.concentrations):
+            del column[length:]
+
+    # Speicherbedarf der Spalten in Bytes
+    @property
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in (
+            self.date_ordinals, self.doses, self.infusion_rates, self.reservoir_volumes, self.events,
+            self.concentrations))
+
+    def dates(self):
+        return [datetime.date.fromordinal(ordinal) for ordinal in self.date_ordinals]
+
+    # Konzentration so, wie sie in der Eingabe bzw. in der Liste der Konzentrationen steht
+    def _concentration_value(self, concentration):
+        if concentration == self.initial_concentration:
+            return self.initial_concentration
+        return concentration_value(concentration)
+
+    # Restvolumen wie in der Tabelle (nach einem Wechsel die Reservoirkapazität)
+    def _reservoir_volume_value(self, index):
+        if self.events[index] != EVENT_NONE:
+            return round(self.pump_capacity, 2)
+        return self.reservoir_volumes[index]
+
+    def row(self, index):
+        return ProtocolEvent(datetime.date.fromordinal(self.date_ordinals[index]), self.doses[index],
+                             self.infusion_rates[index], self._reservoir_volume_value(index), self.events[index],
+                             self._concentration_value(self.concentrations[index]))
+
+    def __iter__(self):
+        return (self.row(index) for index in range(len(self)))
+
+    # Hinweistexte je Zeile (nur Zeilen mit Ereignis werden formatiert)
+    def hints(self):
+        return ["" if event == EVENT_NONE else describe_event(event, self._concentration_value(concentration))
+                for event, concentration in zip(self.events, self.concentrations)]
+
+    # Restvolumen je Zeile wie in der Tabelle (nach einem Wechsel die Reservoirkapazität)
+    def _reservoir_volume_column(self):
+        refilled = round(self.pump_capacity, 2)
+        return [volume if event == EVENT_NONE else refilled
+                for volume, event in zip(self.reservoir_volumes, self.events)]
+
+    # Zeilen für Tabellen (Datum, Dosis, Laufrate, Restvolumen, Hinweis) mit den Spaltentypen
+    def table_rows(self):
+        return zip(self.dates(), self.doses, self.infusion_rates, self.reservoir_volumes, self.hints())
+
+    # Ausgabe als Liste von Dictionaries mit den Anzeigenamen der Spalten (bisheriges Format)
+    #
+    # Die Spalten werden direkt zusammengeführt, ohne Umweg über row().
+    def to_records(self):
+        return [{
+            LABEL_DATE: date,
+            LABEL_DOSE: dose,
+            LABEL_INFUSION_RATE: infusion_rate,
+            LABEL_RESERVOIR_VOLUME: reservoir_volume,
+            LABEL_HINT: hint
+        } for date, dose, infusion_rate, reservoir_volume, hint in zip(
+            self.dates(), self.doses, self.infusion_rates, self._reservoir_volume_column(), self.hints())]
+
+    # Umwandlung einer Liste von Dictionaries (bisheriges Format) in ein Protokoll
+    @classmethod
+    def from_records(cls, records, pump_capacity=3):
+        protocol = cls(pump_capacity)
+        for entry in records:
+            hint = entry[LABEL_HINT]
+            concentration = float("nan")
+            if "Vialwechsel" in hint:
+                event = EVENT_VIAL_CHANGE
+                concentration = float(hint.split("Konzentration:")[1].split()[0])
+            elif hint:
+                event = EVENT_RESERVOIR_REFILL
+            else:
+                event = EVENT_NONE
+            protocol.append(entry[LABEL_DATE], entry[LABEL_DOSE], entry[LABEL_INFUSION_RATE],
+                            entry[LABEL_RESERVOIR_VOLUME], event, concentration)
+        return protocol
+
+
+# Funktion zur Umwandlung eines Protokolls im bisherigen Listenformat
+def as_protocol(protocol):
+    if isinstance(protocol, Protocol):
+        return protocol
+    return Protocol.from_records(protocol)
+
+
+# Funktion zur Erzeugung der Dosisschritte (Datum und ungerundete Dosis je Steigerung)
+def dose_steps(current_dose, target_dose, weeks, increases_per_week, start_date=None):
+    total_increases = weeks * increases_per_week
+    dose_step = (target_dose - current_dose) / total_increases
+    step_delta = datetime.timedelta(days=7 / increases_per_week)
+    current_date = start_date if start_date is not None else datetime.date.today()
+    for _ in range(total_increases):
+        current_date += step_delta  # Berechnung des Datums für jede Steigerung
+        current_dose += dose_step  # Steigere die Dosis
+        yield current_date, current_dose
+
+
+# Zwischenstand der Simulation: Reservoir, angebrochenes Vial und Zähler der Zusammenfassung
+class SimulationState:
+    __slots__ = ("reservoir_volume", "days_used", "refills_left", "concentration", "vial_usage",
+                 "reservoir_changes", "reservoir_intervals", "last_change_date")
+
+    def __init__(self, pump_capacity, vial_capacity, concentration):
+        self.reservoir_volume = pump_capacity  # 3 ml für die Reservoirkapazität
+        self.days_used = 0  # Zählt die Tage, die das aktuelle Reservoir in der Pumpe verbleibt
+        self.refills_left = vial_capacity / pump_capacity  # Ein Vial kann 3 Mal das Reservoir füllen
+        self.concentration = concentration
+        self.vial_usage = {}  # Um den Vial-Verbrauch pro Konzentration zu zählen
+        self.reservoir_changes = 0  # Anzahl der Reservoirwechsel
+        self.reservoir_intervals = []  # Liste der Intervalle für Reservoirwechsel
+        self.last_change_date = None  # Um die Zeit zwischen den Reservoirwechseln zu messen
+
+
+# Zustand der Simulation nach jedem Schritt
+#
+# Gespeichert wird nur, was sich nicht aus dem Protokoll ablesen lässt: die
+# ungerundete Dosis (Eingabe des Schritts), das ungerundete Restvolumen, die
+# Tage des aktuellen Reservoirs, die verbleibenden Füllungen des Vials und je
+# verbrauchtem Vial der Schritt und die Konzentration. Konzentration,
+# Reservoirwechsel und Intervalle bis zu einem Schritt stehen im Protokoll.
+class SimulationCheckpoints:
+    def __init__(self):
+        self.doses = array.array('d')
+        self.reservoir_volumes = array.array('d')
+        self.days_used = array.array('d')
+        self.refills_left = array.array('d')
+        self.vial_log = []
+
+    def append(self, dose, reservoir_volume, days_used, refills_left):
+        self.doses.append(dose)
+        self.reservoir_volumes.append(reservoir_volume)
+        self.days_used.append(days_used)
+        self.refills_left.append(refills_left)
+
+    def __len__(self):
+        return len(self.doses)
+
+    # Funktion zum Verwerfen aller Schritte ab step, liefert die verworfenen Vials
+    def truncate(self, step):
+        for column in (self.doses, self.reservoir_volumes, self.days_used, self.refills_left):
+            del column[step:]
+        dropped = []
+        while self.vial_log and self.vial_log[-1][0] >= step:
+            dropped.append(self.vial_log.pop())
+        return dropped
+
+
+# Simulation einer Folge von Dosisschritten
+#
+# Wie in der ursprünglichen Schleife wird nur an den Dosisschritten geprüft, ob
+# ein Reservoirwechsel (14 Tage erreicht oder weniger als 1 Tag Restvolumen) oder
+# ein Vialwechsel fällig ist; das Protokoll hat eine Zeile je Schritt. Die
+# Schritte werden an protocol angehängt und state wird fortgeschrieben.
+# concentration_switches ({Schritt: Konzentration}) erzwingt an einem Schritt
+# den Wechsel auf ein neues Vial dieser Konzentration.
+def _simulate_steps(state, steps, protocol, weight, pump_capacity, vial_capacity, step_days,
+                    checkpoints=None, first_step=0, concentration_switches=None):
+    refills_per_vial = vial_capacity / pump_capacity
+    current_reservoir_volume = state.reservoir_volume
+    reservoir_days_used = state.days_used
+    vial_refills_left = state.refills_left
+    concentration = state.concentration
+    vial_usage = state.vial_usage
+    reservoir_changes = state.reservoir_changes
+    reservoir_intervals = state.reservoir_intervals
+    last_reservoir_change_date = state.last_change_date
+
+    for index, (current_date, dose) in enumerate(steps, first_step):
+        # Vorzeitiger Wechsel der Konzentration: angebrochenes Vial verwerfen
+        switched = False
+        if concentration_switches:
+            new_concentration = concentration_switches.get(index)
+            if new_concentration is not None and new_concentration != concentration:
+                vial_usage[concentration] = vial_usage.get(concentration, 0) + 1
+                if checkpoints is not None:
+                    checkpoints.vial_log.append((index, concentration))
+                concentration = new_concentration
+                vial_refills_left = refills_per_vial
+                switched = True
+
+        rounded_infusion_rate = round(calculate_infusion_rate(weight, dose, concentration))
+
+        # Verbrauch pro Tag in ml
+        daily_consumption_ml = rounded_infusion_rate * 24 / 1000  # µl in ml umrechnen
+        reservoir_days_left = current_reservoir_volume / daily_consumption_ml
+        reservoir_days_used += step_days
+
+        # Reservoirwechsel erzwingen, wenn 14 Tage erreicht sind, unabhängig vom Restvolumen
+        if switched or reservoir_days_used >= MAX_RESERVOIR_DAYS or reservoir_days_left < 1:
+            current_reservoir_volume = pump_capacity
+            vial_refills_left -= 1  # Eine Reservoirfüllung verbraucht
+            reservoir_days_used = 0
+            reservoir_changes += 1
+
+            if last_reservoir_change_date:
+                reservoir_intervals.append((current_date - last_reservoir_change_date).days)
+            last_reservoir_change_date = current_date
+
+            # Wenn das Vial aufgebraucht ist, ein neues Vial anfangen
+            if vial_refills_left <= 0:
+                vial_usage[concentration] = vial_usage.get(concentration, 0) + 1
+                if checkpoints is not None:
+                    checkpoints.vial_log.append((index, concentration))
+                concentration = get_next_higher_concentration(concentration)
+                vial_refills_left = refills_per_vial
+                event = EVENT_VIAL_CHANGE
+            else:
+                event = EVENT_VIAL_CHANGE if switched else EVENT_RESERVOIR_REFILL
+        else:
+            current_reservoir_volume -= daily_consumption_ml  # Reduziere das Restvolumen im Reservoir
+            event = EVENT_NONE
+
+        protocol.append(current_date, round(dose, 2), rounded_infusion_rate, round(current_reservoir_volume, 2),
+                        event, concentration)
+        if checkpoints is not None:
+            checkpoints.append(dose, current_reservoir_volume, reservoir_days_used, vial_refills_left)
+
+    state.reservoir_volume = current_reservoir_volume
+    state.days_used = reservoir_days_used
+    state.refills_left = vial_refills_left
+    state.concentration = concentration
+    state.reservoir_changes = reservoir_changes
+    state.last_change_date = last_reservoir_change_date
+
+
+# Funktion zur Zusammenstellung des Vialverbrauchs einschließlich des zuletzt angebrochenen Vials
+def _final_vial_usage(state):
+    vial_usage = dict(state.vial_usage)
+    vial_usage[state.concentration] = vial_usage.get(state.concentration, 0) + 1
+    return vial_usage
+
+
+# Simulation des Dosissteigerungsprotokolls
+def simulate_dose_increase(current_dose, target_dose, weeks, increases_per_week, weight, concentration,
+                           pump_capacity=3, vial_capacity=10, start_date=None):
+    state = SimulationState(pump_capacity, vial_capacity, concentration)
+    protocol = Protocol(pump_capacity, concentration)
+    _simulate_steps(state, dose_steps(current_dose, target_dose, weeks, increases_per_week, start_date), protocol,
+                    weight, pump_capacity, vial_capacity, 7 / increases_per_week)
+    return protocol, _final_vial_usage(state), state.reservoir_changes, state.reservoir_intervals
+
+
+# Dosissteigerungsprotokoll mit Zwischenständen je Schritt
+#
+# Wird ein Schritt k geändert (Dosis halten oder anpassen, vorzeitiger Wechsel
+# der Konzentration), werden mit edit() nur die Schritte k..n neu simuliert. Der
+# Zustand vor Schritt k wird aus den Zwischenständen übernommen; Reservoirwechsel,
+# Intervalle und Vialverbrauch werden um die verworfenen Schritte korrigiert.
+# Einmal geänderte Dosen und Konzentrationswechsel bleiben bei späteren
+# Änderungen erhalten; edits zählt die übernommenen Änderungen.
+class TitrationSimulation:
+    def __init__(self, current_dose, target_dose, weeks, increases_per_week, weight, concentration,
+                 pump_capacity=3, vial_capacity=10, start_date=None):
+        self.weeks = weeks
+        self.weight = weight
+        self.pump_capacity = pump_capacity
+        self.vial_capacity = vial_capacity
+        self.step_days = 7 / increases_per_week
+        self.initial_concentration = concentration
+        self.concentration_switches = {}
+        self.edits = 0
+
+        self.state = SimulationState(pump_capacity, vial_capacity, concentration)
+        self.protocol = Protocol(pump_capacity, concentration)
+        self.checkpoints = SimulationCheckpoints()
+        _simulate_steps(self.state, dose_steps(current_dose, target_dose, weeks, increases_per_week, start_date),
+                        self.protocol, weight, pump_capacity, vial_capacity, self.step_days, self.checkpoints)
+
+    def __len__(self):
+        return len(self.protocol)
+
+    # Ergebnis wie simulate_dose_increase
+    def result(self):
+        return self.protocol, _final_vial_usage(self.state), self.state.reservoir_changes, list(
+            self.state.reservoir_intervals)
+
+    def summary(self):
+        return generate_summary(*self.result()[1:], self.weeks)
+
+    # Funktion zum Zurücksetzen des Zustands auf den Stand vor Schritt step
+    def _rewind(self, step):
+        state, protocol, checkpoints = self.state, self.protocol, self.checkpoints
+        events = protocol.events
+
+        state.reservoir_changes -= len(events) - step - events[step:].count(EVENT_NONE)
+        del state.reservoir_intervals[max(state.reservoir_changes - 1, 0):]
+        state.last_change_date = None
+        for index in range(step - 1, -1, -1):
+            if events[index] != EVENT_NONE:
+                state.last_change_date = datetime.date.fromordinal(protocol.date_ordinals[index])
+                break
+
+        for _, concentration in checkpoints.truncate(step):
+            state.vial_usage[concentration] -= 1
+            if not state.vial_usage[concentration]:
+                del state.vial_usage[concentration]
+
+        if step:
+            state.reservoir_volume = checkpoints.reservoir_volumes[step - 1]
+            state.days_used = checkpoints.days_used[step - 1]
+            state.refills_left = checkpoints.refills_left[step - 1]
+            state.concentration = protocol._concentration_value(protocol.concentrations[step - 1])
+        else:
+            state.reservoir_volume = self.pump_capacity
+            state.days_used = 0
+            state.refills_left = self.vial_capacity / self.pump_capacity
+            state.concentration = self.initial_concentration
+        protocol.truncate(step)
+
+    # Funktion zum Ändern einzelner Schritte ({Schritt: Dosis}, {Schritt: Konzentration}),
+    # liefert den ersten neu simulierten Schritt
+    #
+    # Scheitert die Neuberechnung (Laufrate rundet auf 0 µl/h: ZeroDivisionError),
+    # bleibt der Stand vor der Änderung samt früherer Änderungen erhalten.
+    def edit(self, doses=None, concentrations=None):
+        doses = doses or {}
+        concentrations = concentrations or {}
+        changed = [index for index in (*doses, *concentrations) if 0 <= index < len(self)]
+        if not changed:
+            return len(self)
+        step = min(changed)
+
+        planned = self.checkpoints.doses[step:].tolist()
+        for index, dose in doses.items():
+            if step <= index < len(self):
+                planned[index - step] = dose
+        dates = [datetime.date.fromordinal(ordinal) for ordinal in self.protocol.date_ordinals[step:]]
+        backup = copy.deepcopy((self.state, self.protocol, self.checkpoints, self.concentration_switches))
+        self.concentration_switches.update(concentrations)
+
+        try:
+            self._rewind(step)
+            _simulate_steps(self.state, zip(dates, planned), self.protocol, self.weight, self.pump_capacity,
+                            self.vial_capacity, self.step_days, self.checkpoints, step, self.concentration_switches)
+        except ZeroDivisionError:
+            self.state, self.protocol, self.checkpoints, self.concentration_switches = backup
+            raise
+        self.edits += 1
+        return step
+
+
+# Funktion zur Beschreibung eines Ereignisses für die Spalte "Hinweis"
+def describe_event(event, concentration):
+    if event == EVENT_VIAL_CHANGE:
+        return f"Vialwechsel erforderlich. Neue Konzentration: {concentration} mg/ml"
+    if event == EVENT_RESERVOIR_REFILL:
+        return "Reservoir neu gefüllt"
+    return ""
+
+
+# Protokoll als Liste von Dictionaries, die während der Simulation direkt befüllt wird
+#
+# Ersetzt Protocol in generate_dose_increase_protocol: Restvolumen und
+# Konzentration bleiben dabei unverändert (ohne Umweg über die array-Spalten).
+class _ProtocolRecords:
+    def __init__(self):
+        self.records = []
+
+    def append(self, date, dose, infusion_rate, reservoir_volume, event, concentration):
+        self.records.append({
+            LABEL_DATE: date,
+            LABEL_DOSE: dose,
+            LABEL_INFUSION_RATE: infusion_rate,
+            LABEL_RESERVOIR_VOLUME: reservoir_volume,
+            LABEL_HINT: describe_event(event, concentration)
+        })
+
+
+# Dosissteigerungsprotokoll Funktion (Ausgabe als Liste von Dictionaries mit Anzeigenamen)
+def generate_dose_increase_protocol(current_dose, target_dose, weeks, increases_per_week, weight, concentration,
+                                    pump_capacity=3, vial_capacity=10, start_date=None):
+    state = SimulationState(pump_capacity, vial_capacity, concentration)
+    protocol = _ProtocolRecords()
+    _simulate_steps(state, dose_steps(current_dose, target_dose, weeks, increases_per_week, start_date), protocol,
+                    weight, pump_capacity, vial_capacity, 7 / increases_per_week)
+    return protocol.records, _final_vial_usage(state), state.reservoir_changes, state.reservoir_intervals
+
+
+# Funktion zur Erstellung der Zusammenfassung
+def generate_summary(vial_usage, reservoir_changes, reservoir_intervals, total_weeks):
+    summary = f"Zusammenfassung des Dosissteigerungsprotokolls:\n"
+    summary += f"- Gesamtdauer des Protokolls: {total_weeks} Wochen\n"
+    summary += f"- Anzahl der Reservoirwechsel: {reservoir_changes}\n"
+
+    if reservoir_intervals:
+        shortest_interval = min(reservoir_intervals)
+        longest_interval = max(reservoir_intervals)
+        summary += f"- Kürzestes Intervall zwischen Reservoirwechseln: {shortest_interval} Tage\n"
+        summary += f"- Längstes Intervall zwischen Reservoirwechseln: {longest_interval} Tage\n"
+    else:
+        summary += f"- Keine Reservoirwechsel während des Protokolls\n"
+
+    summary += f"- Vialverbrauch:\n"
+
+    for concentration, count in vial_usage.items():
+        summary += f"  - {count} Vials mit {concentration} mg/ml\n"
+
+    return summary
@@ -0,0 +1,327 @@
+# Monte-Carlo-Prognose des Vialbedarfs für eine Patientenkohorte
+#
+# Aufruf:
+#   python trepro_forecast.py kohorte.csv -o bedarf.csv [--chart bedarf.png] [--variants 1000]
+#                             [--seed 1] [--workers 4]
+#
+# Für jeden Patienten werden viele zufällige Varianten der Titration simuliert:
+#   - Gewichtsverlauf: je Variante eine Drift in Prozent pro Woche (normalverteilt)
+#   - ausgelassene bzw. verschobene Steigerungen: die Dosis bleibt an diesem
+#     Schritt gleich, die Steigerung wird am nächsten Schritt nachgeholt
+#   - vorzeitige Reservoirwechsel (z.B. Verschluss oder Hautreaktion)
+# Die Simulation folgt Schritt für Schritt simulate_dose_increase, rechnet aber
+# alle Varianten aller Patienten eines Blocks gleichzeitig als NumPy-Arrays.
+# Ohne Zufallseinflüsse ergibt sich genau der Vialverbrauch aus
+# simulate_dose_increase.
+#
+# Gezählt wird je Variante, wann ein Vial welcher Konzentration angebrochen wird
+# (Kalenderwoche ab dem Prognosebeginn). Variante r aller Patienten bildet einen
+# möglichen Verlauf der ganzen Kohorte; über die Varianten ergeben sich
+# Erwartungswert und 95-%-Quantil des Bedarfs je Konzentration und Woche.
+# Große Kohorten werden in Blöcke geteilt, die optional in einem Prozesspool laufen.
+#
+# Patienten werden wie in trepro_batch geprüft; Patienten, deren Laufrate ohne
+# Zufallseinflüsse auf 0 µl/h rundet (auch erst nach einem Vialwechsel), werden
+# abgelehnt statt mitgezählt, ebenso Patienten, deren Titration vor dem
+# Prognosebeginn startet (ihre ersten Vials lägen vor der ersten Woche).
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import sys
+
+import numpy as np
+
+from trepro_batch import ZERO_RATE_ERROR, open_sink, patient_parameters, read_patients, validate_parameters
+from trepro_core import CONCENTRATIONS, MAX_RESERVOIR_DAYS, simulate_dose_increase
+
+# Anzahl der Zeilen (Patienten mal Varianten) je Block
+CHUNK_ROWS = 200000
+
+FORECAST_COLUMNS = ["week_start", "concentration", "expected_vials", "p95_vials"]
+
+# Ergebnis der Prognose: expected und p95 haben die Form (Konzentrationen, Wochen)
+VialForecast = collections.namedtuple("VialForecast", [
+    "start_date", "week_starts", "concentrations", "expected", "p95", "variants", "patients"])
+
+
+# Funktion zur Prüfung eines Patienten (liefert die Fehlermeldung oder None)
+#
+# Neben validate_parameters wird das Protokoll einmal ohne Zufall simuliert, damit
+# eine Laufrate von 0 µl/h nach einem Vialwechsel wie in der Stapelverarbeitung
+# zur Ablehnung führt.
+def _patient_error(params):
+    error = validate_parameters(params)
+    if error:
+        return error
+    try:
+        simulate_dose_increase(**params)
+    except ZeroDivisionError:
+        return ZERO_RATE_ERROR
+    return None
+
+
+# Funktion zur Prüfung des Titrationsbeginns gegen den Prognosebeginn (liefert die Fehlermeldung oder None)
+def _start_error(params, start_date):
+    patient_start = params.get("start_date")
+    if patient_start is not None and patient_start < start_date:
+        return f"Titrationsbeginn {patient_start} liegt vor dem Prognosebeginn {start_date}."
+    return None
+
+
+# Funktion zur Umwandlung der Patientenparameter in Spalten (ein Eintrag je Patient)
+def _cohort_columns(patients, start_date):
+    columns = collections.defaultdict(list)
+    for params in patients:
+        error = _patient_error(params) or _start_error(params, start_date)
+        if error:
+            raise ValueError(error)
+        ipw = params["increases_per_week"]
+        pump_capacity = params.get("pump_capacity", 3)
+        patient_start = params.get("start_date") or start_date
+        columns["weight"].append(params["weight"])
+        columns["dose"].append(params["current_dose"])
+        columns["dose_step"].append((params["target_dose"] - params["current_dose"]) / (params["weeks"] * ipw))
+        columns["total_increases"].append(params["weeks"] * ipw)
+        columns["step_days"].append(7 / ipw)
+        # Datum wie in dose_steps: date + timedelta zählt nur ganze Tage
+        columns["step_interval"].append(datetime.timedelta(days=7 / ipw).days)
+        columns["pump_capacity"].append(pump_capacity)
+        columns["refills_per_vial"].append(params.get("vial_capacity", 10) / pump_capacity)
+        columns["concentration"].append(params["concentration"])
+        columns["start_offset"].append((patient_start - start_date).days)
+    return {name: np.array(values) for name, values in columns.items()}
+
+
+# Simulation eines Blocks von Patienten mit je `variants` Varianten (läuft ggf. im Worker-Prozess)
+#
+# Liefert die Anzahl angebrochener Vials mit der Form (Varianten, Konzentrationen, Wochen).
+# Zeilen, deren Titration abgeschlossen ist, werden aus den Arrays entfernt, sobald
+# weniger als drei Viertel der Zeilen noch aktiv sind.
+def _simulate_chunk(cohort, variants, n_weeks, weight_drift_sd, missed_step_probability,
+                    early_change_probability, seed):
+    rng = np.random.default_rng(seed)
+    concentrations = np.array(CONCENTRATIONS, dtype=float)
+    n_conc = len(concentrations)
+
+    n_rows = len(cohort["weight"]) * variants
+    rows = {name: np.repeat(values, variants) for name, values in cohort.items()}
+    rows["variant"] = np.tile(np.arange(variants), len(cohort["weight"]))
+    rows["dose"] = rows["dose"].astype(float)
+    rows["concentration"] = rows["concentration"].astype(float)
+    rows["reservoir_volume"] = rows["pump_capacity"].astype(float)
+    rows["reservoir_days_used"] = np.zeros(n_rows)
+    rows["vial_refills_left"] = rows["refills_per_vial"].astype(float)
+    rows["increases_done"] = np.zeros(n_rows, dtype=np.int64)
+    if weight_drift_sd:
+        rows["drift"] = rng.normal(0.0, weight_drift_sd, n_rows)
+
+    counts = np.zeros(variants * n_conc * n_weeks, dtype=np.int64)
+
+    # Funktion zum Zählen angebrochener Vials (Konzentration, Woche) der markierten Zeilen
+    def count_vials(mask, day):
+        conc_index = np.searchsorted(concentrations, rows["concentration"][mask])
+        week = np.minimum(day // 7, n_weeks - 1)
+        flat = (rows["variant"][mask] * n_conc + conc_index) * n_weeks + week
+        counts[:] += np.bincount(flat, minlength=counts.size)
+
+    count_vials(slice(None), rows["start_offset"])  # Erstes Vial am Starttag
+
+    # Ausgelassene Steigerungen verlängern die Titration; höchstens doppelt so viele Schritte
+    max_steps = int(cohort["total_increases"].max()) * (2 if missed_step_probability else 1)
+    for step in range(max_steps):
+        active = rows["increases_done"] < rows["total_increases"]
+        n_active = np.count_nonzero(active)
+        if not n_active:
+            break
+        if n_active < 0.75 * len(active):
+            rows = {name: values[active] for name, values in rows.items()}
+        if n_active == len(rows["variant"]):
+            active = True  # Alle Zeilen aktiv: Maske entfällt
+        n_rows = len(rows["variant"])
+
+        increase = active
+        if missed_step_probability:
+            increase = active & (rng.random(n_rows, dtype=np.float32) >= missed_step_probability)
+        rows["increases_done"] += increase
+        dose = rows["dose"] = np.where(increase, rows["dose"] + rows["dose_step"], rows["dose"])
+        step_days = rows["step_days"]
+        weight = rows["weight"]
+        if weight_drift_sd:
+            weight = weight * (1 + rows["drift"] * ((step + 1) * step_days / 7))
+
+        # Wie calculate_infusion_rate und simulate_dose_increase (Rundung auf ganze µl/h)
+        concentration = rows["concentration"]
+        infusion_rate = np.round(dose * weight / 1000 * 60 / 1000 / concentration * 1000)
+        daily_consumption_ml = infusion_rate * 24 / 1000
+        reservoir_volume = rows["reservoir_volume"]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            reservoir_days_left = reservoir_volume / daily_consumption_ml
+        reservoir_days_used = rows["reservoir_days_used"] + (step_days if active is True else step_days * active)
+
+        change = (reservoir_days_used >= MAX_RESERVOIR_DAYS) | (reservoir_days_left < 1)
+        if early_change_probability:
+            change |= rng.random(n_rows, dtype=np.float32) < early_change_probability
+        if active is not True:
+            change &= active
+
+        pump_capacity = rows["pump_capacity"]
+        if active is not True:
+            daily_consumption_ml = daily_consumption_ml * active
+        rows["reservoir_volume"] = np.where(change, pump_capacity, reservoir_volume - daily_consumption_ml)
+        rows["reservoir_days_used"] = np.where(change, 0.0, reservoir_days_used)
+        vial_refills_left = rows["vial_refills_left"] = rows["vial_refills_left"] - change
+
+        vial_change = change & (vial_refills_left <= 0)
+        if vial_change.any():
+            # Nächsthöhere Konzentration (bei der höchsten bleibt es dabei)
+            next_index = np.minimum(np.searchsorted(concentrations, concentration, side='right'), n_conc - 1)
+            rows["concentration"] = np.where(vial_change, np.maximum(concentrations[next_index], concentration),
+                                             concentration)
+            rows["vial_refills_left"] = np.where(vial_change, rows["refills_per_vial"], vial_refills_left)
+            count_vials(vial_change,
+                        rows["start_offset"][vial_change] + (step + 1) * rows["step_interval"][vial_change])
+
+    return counts.reshape(variants, n_conc, n_weeks)
+
+
+# Funktion zur Prognose des Vialbedarfs einer Kohorte
+#
+# patients: Parameter je Patient wie für simulate_dose_increase (Dictionaries,
+# start_date optional, nicht vor dem Prognosebeginn start_date). Wahrscheinlichkeiten
+# gelten je Dosisschritt.
+def forecast_vial_demand(patients, variants=1000, weight_drift_sd=0.005, missed_step_probability=0.05,
+                         early_change_probability=0.02, start_date=None, seed=None, workers=1,
+                         chunk_rows=CHUNK_ROWS):
+    patients = list(patients)
+    if not patients:
+        raise ValueError("Die Kohorte enthält keine Patienten.")
+    if start_date is None:
+        start_date = min((params.get("start_date") or datetime.date.today()) for params in patients)
+    cohort = _cohort_columns(patients, start_date)
+
+    # Nach Anzahl der Schritte sortieren, damit die Titrationen eines Blocks etwa gleich lang dauern
+    order = np.argsort(cohort["total_increases"], kind="stable")
+    cohort = {name: values[order] for name, values in cohort.items()}
+
+    # Anzahl der Wochen bis zum spätestmöglichen Schritt
+    steps_limit = cohort["total_increases"] * (2 if missed_step_probability else 1)
+    last_day = int((cohort["start_offset"] + steps_limit * cohort["step_interval"]).max())
+    n_weeks = max(last_day, 0) // 7 + 1
+
+    # Patienten in Blöcke teilen; jeder Block erhält einen eigenen, reproduzierbaren Zufallsstrom
+    per_chunk = max(1, chunk_rows // variants)
+    chunks = [{name: values[start:start + per_chunk] for name, values in cohort.items()}
+              for start in range(0, len(patients), per_chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    args = [(chunk, variants, n_weeks, weight_drift_sd, missed_step_probability, early_change_probability,
+             chunk_seed) for chunk, chunk_seed in zip(chunks, seeds)]
+
+    counts = np.zeros((variants, len(CONCENTRATIONS), n_weeks), dtype=np.int64)
+    if workers == 1 or len(chunks) == 1:
+        for chunk_args in args:
+            counts += _simulate_chunk(*chunk_args)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk_counts in executor.map(_simulate_chunk, *zip(*args)):
+                counts += chunk_counts
+
+    # Wochen nach dem letzten angebrochenen Vial weglassen
+    n_weeks = int(np.flatnonzero(counts.any(axis=(0, 1)))[-1]) + 1
+    counts = counts[:, :, :n_weeks]
+    week_starts = [start_date + datetime.timedelta(weeks=week) for week in range(n_weeks)]
+    return VialForecast(start_date, week_starts, list(CONCENTRATIONS), counts.mean(axis=0),
+                        np.percentile(counts, 95, axis=0), variants, len(patients))
+
+
+# Funktion zur Ausgabe der Prognose als Tabellenzeilen (nur Konzentrationen und Wochen mit Bedarf)
+def forecast_rows(forecast):
+    rows = []
+    for week, week_start in enumerate(forecast.week_starts):
+        for index, concentration in enumerate(forecast.concentrations):
+            expected, p95 = forecast.expected[index, week], forecast.p95[index, week]
+            if expected or p95:
+                rows.append({"week_start": week_start, "concentration": concentration,
+                             "expected_vials": round(float(expected), 2), "p95_vials": float(p95)})
+    return rows
+
+
+# Funktion zur Erstellung des Diagramms: erwarteter Bedarf je Konzentration und Woche, P95 gestrichelt
+def plot_forecast(forecast, fig=None):
+    from trepro_render import new_figure
+
+    if fig is None:
+        fig = new_figure()
+    fig.clear()
+    ax = fig.add_subplot()
+    weeks = np.array(forecast.week_starts, dtype='datetime64[D]')
+    for index, concentration in enumerate(forecast.concentrations):
+        if not forecast.p95[index].any():
+            continue
+        line, = ax.plot(weeks, forecast.expected[index], marker='o', label=f"{concentration} mg/ml erwartet")
+        ax.plot(weeks, forecast.p95[index], linestyle='--', color=line.get_color(),
+                label=f"{concentration} mg/ml P95")
+    ax.set_xlabel('Woche ab')
+    ax.set_ylabel('Angebrochene Vials')
+    ax.set_title(f'Vialbedarf ({forecast.patients} Patienten, {forecast.variants} Varianten)')
+    ax.grid(True)
+    ax.legend(loc='upper right', fontsize='small')
+    fig.autofmt_xdate(rotation=45)
+    fig.tight_layout()
+    return fig
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte-Carlo-Prognose des Vialbedarfs einer Kohorte")
+    parser.add_argument("input", help="CSV- oder Parquet-Datei mit den Patientenparametern")
+    parser.add_argument("-o", "--output", required=True, help="Bedarf je Woche und Konzentration (.csv oder .parquet)")
+    parser.add_argument("--chart", help="Diagramm als Bild (z.B. .png oder .svg)")
+    parser.add_argument("--variants", type=int, default=1000, help="Varianten je Patient")
+    parser.add_argument("--weight-drift-sd", type=float, default=0.005, help="Streuung der Gewichtsdrift pro Woche")
+    parser.add_argument("--missed-step-probability", type=float, default=0.05)
+    parser.add_argument("--early-change-probability", type=float, default=0.02)
+    parser.add_argument("--start-date", type=datetime.date.fromisoformat, help="Prognosebeginn (JJJJ-MM-TT)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=1, help="Anzahl der Worker-Prozesse")
+    args = parser.parse_args(argv)
+
+    patients = skipped = 0
+    cohort = []
+    for row in read_patients(args.input):
+        patients += 1
+        try:
+            params = patient_parameters(row)
+            error = _patient_error(params) or (args.start_date and _start_error(params, args.start_date))
+        except (KeyError, TypeError, ValueError) as exc:
+            error = f"{type(exc).__name__}: {exc}"
+        if error:
+            skipped += 1
+            print(f"Zeile {patients} übersprungen: {error}", file=sys.stderr)
+            continue
+        cohort.append(params)
+
+    try:
+        forecast = forecast_vial_demand(cohort, args.variants, args.weight_drift_sd, args.missed_step_probability,
+                                        args.early_change_probability, args.start_date, args.seed, args.workers)
+    except ValueError as exc:  # z.B. alle Zeilen übersprungen
+        print(f"Keine Prognose: {exc}", file=sys.stderr)
+        return 1
+    sink = open_sink(args.output, FORECAST_COLUMNS)
+    try:
+        for row in forecast_rows(forecast):
+            sink.write(row)
+    finally:
+        sink.close()
+
+    if args.chart:
+        from trepro_render import render_figure
+
+        with open(args.chart, "wb") as handle:
+            handle.write(render_figure(plot_forecast(forecast), args.chart.rsplit(".", 1)[-1].lower()))
+
+    print(f"{patients - skipped} Patienten prognostiziert, {skipped} übersprungen.", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
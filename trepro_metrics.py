@@ -0,0 +1,217 @@
+# Zeitmessung der einzelnen Stufen (Protokoll, Tabelle, Diagramm, PDF, ...)
+#
+# Eingeschaltet über die Umgebungsvariable TREPRO_METRICS=1. Ist sie nicht
+# gesetzt, liefert stage() einen leeren Kontextmanager und instrument() gibt die
+# Funktion unverändert zurück, sodass praktisch kein Aufwand entsteht.
+#
+# Je Stufe werden Aufrufe, Fehler und Gesamtdauer gezählt; aus den letzten
+# WINDOW Messungen werden Median (p50) und p99 berechnet. Ausgabe als
+# Prometheus-Text (prometheus_text), als JSON-Zeilen (json_lines) und optional
+# jede einzelne Messung als JSON-Zeile in die Datei aus TREPRO_METRICS_JSONL.
+# Diese Zeilen schreibt ein eigener Thread ungepuffert in eine offen gehaltene
+# Datei; record() legt die Messung nur in eine Warteschlange.
+import atexit
+import collections
+import functools
+import json
+import os
+import queue
+import threading
+import time
+
+ENABLED = os.environ.get("TREPRO_METRICS", "") not in ("", "0")
+JSONL_PATH = os.environ.get("TREPRO_METRICS_JSONL")
+
+# Anzahl der letzten Messungen je Stufe für die Quantile
+WINDOW = 1024
+
+
+# Messwerte einer Stufe
+class StageMetrics:
+    __slots__ = ("count", "errors", "total_seconds", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.recent = collections.deque(maxlen=WINDOW)
+
+    def observe(self, seconds, error):
+        self.count += 1
+        self.errors += error
+        self.total_seconds += seconds
+        self.recent.append(seconds)
+
+    def quantile(self, q):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+_stages = {}
+_lock = threading.Lock()
+
+
+# Schreiben der einzelnen Messungen als JSON-Zeilen in einem eigenen Thread
+#
+# Der Thread sammelt alle wartenden Messungen und hängt sie mit einem einzigen
+# os.write an die offen gehaltene Datei an. Es gibt keinen Puffer im Prozess,
+# den ein per fork gestarteter Worker erben und ein zweites Mal schreiben
+# könnte; im Kind wird der Writer verworfen und beim ersten Aufruf neu angelegt.
+class _JsonlWriter:
+    def __init__(self, path):
+        self._queue = queue.SimpleQueue()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._thread = threading.Thread(target=self._run, name="trepro-metrics-jsonl", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, name, seconds, error):
+        self._queue.put((time.time(), name, seconds, bool(error)))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            lines = []
+            while item is not None:
+                timestamp, name, seconds, error = item
+                lines.append(json.dumps({"ts": timestamp, "stage": name, "seconds": seconds, "error": error}))
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            data = "".join(line + "\n" for line in lines).encode("utf-8")
+            while data:
+                data = data[os.write(self._fd, data):]
+            if item is None:
+                return
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+_writer = None
+
+
+# Funktion zum Zurücksetzen nach fork: das Kind verwendet weder den Writer noch die Sperre des Elternprozesses
+def _after_fork_in_child():
+    global _writer, _lock
+    _writer = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+# Funktion zum Erfassen einer Messung
+def record(name, seconds, error=False):
+    global _writer
+    with _lock:
+        metrics = _stages.get(name)
+        if metrics is None:
+            metrics = _stages[name] = StageMetrics()
+        metrics.observe(seconds, error)
+        if JSONL_PATH:
+            if _writer is None:
+                _writer = _JsonlWriter(JSONL_PATH)
+            _writer.put(name, seconds, error)
+
+
+# Kontextmanager zur Messung einer Stufe
+class _StageTimer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.name, time.perf_counter() - self.start, exc_type is not None)
+        return False
+
+
+# Leerer Kontextmanager, wenn die Messung ausgeschaltet ist
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+# Funktion zur Messung eines Codeblocks:  with stage("pdf"): ...
+def stage(name):
+    if ENABLED:
+        return _StageTimer(name)
+    return _NULL_TIMER
+
+
+# Dekorator zur Messung jedes Aufrufs einer Funktion (Name der Stufe: Funktionsname)
+def instrument(name=None):
+    def decorator(func):
+        if not ENABLED:
+            return func
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _StageTimer(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Funktion zur Abfrage der aktuellen Werte aller Stufen
+def snapshot():
+    with _lock:
+        return {name: {
+            "count": metrics.count,
+            "errors": metrics.errors,
+            "total_seconds": metrics.total_seconds,
+            "p50_seconds": metrics.quantile(0.5),
+            "p99_seconds": metrics.quantile(0.99),
+        } for name, metrics in sorted(_stages.items())}
+
+
+# Ausgabe im Textformat von Prometheus
+def prometheus_text():
+    lines = [
+        "# HELP trepro_stage_seconds Dauer der Stufen des Dosissteigerungsprotokolls.",
+        "# TYPE trepro_stage_seconds summary",
+    ]
+    stages = snapshot()
+    for name, values in stages.items():
+        lines.append(f'trepro_stage_seconds{{stage="{name}",quantile="0.5"}} {values["p50_seconds"]:.6f}')
+        lines.append(f'trepro_stage_seconds{{stage="{name}",quantile="0.99"}} {values["p99_seconds"]:.6f}')
+        lines.append(f'trepro_stage_seconds_sum{{stage="{name}"}} {values["total_seconds"]:.6f}')
+        lines.append(f'trepro_stage_seconds_count{{stage="{name}"}} {values["count"]}')
+    lines.append("# HELP trepro_stage_errors_total Anzahl der fehlgeschlagenen Aufrufe je Stufe.")
+    lines.append("# TYPE trepro_stage_errors_total counter")
+    for name, values in stages.items():
+        lines.append(f'trepro_stage_errors_total{{stage="{name}"}} {values["errors"]}')
+    return "\n".join(lines) + "\n"
+
+
+# Ausgabe als JSON-Zeilen (eine Zeile je Stufe)
+def json_lines():
+    timestamp = time.time()
+    return "".join(json.dumps(dict(values, ts=timestamp, stage=name)) + "\n" for name, values in snapshot().items())
+
+
+def reset():
+    with _lock:
+        _stages.clear()
@@ -0,0 +1,134 @@
+# Nomogramme: Nachschlagetabellen für Laufrate, Haltbarkeit des Reservoirs und Perfusor-Laufrate
+#
+# Für jede Konzentration werden die Werte auf einem Raster aus Körpergewicht und
+# Dosis in einem einzigen vektorisierten Durchgang mit trepro_vectorized
+# berechnet (dieselben Werte wie trepro_core). Die Nomogramme dienen nur der
+# Tabellenansicht und dem Ausdruck; einzelne Werte werden direkt mit den
+# Funktionen aus trepro_core berechnet.
+#
+# get_nomogram() hält die Nomogramme je Raster im Prozess vor; CSV und PDF eines
+# Nomogramms werden beim ersten Abruf erzeugt und danach wiederverwendet.
+import csv
+import datetime
+import functools
+import io
+
+import numpy as np
+
+import trepro_vectorized as vec
+from trepro_core import CONCENTRATIONS
+
+# Standardraster: Körpergewicht in kg und Dosis in ng/kg/min
+DEFAULT_WEIGHTS = tuple(range(40, 151, 5))
+DEFAULT_DOSES = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 12, 14, 16, 18, 20, 25, 30, 35, 40, 45, 50, 60, 70, 80, 90, 100)
+
+# Größen des Nomogramms: Name -> (Anzeigename, Hinweis für den Ausdruck)
+QUANTITIES = {
+    "infusion_rate": ("Laufrate (µl/h)", "Gültig für die Apex Micro sc Infusionspumpe."),
+    "reservoir_duration": ("Haltbarkeit des Reservoirs (Tage)",
+                           "Gültig für die Apex Micro sc Infusionspumpe. Maximal 14 Tage im Reservoir!"),
+    "perfusor_rate": ("Perfusor-Laufrate (ml/h)",
+                      "50ml Perfusorspritze mit 1ml des Medikamentes und 49ml NaCl 0,9%."),
+}
+
+NOMOGRAM_FOOTER_TEMPLATE = ("Dieses Nomogramm wurde automatisch mit dem Treprostinil Dosisrechner "
+                            "(Beta Version 1.0) am {created} erstellt.")
+NOMOGRAM_COLUMNS = ["concentration", "weight", "dose", "infusion_rate", "reservoir_duration", "perfusor_rate"]
+
+# Spaltenbreiten der gedruckten Tabelle (Querformat) in mm
+PDF_FIRST_COL_WIDTH = 27
+PDF_VALUE_COL_WIDTH = 13
+PDF_DOSES_PER_PAGE = 18
+
+
+class Nomogram:
+    def __init__(self, weights=DEFAULT_WEIGHTS, doses=DEFAULT_DOSES, concentrations=CONCENTRATIONS,
+                 reservoir_volume=3):
+        self.weights = sorted(set(weights))
+        self.doses = sorted(set(doses))
+        self.concentrations = list(concentrations)
+        self.reservoir_volume = reservoir_volume
+        self._concentration_index = {conc: index for index, conc in enumerate(self.concentrations)}
+
+        # Ein Durchgang über alle Kombinationen: Form (Konzentrationen, Gewichte, Dosen)
+        weight = np.array(self.weights, dtype=float)[None, :, None]
+        dose = np.array(self.doses, dtype=float)[None, None, :]
+        concentration = np.array(self.concentrations, dtype=float)[:, None, None]
+        infusion_rates = vec.calculate_infusion_rates(weight, dose, concentration)
+        self.tables = {
+            "infusion_rate": infusion_rates,
+            "reservoir_duration": vec.calculate_reservoir_durations(infusion_rates, reservoir_volume),
+            "perfusor_rate": vec.calculate_perfusor_rates(weight, dose, concentration),
+        }
+        self._csv = None
+        self._pdf = None
+
+    # Funktion zur Ausgabe einer Tabelle (Zeilen: Gewichte, Spalten: Dosen)
+    def table(self, quantity, concentration):
+        return self.tables[quantity][self._concentration_index[concentration]]
+
+    # Ausgabe als CSV (eine Zeile je Konzentration, Gewicht und Dosis)
+    def to_csv(self):
+        if self._csv is None:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(NOMOGRAM_COLUMNS)
+            for c_index, concentration in enumerate(self.concentrations):
+                for w_index, weight in enumerate(self.weights):
+                    for d_index, dose in enumerate(self.doses):
+                        writer.writerow([concentration, weight, dose] + [
+                            round(float(self.tables[name][c_index, w_index, d_index]), 2) for name in QUANTITIES])
+            self._csv = buffer.getvalue().encode("utf-8")
+        return self._csv
+
+    # Ausgabe als mehrseitiges PDF (je Konzentration und Größe eine Tabelle, bei vielen Dosen auf mehreren Seiten)
+    def to_pdf(self, created=None):
+        if self._pdf is None:
+            from trepro_render import new_pdf_document, write_pdf_to_stream
+
+            created = created or datetime.datetime.now()
+            footer_text = NOMOGRAM_FOOTER_TEMPLATE.format(created=created.strftime("%Y-%m-%d %H:%M:%S"))
+            pdf = new_pdf_document()
+            for quantity, (label, note) in QUANTITIES.items():
+                for concentration in self.concentrations:
+                    self._write_table_pages(pdf, quantity, label, note, concentration, footer_text)
+            buffer = io.BytesIO()
+            write_pdf_to_stream(pdf, buffer)
+            self._pdf = buffer.getvalue()
+        return self._pdf
+
+    def _write_table_pages(self, pdf, quantity, label, note, concentration, footer_text):
+        table = self.table(quantity, concentration)
+        for start in range(0, len(self.doses), PDF_DOSES_PER_PAGE):
+            doses = self.doses[start:start + PDF_DOSES_PER_PAGE]
+            pdf.add_page(orientation='L')
+
+            pdf.set_font('Arial', 'B', 12)
+            pdf.cell(0, 10, txt=f"Nomogramm {label} - Konzentration {concentration} mg/ml", ln=True, align='L')
+            pdf.set_font('Arial', 'I', 8)
+            pdf.cell(0, 6, txt=note, ln=True, align='L')
+            pdf.cell(0, 6, txt=footer_text, ln=True, align='L')
+            pdf.ln(2)
+
+            # Kopfzeile: Dosen in ng/kg/min
+            pdf.set_font('Arial', 'B', 8)
+            pdf.cell(PDF_FIRST_COL_WIDTH, 7, "kg \\ ng/kg/min", 1, 0, 'C')
+            for dose in doses:
+                pdf.cell(PDF_VALUE_COL_WIDTH, 7, f"{dose:g}", 1, 0, 'C')
+            pdf.ln()
+
+            pdf.set_font('Arial', '', 8)
+            for w_index, weight in enumerate(self.weights):
+                pdf.set_font('Arial', 'B', 8)
+                pdf.cell(PDF_FIRST_COL_WIDTH, 6, f"{weight:g}", 1, 0, 'C')
+                pdf.set_font('Arial', '', 8)
+                for d_index in range(start, start + len(doses)):
+                    pdf.cell(PDF_VALUE_COL_WIDTH, 6, f"{table[w_index, d_index]:.2f}", 1, 0, 'R')
+                pdf.ln()
+
+
+# Funktion zum Abruf eines Nomogramms (wird je Raster nur einmal berechnet)
+@functools.lru_cache(maxsize=8)
+def get_nomogram(weights=DEFAULT_WEIGHTS, doses=DEFAULT_DOSES, concentrations=tuple(CONCENTRATIONS),
+                 reservoir_volume=3):
+    return Nomogram(weights, doses, concentrations, reservoir_volume)
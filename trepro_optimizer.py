@@ -0,0 +1,117 @@
+# Suche nach geeigneten Titrationsplänen
+#
+# Für ein Raster aus Dauer (Wochen), Steigerungen pro Woche und Anfangskonzentration
+# wird jeweils das Dosissteigerungsprotokoll simuliert. Pläne, die eine
+# Nebenbedingung verletzen (Reservoirintervall über 14 Tage, Laufrate außerhalb
+# der Pumpengrenzen, optional zu große Dosissprünge je Steigerung), werden verworfen. Aus den übrigen wird die Pareto-Menge
+# bezüglich der Anzahl der Reservoirwechsel und des verworfenen Vialvolumens
+# bestimmt. Größere Raster werden auf einen Prozesspool verteilt.
+#
+# Verworfenes Vialvolumen: angebrochene Vials (Vialanzahl mal Vialkapazität)
+# abzüglich des in Reservoirs gefüllten Volumens (Erstfüllung plus ein
+# Reservoir je Wechsel), mindestens 0.
+import collections
+import concurrent.futures
+import datetime
+import itertools
+import os
+
+from trepro_core import CONCENTRATIONS, MAX_RESERVOIR_DAYS, simulate_dose_increase
+
+# Ab dieser Rastergröße wird parallel gerechnet
+PARALLEL_MIN_CANDIDATES = 5000
+
+PlanCandidate = collections.namedtuple("PlanCandidate", [
+    "weeks", "increases_per_week", "concentration", "reservoir_changes", "discarded_volume", "longest_interval",
+    "min_infusion_rate", "max_infusion_rate", "feasible", "reason"])
+
+
+# Funktion zur Bewertung eines einzelnen Plans
+def evaluate_plan(weeks, increases_per_week, concentration, current_dose, target_dose, weight,
+                  pump_capacity=3, vial_capacity=10, start_date=None, min_rate=None, max_rate=None,
+                  max_dose_step=None):
+    start_date = start_date or datetime.date.today()
+
+    # Zu große Dosissprünge lassen sich ohne Simulation erkennen
+    dose_step = (target_dose - current_dose) / (weeks * increases_per_week)
+    if max_dose_step is not None and dose_step > max_dose_step:
+        return PlanCandidate(weeks, increases_per_week, concentration, None, None, None, None, None, False,
+                             f"Dosissprung von {dose_step:.2f} ng/kg/min je Steigerung")
+
+    try:
+        protocol, vial_usage, reservoir_changes, _ = simulate_dose_increase(
+            current_dose, target_dose, weeks, increases_per_week, weight, concentration,
+            pump_capacity, vial_capacity, start_date)
+    except ZeroDivisionError:  # Laufrate rundet auf 0 µl/h
+        return PlanCandidate(weeks, increases_per_week, concentration, None, None, None, 0, 0, False,
+                             "Laufrate von 0 µl/h")
+
+    # Intervalle aus der verstrichenen Zeit (Anzahl Schritte mal Schrittweite in Tagen), nicht aus den
+    # Kalenderdaten: diese schneiden Bruchteile von Tagen ab. Das erste Intervall beginnt am Starttag.
+    step_days = 7 / increases_per_week
+    change_steps = [index for index, event in enumerate(protocol.events) if event]
+    intervals = [round((step - previous) * step_days, 2)
+                 for previous, step in zip([-1] + change_steps, change_steps)]
+    longest_interval = max(intervals) if intervals else None
+
+    opened_volume = sum(vial_usage.values()) * vial_capacity
+    filled_volume = (reservoir_changes + 1) * pump_capacity
+    discarded_volume = round(max(opened_volume - filled_volume, 0), 2)
+
+    rates = protocol.infusion_rates
+    min_infusion_rate, max_infusion_rate = min(rates), max(rates)
+
+    reason = ""
+    if longest_interval is not None and longest_interval > MAX_RESERVOIR_DAYS:
+        reason = f"Reservoirintervall von {longest_interval:g} Tagen"
+    elif min_rate is not None and min_infusion_rate < min_rate:
+        reason = f"Laufrate {min_infusion_rate} µl/h unter {min_rate} µl/h"
+    elif max_rate is not None and max_infusion_rate > max_rate:
+        reason = f"Laufrate {max_infusion_rate} µl/h über {max_rate} µl/h"
+
+    return PlanCandidate(weeks, increases_per_week, concentration, reservoir_changes, discarded_volume,
+                         longest_interval, min_infusion_rate, max_infusion_rate, not reason, reason)
+
+
+def _evaluate_grid_point(args):
+    point, fixed = args
+    return evaluate_plan(*point, **fixed)
+
+
+# Funktion zur Bewertung aller Pläne des Rasters
+def evaluate_grid(weeks_options, increases_options, current_dose, target_dose, weight,
+                  concentrations=CONCENTRATIONS, workers=None, **fixed):
+    fixed.update(current_dose=current_dose, target_dose=target_dose, weight=weight)
+    grid = [(point, fixed) for point in itertools.product(weeks_options, increases_options, concentrations)]
+    if workers == 1 or len(grid) < PARALLEL_MIN_CANDIDATES:
+        return [_evaluate_grid_point(args) for args in grid]
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_evaluate_grid_point, grid, chunksize=max(1, len(grid) // (workers * 4))))
+
+
+# Funktion zur Bestimmung der Pareto-Menge (weniger Reservoirwechsel, weniger verworfenes Volumen)
+def pareto_front(candidates):
+    feasible = sorted((candidate for candidate in candidates if candidate.feasible),
+                      key=lambda c: (c.reservoir_changes, c.discarded_volume, c.weeks, c.increases_per_week))
+    front = []
+    best_discarded = None
+    for candidate in feasible:
+        if best_discarded is None or candidate.discarded_volume < best_discarded:
+            front.append(candidate)
+            best_discarded = candidate.discarded_volume
+        elif front and (candidate.reservoir_changes, candidate.discarded_volume) == (
+                front[-1].reservoir_changes, front[-1].discarded_volume):
+            front.append(candidate)  # Gleichwertige Pläne ebenfalls anbieten
+    return front
+
+
+# Funktion zur Optimierung eines Titrationsplans
+def optimize_titration(current_dose, target_dose, weight, weeks_options, increases_options,
+                       concentrations=CONCENTRATIONS, pump_capacity=3, vial_capacity=10, start_date=None,
+                       min_rate=None, max_rate=None, max_dose_step=None, workers=None):
+    candidates = evaluate_grid(weeks_options, increases_options, current_dose, target_dose, weight,
+                               concentrations, workers, pump_capacity=pump_capacity, vial_capacity=vial_capacity,
+                               start_date=start_date, min_rate=min_rate, max_rate=max_rate,
+                               max_dose_step=max_dose_step)
+    return pareto_front(candidates), candidates
@@ -0,0 +1,368 @@
+# Darstellung und Export des Dosissteigerungsprotokolls
+#
+# NumPy, pandas, matplotlib und fpdf werden erst innerhalb der Funktionen importiert,
+# damit der Import dieses Moduls (und des Rechenkerns) billig bleibt und die
+# schweren Bibliotheken nur geladen werden, wenn tatsächlich gerendert wird.
+import datetime
+import functools
+import io
+import os
+import tempfile  # Für das Erstellen eines temporären Verzeichnisses
+import threading
+
+from trepro_core import (
+    EVENT_VIAL_CHANGE,
+    LABEL_DATE,
+    LABEL_DOSE,
+    LABEL_HINT,
+    LABEL_INFUSION_RATE,
+    LABEL_RESERVOIR_VOLUME,
+    Protocol,
+    as_protocol,
+)
+from trepro_metrics import instrument
+
+# Größe des Diagramms in Zoll
+FIGURE_SIZE = (10, 5)
+
+# Wiederverwendbare Diagrammvorlage je Thread (siehe render_protocol_chart)
+_figure_templates = threading.local()
+
+
+# Funktion zur Umwandlung des Protokolls in eine Tabelle
+#
+# Die Zahlenspalten eines Protocol werden ohne Kopie übernommen.
+@instrument()
+def protocol_to_dataframe(protocol):
+    import numpy as np
+    import pandas as pd
+
+    if not isinstance(protocol, Protocol):
+        return pd.DataFrame(protocol)
+    return pd.DataFrame({
+        LABEL_DATE: protocol.dates(),
+        LABEL_DOSE: np.frombuffer(protocol.doses, dtype=np.float64),
+        LABEL_INFUSION_RATE: np.frombuffer(protocol.infusion_rates, dtype=np.int64),
+        LABEL_RESERVOIR_VOLUME: np.frombuffer(protocol.reservoir_volumes, dtype=np.float64),
+        LABEL_HINT: protocol.hints(),
+    }, copy=False)
+
+
+# Funktion zur Ermittlung der Tabellenzeilen (Datum, Dosis, Laufrate, Restvolumen, Hinweis)
+#
+# Akzeptiert ein Protocol, einen DataFrame oder eine Liste von Dictionaries.
+def protocol_table_rows(protocol):
+    if isinstance(protocol, Protocol):
+        return protocol.table_rows()
+    if hasattr(protocol, "itertuples"):
+        return protocol.itertuples(index=False)
+    return ((entry[LABEL_DATE], entry[LABEL_DOSE], entry[LABEL_INFUSION_RATE], entry[LABEL_RESERVOIR_VOLUME],
+             entry[LABEL_HINT]) for entry in protocol)
+
+
+# Gemeinsames Layout der PDF-Dokumente
+PDF_TITLE = "Dosissteigerungsprotokoll"
+PDF_FOOTER_TEMPLATE = ("Dieses Dosissteigerungsprotokoll wurde automatisch mit dem Treprostinil Dosisrechner "
+                       "(Beta Version 1.0) am {created} erstellt.")
+PDF_COLUMNS = ["Datum", "Dosis (ng/kg/min)", "Laufrate (µl/h)", "Noch im Reservoir (ml)", "Hinweis"]
+PDF_COL_WIDTHS = [20, 25, 20, 32, 73]  # Anpassung der Spaltenbreiten
+PDF_ROW_HEIGHT = 8  # Angepasste Zeilenhöhe
+
+
+# Funktion zur Erstellung des Fußzeilentextes mit Datum und Uhrzeit
+def pdf_footer_text(created=None):
+    created = created or datetime.datetime.now()
+    return PDF_FOOTER_TEMPLATE.format(created=created.strftime("%Y-%m-%d %H:%M:%S"))
+
+
+# Funktion zur Erstellung eines leeren PDF-Dokuments
+def new_pdf_document():
+    from fpdf import FPDF
+
+    pdf = FPDF()
+
+    # Setze Seitenränder auf 15 mm
+    pdf.set_margins(15, 15, 15)
+    return pdf
+
+
+# Funktion zum Schreiben eines Protokolls (Titel, Tabelle, Zusammenfassung, Grafik) auf eine neue Seite
+#
+# rows liefert je Zeile die fünf Tabellenwerte in der Reihenfolge von PDF_COLUMNS.
+def write_protocol_pages(pdf, title, footer_text, rows, summary_text, png_data, image_dir):
+    pdf.add_page()
+
+    # Füge den Titel hinzu
+    pdf.set_font('Arial', 'B', 12)
+    pdf.cell(200, 10, txt=title, ln=True, align='L')
+
+    # Füge die Fußzeile mit Datum und Uhrzeit hinzu
+    pdf.ln(2)
+    pdf.set_font('Arial', 'I', 8)
+    pdf.cell(200, 10, txt=footer_text, ln=True, align='L')
+
+    # Füge die Tabelle hinzu (angepasste Spaltenbreiten und kleinere Schriftgröße)
+    pdf.set_font('Arial', '', 8)  # Kleinere Schriftgröße für die Tabelle
+    for width, col in zip(PDF_COL_WIDTHS, PDF_COLUMNS):
+        pdf.cell(width, PDF_ROW_HEIGHT, col, 1)
+    pdf.ln()
+
+    for date, dose, infusion_rate, reservoir_volume, hint_text in rows:
+        pdf.cell(PDF_COL_WIDTHS[0], PDF_ROW_HEIGHT, str(date), 1)
+        pdf.cell(PDF_COL_WIDTHS[1], PDF_ROW_HEIGHT, str(dose), 1)
+        pdf.cell(PDF_COL_WIDTHS[2], PDF_ROW_HEIGHT, str(infusion_rate), 1)
+        pdf.cell(PDF_COL_WIDTHS[3], PDF_ROW_HEIGHT, str(reservoir_volume), 1)
+
+        # Umbruch für die "Hinweis"-Spalte, wenn der Text zu lang ist
+        pdf.multi_cell(PDF_COL_WIDTHS[4], PDF_ROW_HEIGHT, str(hint_text), 1)
+
+    # Füge die Zusammenfassung hinzu
+    pdf.ln(5)
+    pdf.set_font('Arial', '', 10)
+    for line in summary_text.split('\n'):
+        pdf.cell(200, 10, txt=line, ln=True)
+
+    # Füge die Grafik hinzu (fpdf liest Bilder nur aus Dateien und merkt sie sich
+    # unter ihrem Pfad, daher erhält jede Grafik einen eigenen Dateinamen)
+    image_path = os.path.join(image_dir, f"diagramm_{len(pdf.images) + 1}.png")
+    with open(image_path, "wb") as image_file:
+        image_file.write(png_data)
+    pdf.image(image_path, x=10, y=None, w=180)
+    os.remove(image_path)  # Die Bilddaten liegen jetzt im Dokument
+
+
+# Puffer eines Streaming-Dokuments: schreibt alles sofort in den Zielstrom und zählt nur die Länge
+class _StreamBuffer:
+    def __init__(self, stream):
+        self.stream = stream
+        self.length = 0
+
+    def __iadd__(self, text):
+        self.stream.write(text.encode('latin1'))
+        self.length += len(text)  # latin1: ein Zeichen je Byte
+        return self
+
+    def __len__(self):
+        return self.length
+
+
+# PDF-Dokument, das jede fertige Seite samt ihrer neuen Bilder sofort in den Zielstrom schreibt
+#
+# fpdf hält sonst alle Seiten und Bilder bis zum Schluss im Speicher und baut das
+# ganze Dokument als eine Zeichenkette auf. Hier bleiben nur Seitennummern,
+# Objekt-Offsets und Schriften bis zum Ende; Schriften, Ressourcen, Seitenbaum
+# und Querverweise folgen beim Schließen. Nicht unterstützt werden Links und der
+# Platzhalter für die Seitenzahl (alias_nb_pages), die das Layout nicht verwendet.
+@functools.lru_cache(maxsize=None)
+def _streaming_pdf_class():
+    import zlib
+
+    from fpdf import FPDF
+
+    class StreamingPDF(FPDF):
+        def __init__(self, stream):
+            super().__init__()
+            self.buffer = _StreamBuffer(stream)
+            self._header_written = False
+            self._page_objects = []
+
+        def _putheader(self):
+            if not self._header_written:
+                self._header_written = True
+                super()._putheader()
+
+        def _endpage(self):
+            super()._endpage()
+            self._putheader()
+            self._put_page(self.page)
+            self._putimages()
+
+        # Funktion zum Schreiben einer Seite (wie FPDF._putpages), danach wird der Seiteninhalt verworfen
+        def _put_page(self, n):
+            if self.def_orientation == 'P':
+                w_pt, h_pt = self.fw_pt, self.fh_pt
+            else:
+                w_pt, h_pt = self.fh_pt, self.fw_pt
+            self._newobj()
+            self._page_objects.append(self.n)
+            self._out('<</Type /Page')
+            self._out('/Parent 1 0 R')
+            if n in self.orientation_changes:
+                self._out('/MediaBox [0 0 %.2f %.2f]' % (h_pt, w_pt))
+            self._out('/Resources 2 0 R')
+            if self.pdf_version > '1.3':
+                self._out('/Group <</Type /Group /S /Transparency /CS /DeviceRGB>>')
+            self._out('/Contents ' + str(self.n + 1) + ' 0 R>>')
+            self._out('endobj')
+
+            content = self.pages[n].encode('latin1')
+            self.pages[n] = ''
+            if self.compress:
+                content = zlib.compress(content)
+            self._newobj()
+            self._out('<<' + ('/Filter /FlateDecode ' if self.compress else '') + '/Length ' + str(len(content)) + '>>')
+            self._putstream(content)
+            self._out('endobj')
+
+        # Nur der Seitenbaum fehlt noch, die Seiten selbst sind bereits geschrieben
+        def _putpages(self):
+            if self.def_orientation == 'P':
+                w_pt, h_pt = self.fw_pt, self.fh_pt
+            else:
+                w_pt, h_pt = self.fh_pt, self.fw_pt
+            self.offsets[1] = len(self.buffer)
+            self._out('1 0 obj')
+            self._out('<</Type /Pages')
+            self._out('/Kids [' + ''.join(f'{n} 0 R ' for n in self._page_objects) + ']')
+            self._out('/Count ' + str(len(self._page_objects)))
+            self._out('/MediaBox [0 0 %.2f %.2f]' % (w_pt, h_pt))
+            self._out('>>')
+            self._out('endobj')
+
+        # Nur Bilder schreiben, die noch nicht im Dokument stehen; ihre Daten werden danach freigegeben
+        def _putimages(self):
+            for _, info in sorted((info['i'], info) for info in self.images.values() if 'data' in info):
+                self._putimage(info)
+                del info['data']
+                info.pop('smask', None)
+                info.pop('pal', None)
+
+    return StreamingPDF
+
+
+# Funktion zur Erstellung eines PDF-Dokuments, das direkt in stream geschrieben wird (Abschluss mit close())
+def new_streaming_pdf_document(stream):
+    pdf = _streaming_pdf_class()(stream)
+
+    # Setze Seitenränder auf 15 mm
+    pdf.set_margins(15, 15, 15)
+    return pdf
+
+
+# Funktion zum Schreiben eines fertigen Dokuments in einen Binärstrom
+#
+# fpdf baut beim Schließen das ganze Dokument als Zeichenkette auf; diese wird
+# abschnittsweise kodiert, statt sie zusätzlich als Ganzes zu kopieren. Für
+# Dokumente, deren Größe mit der Zahl der Patienten wächst, ist
+# new_streaming_pdf_document gedacht.
+def write_pdf_to_stream(pdf, stream, chunk_size=1024 * 1024):
+    pdf.close()
+    buffer = pdf.buffer
+    for offset in range(0, len(buffer), chunk_size):
+        stream.write(buffer[offset:offset + chunk_size].encode('latin1'))
+
+
+# Funktion zur PDF-Erstellung mit Grafik, Zusammenfassung und Fußzeile
+#
+# protocol_df kann ein DataFrame oder ein Protocol sein, fig eine matplotlib-Figure
+# oder bereits gerenderte PNG-Bytes.
+@instrument()
+def generate_pdf_with_graph(protocol_df, fig, summary_text):
+    pdf = new_pdf_document()
+    png_data = fig if isinstance(fig, bytes) else render_figure(fig, 'png')
+
+    # Die Grafik wird nur kurz in einem temporären Verzeichnis abgelegt, das beim Verlassen des Blocks gelöscht wird
+    with tempfile.TemporaryDirectory() as image_dir:
+        write_protocol_pages(pdf, PDF_TITLE, pdf_footer_text(), protocol_table_rows(protocol_df), summary_text,
+                             png_data, image_dir)
+
+    # Schreibe die PDF in einen Byte-Stream anstelle einer Datei
+    pdf_output = io.BytesIO()
+    write_pdf_to_stream(pdf, pdf_output)
+    return pdf_output.getvalue()
+
+
+# Funktion zur Erstellung einer Figure ohne pyplot
+#
+# Figures, die nicht über pyplot erzeugt werden, sind keinem globalen Register
+# bekannt und werden freigegeben, sobald keine Referenz mehr auf sie besteht.
+# Gerendert wird mit dem nicht-interaktiven Agg-Backend.
+def new_figure():
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=FIGURE_SIZE)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+# Funktion zum Rendern einer Figure in den Speicher (z.B. 'png' oder 'svg')
+#
+# PNGs werden ohne Alphakanal geschrieben: fpdf zerlegt RGBA-Bilder beim Einbetten
+# Pixel für Pixel, was pro Diagramm mehrere Sekunden kostet. Der Hintergrund der
+# Diagramme ist ohnehin deckend weiß.
+def render_figure(fig, fmt='png'):
+    buffer = io.BytesIO()
+    if fmt == 'png':
+        import numpy as np
+        from PIL import Image
+
+        fig.canvas.draw()
+        rgba = np.asarray(fig.canvas.buffer_rgba())
+        Image.fromarray(rgba[..., :3]).save(buffer, format='PNG')
+    else:
+        fig.savefig(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+# Funktion zur Erstellung der Grafik mit Reservoir-Inhalt als Balken
+#
+# Wird eine bestehende Figure übergeben, wird sie geleert und neu gezeichnet.
+@instrument()
+def plot_dose_infusion_rate_reservoir(protocol, fig=None):
+    import numpy as np
+
+    protocol = as_protocol(protocol)
+    dates = np.array(protocol.dates(), dtype='datetime64[D]')
+    doses = np.frombuffer(protocol.doses, dtype=np.float64)
+    infusion_rates = np.frombuffer(protocol.infusion_rates, dtype=np.int64)
+    reservoir_volumes = np.frombuffer(protocol.reservoir_volumes, dtype=np.float64)
+    vial_changes = np.flatnonzero(np.frombuffer(protocol.events, dtype=np.int8) == EVENT_VIAL_CHANGE)
+
+    if fig is None:
+        fig = new_figure()
+    else:
+        fig.clear()
+    ax1 = fig.add_subplot()
+
+    # Dosis darstellen
+    ax1.plot(dates, doses, marker='o', color='b', label='Dosis (ng/kg/min)')
+    ax1.set_xlabel('Datum')
+    ax1.set_ylabel('Dosis (ng/kg/min)', color='b')
+    ax1.tick_params(axis='y', labelcolor='b')
+
+    # Pumpenlaufrate darstellen (zweite y-Achse)
+    ax2 = ax1.twinx()
+    ax2.plot(dates, infusion_rates, marker='s', color='g', label='Laufrate (µl/h)')
+    ax2.set_ylabel('Laufrate (µl/h)', color='g')
+    ax2.tick_params(axis='y', labelcolor='g')
+
+    # Reservoir-Inhalt als Balken hinzufügen (separate Achse für den Bar-Plot)
+    ax3 = ax1.twinx()
+    ax3.bar(dates, reservoir_volumes, alpha=0.3, color='orange', width=1.0, label='Reservoir Inhalt (ml)')
+    ax3.set_ylabel('Reservoir Inhalt (ml)', color='orange')
+    ax3.tick_params(axis='y', labelcolor='orange')
+    ax3.spines['right'].set_position(('outward', 60))  # Verschiebe die dritte Achse nach außen
+
+    # Markiere Vialwechsel
+    for idx in vial_changes:
+        ax1.axvline(dates[idx], color='r', linestyle='--', label=f'Vialwechsel am {dates[idx]}')
+
+    ax3.set_title('Dosissteigerungsprotokoll mit Laufrate und Reservoir-Inhalt')
+    fig.tight_layout()
+    return fig
+
+
+# Funktion zum Rendern des Protokolldiagramms direkt in Bytes
+#
+# Jeder Thread verwendet dieselbe Figure als Vorlage wieder; nach dem Rendern
+# wird sie geleert, sodass keine Achsen oder Daten im Speicher verbleiben.
+@instrument()
+def render_protocol_chart(protocol, fmt='png'):
+    fig = getattr(_figure_templates, "figure", None)
+    if fig is None:
+        fig = _figure_templates.figure = new_figure()
+    try:
+        return render_figure(plot_dose_infusion_rate_reservoir(protocol, fig), fmt)
+    finally:
+        fig.clear()
@@ -0,0 +1,136 @@
+# Sammelberichte über viele Patienten (z.B. für die wöchentliche Visite)
+#
+# Zwei Varianten:
+#   - PdfReportBuilder: ein gemeinsames PDF mit einem Abschnitt je Patient
+#   - ZipReportBuilder: ein ZIP-Archiv mit einem PDF je Patient
+#
+# Layout, Fußzeilentext und Schriften werden einmal für den ganzen Bericht
+# festgelegt. Patienten werden einzeln hinzugefügt; Protokoll, Diagramm und
+# Tabellenzeilen eines Patienten werden nach dem Schreiben sofort verworfen.
+# Beide Varianten schreiben direkt in die Zieldatei bzw. den Zielstrom: das
+# gemeinsame PDF Seite für Seite (new_streaming_pdf_document), das ZIP-Archiv
+# Eintrag für Eintrag. Der Speicherbedarf entspricht damit etwa einem Patienten.
+#
+# Tritt im with-Block ein Fehler auf, wird der Bericht nicht abgeschlossen; eine
+# vom Builder angelegte Zieldatei wird wieder gelöscht.
+#
+# Beispiel:
+#   with ZipReportBuilder("visite.zip") as report:
+#       for patient_id, protocol, summary in patienten:
+#           report.add_patient(patient_id, protocol, summary)
+import gc
+import os
+import re
+import tempfile
+import zipfile
+
+from trepro_render import (
+    PDF_TITLE,
+    new_streaming_pdf_document,
+    pdf_footer_text,
+    protocol_table_rows,
+    render_protocol_chart,
+    write_protocol_pages,
+)
+
+
+# Funktion zum Öffnen des Ziels (Dateipfad oder bereits geöffneter Binärstrom)
+def _open_target(target):
+    if hasattr(target, "write"):
+        return target, False
+    return open(target, "wb"), True
+
+
+# Gemeinsame Grundlage der Berichtsvarianten
+class _ReportBuilder:
+    def __init__(self, target, created=None):
+        self.footer_text = pdf_footer_text(created)
+        self.patients = 0
+        self._stream, self._owns_stream = _open_target(target)
+        self._path = None if hasattr(target, "write") else target
+        self._image_dir = tempfile.TemporaryDirectory()
+
+    # Funktion zum Schreiben eines Patienten in ein PDF-Dokument
+    def _write_patient(self, pdf, patient_id, protocol, summary_text):
+        png_data = render_protocol_chart(protocol)
+        write_protocol_pages(pdf, f"{PDF_TITLE} - Patient {patient_id}", self.footer_text,
+                             protocol_table_rows(protocol), summary_text, png_data, self._image_dir.name)
+        self.patients += 1
+        # Die Diagrammobjekte von matplotlib bilden Referenzzyklen (etwa 1 MiB je Diagramm); ohne
+        # sofortige Sammlung wächst der Speicher bis zum nächsten vollständigen Lauf der Speicherbereinigung
+        gc.collect()
+
+    def close(self):
+        self._image_dir.cleanup()
+        if self._owns_stream:
+            self._stream.close()
+
+    # Funktion zum Abbrechen: der Bericht wird nicht abgeschlossen, eine eigene Zieldatei gelöscht
+    def abort(self):
+        self._discard()
+        self._image_dir.cleanup()
+        if self._owns_stream:
+            self._stream.close()
+            os.remove(self._path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# Ein gemeinsames PDF mit allen Patienten
+class PdfReportBuilder(_ReportBuilder):
+    def __init__(self, target, created=None):
+        super().__init__(target, created)
+        self._pdf = new_streaming_pdf_document(self._stream)
+
+    def add_patient(self, patient_id, protocol, summary_text):
+        self._write_patient(self._pdf, patient_id, protocol, summary_text)
+
+    def _discard(self):
+        self._pdf = None
+
+    def close(self):
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
+        super().close()
+
+
+# Ein ZIP-Archiv mit einem PDF je Patient
+class ZipReportBuilder(_ReportBuilder):
+    def __init__(self, target, created=None):
+        super().__init__(target, created)
+        self._zip = zipfile.ZipFile(self._stream, "w", compression=zipfile.ZIP_DEFLATED)
+        self._names = set()
+
+    # Funktion zur Bildung eines eindeutigen Dateinamens im Archiv (ohne Pfadtrenner, "..", Steuerzeichen)
+    def _entry_name(self, patient_id):
+        stem = re.sub(r"[^\w.-]", "_", str(patient_id)).lstrip(".") or "patient"
+        name = f"dosissteigerungsprotokoll_{stem}.pdf"
+        number = 1
+        while name in self._names:
+            number += 1
+            name = f"dosissteigerungsprotokoll_{stem}_{number}.pdf"
+        self._names.add(name)
+        return name
+
+    def add_patient(self, patient_id, protocol, summary_text):
+        with self._zip.open(self._entry_name(patient_id), "w") as entry:
+            pdf = new_streaming_pdf_document(entry)
+            self._write_patient(pdf, patient_id, protocol, summary_text)
+            pdf.close()
+
+    def _discard(self):
+        self._zip = None
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        super().close()
@@ -0,0 +1,379 @@
+# JSON-HTTP-Dienst für die Berechnungen ohne Streamlit
+#
+# Aufruf:  python trepro_service.py [--host 127.0.0.1] [--port 8765] [--workers 2]
+#
+# Endpunkte (alle POST mit JSON-Körper, Antwort JSON):
+#   /infusion-rate   {weight, dose, concentration}
+#   /dose            {weight, infusion_rate, concentration}
+#   /perfusor-rate   {weight, dose, concentration}
+#   /protocol        {current_dose, target_dose, weeks, increases_per_week, weight, concentration,
+#                     pump_capacity?, vial_capacity?, start_date?}
+#   /protocol/pdf    wie /protocol, Antwort application/pdf
+#   /batch           {patients: [{patient_id?, ...wie /protocol}, ...]}, Antwort je Patient wie /protocol
+#                    plus patient_id und error
+# sowie GET /health und GET /metrics (Prometheus-Text, siehe trepro_metrics).
+#
+# Der Dienst verwendet nur die Standardbibliothek (asyncio). Anfragen werden
+# nebenläufig bearbeitet; PDF-Erstellung und Stapelberechnungen laufen in einem
+# Prozesspool, damit sie die Ereignisschleife nicht blockieren. /protocol wird
+# direkt berechnet, Dauer und Steigerungen pro Woche sind dafür begrenzt
+# (MAX_WEEKS, MAX_INCREASES_PER_WEEK). Ungültige Eingaben, auch eine auf 0 µl/h
+# gerundete Laufrate, werden mit 422 beantwortet, ebenso Ergebnisse, die keine
+# endliche Zahl sind (JSON kennt weder Infinity noch NaN).
+#
+# Die Worker-Prozesse werden über einen Forkserver gestartet: Ein per fork
+# gestarteter Worker erbt sonst die in diesem Moment offenen Client-Verbindungen
+# und hält sie offen, nachdem der Dienst sie geschlossen hat.
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import math
+import multiprocessing
+import sys
+
+import trepro_metrics as metrics
+from trepro_batch import ZERO_RATE_ERROR, validate_parameters
+from trepro_core import (
+    calculate_dose_from_infusion_rate,
+    calculate_infusion_rate,
+    calculate_perfusor_rate,
+    calculate_reservoir_duration,
+    capacity_value,
+    concentration_value,
+    describe_event,
+    generate_summary,
+    simulate_dose_increase,
+)
+
+# Maximale Größe eines Anfragekörpers in Bytes
+MAX_BODY_BYTES = 8 * 1024 * 1024
+
+# Obergrenzen für ein Protokoll: /protocol wird direkt in der Ereignisschleife
+# berechnet und soll andere Anfragen (auch /health) nur kurz aufhalten
+MAX_WEEKS = 260
+MAX_INCREASES_PER_WEEK = 14
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+
+# Fehler mit HTTP-Status, der als JSON {"error": ...} beantwortet wird
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+    # Auch aus dem Worker-Prozess übertragbar (pickle verwendet sonst nur args)
+    def __reduce__(self):
+        return HttpError, (self.status, self.message)
+
+
+# Funktion zum Lesen eines endlichen Zahlenwerts aus der Anfrage (Zahl oder Zahl als Text, kein true/false)
+def _number(payload, name):
+    try:
+        value = payload[name]
+    except KeyError:
+        raise HttpError(422, f"Feld '{name}' fehlt.")
+    if isinstance(value, bool):
+        raise HttpError(422, f"Feld '{name}' muss eine Zahl sein.")
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise HttpError(422, f"Feld '{name}' muss eine Zahl sein.")
+    except OverflowError:  # Ganze Zahl jenseits des float-Bereichs
+        value = math.inf
+    if not math.isfinite(value):
+        raise HttpError(422, f"Feld '{name}' muss eine endliche Zahl sein.")
+    return value
+
+
+# Funktion zum Lesen eines positiven Zahlenwerts aus der Anfrage
+def _positive(payload, name):
+    value = _number(payload, name)
+    if not value > 0:
+        raise HttpError(422, f"Feld '{name}' muss größer als 0 sein.")
+    return value
+
+
+# Funktion zum Lesen einer ganzen Zahl aus der Anfrage (2.0 ja, 2.9 nein)
+def _integer(payload, name):
+    value = _number(payload, name)
+    if not value.is_integer():
+        raise HttpError(422, f"Feld '{name}' muss eine ganze Zahl sein.")
+    return int(value)
+
+
+# Funktion zum Lesen des optionalen Startdatums (Text im Format JJJJ-MM-TT)
+def _start_date(payload):
+    value = payload.get("start_date")
+    if value is None:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HttpError(422, "Feld 'start_date' muss ein Datum im Format JJJJ-MM-TT sein.")
+
+
+# Funktion zur Umwandlung eines Protokolls in JSON-Zeilen
+def _protocol_rows(protocol):
+    return [{
+        "date": step.date.isoformat(),
+        "dose": step.dose,
+        "infusion_rate": step.infusion_rate,
+        "reservoir_volume": step.reservoir_volume,
+        "event": step.event,
+        "concentration": step.concentration,
+        "hint": describe_event(step.event, step.concentration),
+    } for step in protocol]
+
+
+# Funktion zum Prüfen und Umwandeln der Protokollparameter
+#
+# Strenger als trepro_batch.patient_parameters: ganze Zahlen für Dauer und
+# Steigerungen, keine Wahrheitswerte als Zahl und ein Startdatum nur als Text.
+def _protocol_parameters(payload):
+    params = {
+        "current_dose": _number(payload, "current_dose"),
+        "target_dose": _number(payload, "target_dose"),
+        "weeks": _integer(payload, "weeks"),
+        "increases_per_week": _integer(payload, "increases_per_week"),
+        "weight": _number(payload, "weight"),
+        "concentration": concentration_value(_number(payload, "concentration")),
+        "start_date": _start_date(payload),
+    }
+    for optional in ("pump_capacity", "vial_capacity"):
+        if payload.get(optional) is not None:
+            params[optional] = capacity_value(_number(payload, optional))
+    if params["weeks"] > MAX_WEEKS:
+        raise HttpError(422, f"Feld 'weeks' darf höchstens {MAX_WEEKS} sein.")
+    if params["increases_per_week"] > MAX_INCREASES_PER_WEEK:
+        raise HttpError(422, f"Feld 'increases_per_week' darf höchstens {MAX_INCREASES_PER_WEEK} sein.")
+    error = validate_parameters(params)
+    if error:
+        raise HttpError(422, error)
+    return params
+
+
+def handle_infusion_rate(payload):
+    infusion_rate = calculate_infusion_rate(_positive(payload, "weight"), _positive(payload, "dose"),
+                                            _positive(payload, "concentration"))
+    return {"infusion_rate": infusion_rate, "reservoir_duration_days": calculate_reservoir_duration(infusion_rate)}
+
+
+def handle_dose(payload):
+    return {"dose": calculate_dose_from_infusion_rate(_positive(payload, "weight"),
+                                                      _positive(payload, "infusion_rate"),
+                                                      _positive(payload, "concentration"))}
+
+
+def handle_perfusor_rate(payload):
+    return {"perfusor_rate": calculate_perfusor_rate(_positive(payload, "weight"), _positive(payload, "dose"),
+                                                     _positive(payload, "concentration"))}
+
+
+def handle_protocol(payload):
+    return _protocol_response(_protocol_parameters(payload))
+
+
+# Funktion zur Berechnung des Protokolls samt Zusammenfassung als JSON-Objekt
+def _protocol_response(params):
+    try:
+        protocol, vial_usage, reservoir_changes, reservoir_intervals = simulate_dose_increase(**params)
+    except ZeroDivisionError:  # Laufrate fällt nach einem Vialwechsel auf 0 µl/h
+        raise HttpError(422, ZERO_RATE_ERROR)
+    return {
+        "protocol": _protocol_rows(protocol),
+        "vial_usage": [{"concentration": conc, "vials": count} for conc, count in vial_usage.items()],
+        "reservoir_changes": reservoir_changes,
+        "reservoir_intervals": reservoir_intervals,
+        "summary": generate_summary(vial_usage, reservoir_changes, reservoir_intervals, params["weeks"]),
+    }
+
+
+# PDF-Erstellung (läuft im Worker-Prozess, jeder Worker hat seinen eigenen Zwischenspeicher)
+def render_protocol_pdf(params):
+    from trepro_cache import cached_protocol_result
+
+    try:
+        return cached_protocol_result(params["weight"], params["current_dose"], params["target_dose"],
+                                      params["weeks"], params["increases_per_week"], params["concentration"],
+                                      params.get("pump_capacity", 3), params.get("vial_capacity", 10),
+                                      params["start_date"] or datetime.date.today()).pdf
+    except ZeroDivisionError:
+        raise HttpError(422, ZERO_RATE_ERROR)
+
+
+# Stapelberechnung (läuft im Worker-Prozess); Fehler eines Patienten brechen den Stapel nicht ab
+def process_batch(patients, offset=0):
+    results = []
+    for index, row in enumerate(patients, start=offset + 1):
+        patient_id = str(row.get("patient_id") or index) if isinstance(row, dict) else str(index)
+        try:
+            if not isinstance(row, dict):
+                raise HttpError(422, "Patient muss ein JSON-Objekt sein.")
+            result = _protocol_response(_protocol_parameters(row))
+            result.update(patient_id=patient_id, error=None)
+        except HttpError as exc:
+            result = {"patient_id": patient_id, "error": exc.message}
+        except Exception as exc:
+            result = {"patient_id": patient_id, "error": f"{type(exc).__name__}: {exc}"}
+        results.append(result)
+    return results
+
+
+SYNC_ROUTES = {
+    "/infusion-rate": handle_infusion_rate,
+    "/dose": handle_dose,
+    "/perfusor-rate": handle_perfusor_rate,
+    "/protocol": handle_protocol,
+}
+
+# Alle bekannten Pfade; nur diese werden als Stufe der Zeitmessung verwendet
+ROUTES = frozenset((*SYNC_ROUTES, "/protocol/pdf", "/batch", "/health", "/metrics"))
+
+
+# Funktion zur Umwandlung einer Antwort in JSON (nur endliche Zahlen)
+def _json_body(data):
+    try:
+        return json.dumps(data, allow_nan=False).encode()
+    except ValueError:
+        raise HttpError(422, "Ergebnis ist keine endliche Zahl; die Eingaben sind zu groß oder zu klein.")
+
+
+# Funktion zum Lesen der Länge des Anfragekörpers
+def _content_length(headers):
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HttpError(400, "Ungültiger Content-Length-Header.")
+    if length < 0:
+        raise HttpError(400, "Ungültiger Content-Length-Header.")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, "Anfrage zu groß.")
+    return length
+
+
+# HTTP-Dienst auf Basis von asyncio
+class TreproService:
+    def __init__(self, workers=None, batch_chunk_size=50):
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
+        self.batch_chunk_size = batch_chunk_size
+
+    async def dispatch(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, "application/json", b'{"status": "ok"}'
+        if method == "GET" and path == "/metrics":
+            return 200, "text/plain; version=0.0.4", metrics.prometheus_text().encode()
+        if path not in ROUTES:
+            raise HttpError(404, f"Unbekannter Pfad {path}.")
+        if path in ("/health", "/metrics"):
+            raise HttpError(405, "Nur GET wird unterstützt.")
+        if method != "POST":
+            raise HttpError(405, "Nur POST wird unterstützt.")
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(400, "Ungültiges JSON.")
+        if not isinstance(payload, dict):
+            raise HttpError(400, "Es wird ein JSON-Objekt erwartet.")
+
+        loop = asyncio.get_running_loop()
+        if path == "/protocol/pdf":
+            params = _protocol_parameters(payload)
+            pdf = await loop.run_in_executor(self.executor, render_protocol_pdf, params)
+            return 200, "application/pdf", pdf
+        if path == "/batch":
+            patients = payload.get("patients")
+            if not isinstance(patients, list):
+                raise HttpError(422, "Feld 'patients' muss eine Liste sein.")
+            results = await asyncio.gather(*(
+                loop.run_in_executor(self.executor, process_batch, patients[start:start + self.batch_chunk_size],
+                                     start)
+                for start in range(0, len(patients), self.batch_chunk_size)))
+            data = {"results": [result for chunk in results for result in chunk]}
+        else:
+            data = SYNC_ROUTES[path](payload)
+        return 200, "application/json", _json_body(data)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                path = target.split("?", 1)[0]
+                with metrics.stage(f"http {path if path in ROUTES else 'unknown'}"):
+                    try:
+                        try:
+                            length = _content_length(headers)
+                        except HttpError:
+                            keep_alive = False  # Anfragekörper nicht gelesen, Verbindung nicht weiter nutzbar
+                            raise
+                        body = await reader.readexactly(length) if length else b""
+                        status, content_type, payload = await self.dispatch(method, path, body)
+                    except HttpError as exc:
+                        status, content_type = exc.status, "application/json"
+                        payload = json.dumps({"error": exc.message}).encode()
+                    except Exception as exc:  # Unerwartete Fehler als 500 beantworten
+                        status, content_type = 500, "application/json"
+                        payload = json.dumps({"error": f"{type(exc).__name__}: {exc}"}).encode()
+
+                writer.write((f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                              f"Content-Type: {content_type}\r\n"
+                              f"Content-Length: {len(payload)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin1"))
+                writer.write(payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Treprostinil-Dienst läuft auf http://{host}:{port}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON-HTTP-Dienst des Treprostinil Dosisrechners")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="Worker-Prozesse für PDF und Stapel")
+    args = parser.parse_args(argv)
+
+    service = TreproService(args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
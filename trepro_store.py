@@ -0,0 +1,155 @@
+# Dauerhafte Ablage der Dosissteigerungsprotokolle in SQLite
+#
+# Je Patient wird das zuletzt gespeicherte Protokoll gehalten (Tabelle
+# protocols, eindeutiger Index auf patient_id); die Schritte stehen in
+# protocol_steps mit Datum (Ordinalzahl wie in Protocol.date_ordinals), Dosis,
+# Laufrate, Restvolumen, Ereigniscode und Konzentration. Der Index auf
+# (event, date) beantwortet Fragen wie "alle Vialwechsel der nächsten 7 Tage
+# auf der Station" über einen Bereichszugriff; er enthält auch Dosis, Laufrate
+# und Konzentration, sodass die Schritttabelle dabei nicht gelesen wird.
+#
+# Gespeichert wird immer in einer einzigen Transaktion je Aufruf, auch wenn
+# viele Patienten auf einmal gespeichert werden (save_many).
+#
+# Pfad der Datenbank: Umgebungsvariable TREPRO_STORE_PATH, sonst
+# trepro_protocols.sqlite3 im aktuellen Verzeichnis.
+import collections
+import datetime
+import os
+import sqlite3
+
+from trepro_core import EVENT_RESERVOIR_REFILL, EVENT_VIAL_CHANGE, Protocol, capacity_value, concentration_value
+
+DEFAULT_PATH = os.environ.get("TREPRO_STORE_PATH", "trepro_protocols.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS protocols (
+    id INTEGER PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    created TEXT NOT NULL,
+    pump_capacity REAL NOT NULL,
+    initial_concentration REAL,
+    summary TEXT NOT NULL DEFAULT ''
+);
+CREATE UNIQUE INDEX IF NOT EXISTS protocols_patient ON protocols (patient_id);
+CREATE TABLE IF NOT EXISTS protocol_steps (
+    protocol_id INTEGER NOT NULL REFERENCES protocols (id) ON DELETE CASCADE,
+    step INTEGER NOT NULL,
+    date INTEGER NOT NULL,
+    dose REAL NOT NULL,
+    infusion_rate INTEGER NOT NULL,
+    reservoir_volume REAL NOT NULL,
+    event INTEGER NOT NULL,
+    concentration REAL NOT NULL,
+    PRIMARY KEY (protocol_id, step)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS protocol_steps_event_date ON protocol_steps (event, date, dose, infusion_rate, concentration);
+"""
+
+# Ein anstehendes Ereignis eines Patienten
+UpcomingEvent = collections.namedtuple("UpcomingEvent", [
+    "patient_id", "date", "event", "dose", "infusion_rate", "concentration"])
+
+# Ein gespeicherter Patient mit Zeitraum seines Protokolls
+StoredPatient = collections.namedtuple("StoredPatient", [
+    "patient_id", "created", "first_date", "last_date", "steps", "summary"])
+
+
+class ProtocolStore:
+    def __init__(self, path=DEFAULT_PATH):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        if path != ":memory:":
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    # Funktion zum Schreiben eines Protokolls (ersetzt ein vorhandenes Protokoll des Patienten)
+    def _insert(self, patient_id, protocol, summary, created):
+        cursor = self.connection.cursor()
+        cursor.execute("DELETE FROM protocols WHERE patient_id = ?", (patient_id,))
+        cursor.execute(
+            "INSERT INTO protocols (patient_id, created, pump_capacity, initial_concentration, summary) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (patient_id, created, protocol.pump_capacity, protocol.initial_concentration, summary))
+        protocol_id = cursor.lastrowid
+        cursor.executemany(
+            "INSERT INTO protocol_steps (protocol_id, step, date, dose, infusion_rate, reservoir_volume, event, "
+            "concentration) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            zip([protocol_id] * len(protocol), range(len(protocol)), protocol.date_ordinals, protocol.doses,
+                protocol.infusion_rates, protocol.reservoir_volumes, protocol.events, protocol.concentrations))
+        return protocol_id
+
+    def save_protocol(self, patient_id, protocol, summary=""):
+        created = datetime.datetime.now().isoformat(timespec="seconds")
+        with self.connection:
+            return self._insert(str(patient_id), protocol, summary, created)
+
+    # Funktion zum Speichern vieler Patienten in einer Transaktion: entries liefert (patient_id, protocol, summary)
+    def save_many(self, entries):
+        created = datetime.datetime.now().isoformat(timespec="seconds")
+        count = 0
+        with self.connection:
+            for patient_id, protocol, summary in entries:
+                self._insert(str(patient_id), protocol, summary, created)
+                count += 1
+        return count
+
+    def load_protocol(self, patient_id):
+        header = self.connection.execute(
+            "SELECT id, pump_capacity, initial_concentration FROM protocols WHERE patient_id = ?",
+            (str(patient_id),)).fetchone()
+        if header is None:
+            return None
+        protocol_id, pump_capacity, initial_concentration = header
+        protocol = Protocol(capacity_value(pump_capacity), concentration_value(initial_concentration))
+        for date, dose, infusion_rate, reservoir_volume, event, concentration in self.connection.execute(
+                "SELECT date, dose, infusion_rate, reservoir_volume, event, concentration FROM protocol_steps "
+                "WHERE protocol_id = ? ORDER BY step", (protocol_id,)):
+            protocol.date_ordinals.append(date)
+            protocol.doses.append(dose)
+            protocol.infusion_rates.append(infusion_rate)
+            protocol.reservoir_volumes.append(reservoir_volume)
+            protocol.events.append(event)
+            protocol.concentrations.append(concentration)
+        return protocol
+
+    def delete_patient(self, patient_id):
+        with self.connection:
+            return self.connection.execute("DELETE FROM protocols WHERE patient_id = ?",
+                                           (str(patient_id),)).rowcount
+
+    def patients(self):
+        rows = self.connection.execute(
+            "SELECT p.patient_id, p.created, MIN(s.date), MAX(s.date), COUNT(s.step), p.summary "
+            "FROM protocols p LEFT JOIN protocol_steps s ON s.protocol_id = p.id "
+            "GROUP BY p.id ORDER BY p.patient_id")
+        return [StoredPatient(patient_id, created,
+                              datetime.date.fromordinal(first) if first else None,
+                              datetime.date.fromordinal(last) if last else None, steps, summary)
+                for patient_id, created, first, last, steps, summary in rows]
+
+    # Funktion zur Abfrage der Ereignisse aller Patienten im Zeitraum [start, start + days)
+    def upcoming_events(self, start=None, days=7, events=(EVENT_RESERVOIR_REFILL, EVENT_VIAL_CHANGE)):
+        start = (start or datetime.date.today()).toordinal()
+        events = tuple(events)
+        placeholders = ", ".join("?" * len(events))
+        rows = self.connection.execute(
+            "SELECT p.patient_id, s.date, s.event, s.dose, s.infusion_rate, s.concentration "
+            "FROM protocol_steps s JOIN protocols p ON p.id = s.protocol_id "
+            f"WHERE s.event IN ({placeholders}) AND s.date >= ? AND s.date < ? "
+            "ORDER BY s.date, p.patient_id",
+            (*events, start, start + days))
+        return [UpcomingEvent(patient_id, datetime.date.fromordinal(date), event, dose, infusion_rate,
+                              concentration_value(concentration))
+                for patient_id, date, event, dose, infusion_rate, concentration in rows]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
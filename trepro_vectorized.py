@@ -0,0 +1,73 @@
+# Vektorisierte Umrechnungen für ganze Patientenlisten
+#
+# Die Funktionen entsprechen den skalaren Varianten aus trepro_core, nehmen aber
+# NumPy-Arrays, pandas-Spalten oder Skalare entgegen und rechnen alle Zeilen in
+# einem Durchgang. Die Rechenschritte stehen in derselben Reihenfolge wie im
+# Rechenkern, damit die Ergebnisse bitgenau übereinstimmen.
+#
+# Statt einer Fehlermeldung wie in der App (Gewicht und Dosis müssen größer als
+# 0 sein) werden ungültige Zeilen über eine Maske auf NaN gesetzt.
+import numpy as np
+
+
+# Funktion zur Umwandlung der Eingaben in gleich lange float-Arrays
+def _as_float_arrays(*values):
+    return np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in values))
+
+
+# Funktion zur Ermittlung der gültigen Zeilen (alle Werte größer als 0)
+def valid_mask(*values):
+    arrays = _as_float_arrays(*values)
+    mask = np.ones(arrays[0].shape, dtype=bool)
+    for array in arrays:
+        mask &= array > 0  # NaN ist nie größer als 0 und fällt damit ebenfalls heraus
+    return mask
+
+
+# Funktion zum Ausblenden ungültiger Zeilen
+def _apply_mask(result, mask):
+    return np.where(mask, result, np.nan)
+
+
+# Funktion zur Berechnung der Laufrate in µl/h
+def calculate_infusion_rates(weight, dose, concentration):
+    weight, dose, concentration = _as_float_arrays(weight, dose, concentration)
+    mask = valid_mask(weight, dose, concentration)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dose_mcg_per_min = dose * weight / 1000  # ng/kg/min in µg/min umrechnen
+        dose_mg_per_h = dose_mcg_per_min * 60 / 1000  # µg/min in mg/h umrechnen
+        infusion_rate = dose_mg_per_h / concentration * 1000  # mg/h in µl/h umrechnen
+    return _apply_mask(infusion_rate, mask)
+
+
+# Funktion zur Berechnung der Haltbarkeit des Reservoirs in Tagen
+def calculate_reservoir_durations(infusion_rate, reservoir_volume=3):
+    infusion_rate, reservoir_volume = _as_float_arrays(infusion_rate, reservoir_volume)
+    mask = valid_mask(infusion_rate, reservoir_volume)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reservoir_duration_hours = (reservoir_volume * 1000) / infusion_rate  # Reservoirvolumen in µl
+        reservoir_duration_days = reservoir_duration_hours / 24  # in Tagen umrechnen
+    return _apply_mask(reservoir_duration_days, mask)
+
+
+# Funktion zur Berechnung der Dosis in ng/kg/min basierend auf der Laufrate
+def calculate_doses_from_infusion_rates(weight, infusion_rate, concentration):
+    weight, infusion_rate, concentration = _as_float_arrays(weight, infusion_rate, concentration)
+    mask = valid_mask(weight, infusion_rate, concentration)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dose_mg_per_h = infusion_rate * concentration / 1000  # µl/h in mg/h umrechnen
+        dose_mcg_per_min = dose_mg_per_h * 1000 / 60  # mg/h in µg/min umrechnen
+        dose_ng_per_kg_min = dose_mcg_per_min / weight * 1000  # µg/min in ng/kg/min umrechnen
+    return _apply_mask(dose_ng_per_kg_min, mask)
+
+
+# Funktion zur Berechnung der Perfusor-Laufrate in ml/h
+def calculate_perfusor_rates(weight, dose, concentration):
+    weight, dose, concentration = _as_float_arrays(weight, dose, concentration)
+    mask = valid_mask(weight, dose, concentration)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diluted_concentration = concentration / 50  # Konzentration des verdünnten Medikaments
+        dose_mcg_per_min = dose * weight / 1000  # ng/kg/min in µg/min umrechnen
+        dose_mg_per_h = dose_mcg_per_min * 60 / 1000  # µg/min in mg/h umrechnen
+        perfusor_rate = dose_mg_per_h / diluted_concentration  # mg/h in ml/h umrechnen
+    return _apply_mask(perfusor_rate, mask)